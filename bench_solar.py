@@ -0,0 +1,481 @@
+# bench_solar.py
+# Benchmark + regresión de precisión del motor solar (ubicacion_y_sol).
+#
+# - Tiempo: µs por usuario-día de cada motor (barrido minuto a minuto, solver
+#   analítico, SolarDay con los modelos legacy/fast/precise, rango de días y lote NumPy).
+# - Precisión: desviación máxima (min) de cada motor frente a una referencia de
+#   alta precisión propia del bench (Meeus: posición aparente con nutación y aberración,
+#   tiempo sidéreo, paralaje y refracción de Sæmundsson; cruces por bisección al segundo),
+#   sin compartir código con los modelos que mide (tampoco con "precise", que es NOAA),
+#   y diferencia frente al barrido original (debe ser 0 en el solver analítico y el lote).
+# - Equivalencia lote NumPy / cálculo escalar con zonas lejos de su longitud solar
+#   (tramos junto a la medianoche local).
+#
+# Uso:
+#   python bench_solar.py            (rejilla completa)
+#   python bench_solar.py --rapido   (menos latitudes, para CI / antes de desplegar)
+#   python bench_solar.py > bench_output.txt
+# Sale con código 1 si se pasa algún umbral (REGRESION_MAX_S, TOLERANCIA_MIN).
+
+from __future__ import annotations
+
+import argparse
+import math
+import random
+import time
+import datetime as dt
+from typing import Callable, Dict, List, Optional, Tuple
+
+import pytz
+
+import zonas_horarias as zonas
+from ubicacion_y_sol import (
+    SolarDay,
+    _declinacion_solar,
+    _elevacion_solar_deg,
+    _interp_time,
+    _partir_en_mediodia,
+    _solar_hour_angle,
+    calcular_dia_solar,
+    calcular_intervalos_30_40,
+    calcular_mediodia_solar,
+    calcular_ventanas_lote,
+    iterar_dias_solares,
+    minutos_a_datetime,
+)
+
+# ----------------------------
+# Rejilla fija
+# ----------------------------
+# (zona, longitud representativa, días de cambio de hora 2024)
+ZONAS = [
+    ("UTC", 0.0, []),
+    ("Europe/Madrid", -3.70, [dt.date(2024, 3, 31), dt.date(2024, 10, 27)]),
+    ("America/New_York", -74.0, [dt.date(2024, 3, 10), dt.date(2024, 11, 3)]),
+    ("Asia/Kolkata", 77.2, []),
+    ("Australia/Sydney", 151.2, [dt.date(2024, 4, 7), dt.date(2024, 10, 6)]),
+    ("Atlantic/Reykjavik", -21.9, []),
+]
+LATITUDES = [0.0, 10.0, 23.4, 30.0, 36.7, 40.4, 45.0, 50.0, 55.0, 60.0, 64.0, 66.5, 70.0, 75.0, 80.0]
+LATITUDES_RAPIDO = [0.0, 36.7, 50.0, 60.0, 70.0]
+FECHAS = [
+    dt.date(2024, 3, 20),   # equinoccio
+    dt.date(2024, 6, 20),   # solsticio
+    dt.date(2024, 9, 22),   # equinoccio
+    dt.date(2024, 12, 21),  # solsticio
+    dt.date(2024, 2, 10),
+    dt.date(2024, 8, 5),
+]
+
+# días en que la altura máxima queda a menos de esto de 30° o 40° se cuentan aparte
+ROCE_DEG = 0.5
+
+# umbrales (el bench sale con código 1 si se pasan)
+# - legacy (analítico, SolarDay, lote NumPy) frente al barrido original, en segundos
+REGRESION_MAX_S = 1.0
+# - fast / precise frente a la referencia, en minutos (sin contar los días "rozando")
+TOLERANCIA_MIN = {"SolarDay fast": 1.0, "SolarDay precise": 0.25}
+
+Caso = Tuple[float, float, dt.date, str]
+Resultado = Tuple[Tuple[Optional[tuple], Optional[tuple]], dt.datetime, float]
+
+
+def _casos(latitudes: List[float]) -> List[Caso]:
+    casos: List[Caso] = []
+    for tzname, lon, cambios in ZONAS:
+        for lat in latitudes:
+            for signo in (1.0, -1.0):
+                if lat == 0.0 and signo < 0:
+                    continue
+                for fecha in FECHAS + cambios:
+                    casos.append((signo * lat, lon, fecha, tzname))
+    return casos
+
+
+def _casos_desfase(n: int) -> List[Caso]:
+    """Coordenadas al azar con cualquier zona de la rejilla: la zona no cuadra con la longitud."""
+    rnd = random.Random(2024)
+    casos: List[Caso] = []
+    for _ in range(n):
+        tzname = rnd.choice(ZONAS)[0]
+        fecha = dt.date(2024, 1, 1) + dt.timedelta(days=rnd.randrange(366))
+        casos.append((rnd.uniform(-70.0, 70.0), rnd.uniform(-180.0, 180.0), fecha, tzname))
+    return casos
+
+
+# ----------------------------
+# Referencia de alta precisión (Meeus, independiente de ubicacion_y_sol)
+# ----------------------------
+# ΔT = TT - UT (s) en 2024
+DELTA_T = 69.0
+
+
+def _elevacion_ref(lat: float, lon: float, t_utc: dt.datetime) -> float:
+    """
+    Elevación aparente del centro del sol. Meeus, Astronomical Algorithms, cap. 12
+    (tiempo sidéreo), 22 (nutación abreviada) y 25; refracción de Sæmundsson.
+    """
+    jd = t_utc.timestamp() / 86400.0 + 2440587.5
+    T = (jd + DELTA_T / 86400.0 - 2451545.0) / 36525.0
+
+    L0 = 280.46646 + T * (36000.76983 + T * 0.0003032)
+    M = 357.52911 + T * (35999.05029 - T * 0.0001537)
+    e = 0.016708634 - T * (0.000042037 + T * 0.0000001267)
+    Mr = math.radians(M)
+    C = ((1.914602 - T * (0.004817 + T * 0.000014)) * math.sin(Mr)
+         + (0.019993 - T * 0.000101) * math.sin(2 * Mr) + 0.000289 * math.sin(3 * Mr))
+    v = math.radians(M + C)
+    R = 1.000001018 * (1 - e * e) / (1 + e * math.cos(v))
+
+    # nutación y oblicuidad verdadera
+    om = math.radians(125.04452 - 1934.136261 * T)
+    Ls = math.radians(280.4665 + 36000.7698 * T)
+    Lm = math.radians(218.3165 + 481267.8813 * T)
+    dpsi = (-17.20 * math.sin(om) - 1.32 * math.sin(2 * Ls) - 0.23 * math.sin(2 * Lm) + 0.21 * math.sin(2 * om)) / 3600.0
+    deps = (9.20 * math.cos(om) + 0.57 * math.cos(2 * Ls) + 0.10 * math.cos(2 * Lm) - 0.09 * math.cos(2 * om)) / 3600.0
+    eps0 = 23.0 + 26.0 / 60.0 + (21.448 - T * (46.8150 + T * (0.00059 - T * 0.001813))) / 3600.0
+    eps = math.radians(eps0 + deps)
+
+    # longitud aparente (nutación + aberración) -> ascensión recta y declinación
+    lam = math.radians(L0 + C + dpsi - 20.4898 / 3600.0 / R)
+    ra = math.atan2(math.cos(eps) * math.sin(lam), math.cos(lam))
+    dec = math.asin(math.sin(eps) * math.sin(lam))
+
+    # tiempo sidéreo aparente de Greenwich (UT) y ángulo horario local
+    d = jd - 2451545.0
+    Tu = d / 36525.0
+    gmst = 280.46061837 + 360.98564736629 * d + Tu * Tu * (0.000387933 - Tu / 38710000.0)
+    H = math.radians(gmst + dpsi * math.cos(eps) + lon) - ra
+
+    latr = math.radians(lat)
+    alt = math.degrees(math.asin(math.sin(latr) * math.sin(dec) + math.cos(latr) * math.cos(dec) * math.cos(H)))
+    alt -= 8.794 / 3600.0 * math.cos(math.radians(alt))  # paralaje
+    # Sæmundsson (minutos de arco, a partir de la altura verdadera)
+    return alt + 1.02 / math.tan(math.radians(alt + 10.3 / (alt + 5.11))) / 60.0
+
+
+def referencia(lat: float, lon: float, fecha: dt.date, tzname: str) -> Resultado:
+    """Tramos 30–40° (misma partición a las 12:00), mediodía y altura máx. de referencia."""
+    base = zonas.localizar(tzname, dt.datetime(fecha.year, fecha.month, fecha.day, 0, 0))
+    base_utc = base.astimezone(dt.timezone.utc)
+
+    def elev(m: float) -> float:
+        return _elevacion_ref(lat, lon, base_utc + dt.timedelta(minutes=m))
+
+    def biseccion(a: float, b: float, target: float) -> float:
+        ea = elev(a) - target
+        for _ in range(30):  # 1 min / 2^30: muy por debajo del segundo
+            mid = (a + b) / 2.0
+            em = elev(mid) - target
+            if (em >= 0) == (ea >= 0):
+                a, ea = mid, em
+            else:
+                b = mid
+        return (a + b) / 2.0
+
+    minutos = list(range(0, 24 * 60))
+    elevs = [elev(m) for m in minutos]
+
+    tramos = []
+    ini = None
+    for i in range(1, len(minutos)):
+        e0, e1 = elevs[i - 1], elevs[i]
+        in0, in1 = 30.0 <= e0 <= 40.0, 30.0 <= e1 <= 40.0
+        if not in0 and in1:
+            ini = biseccion(i - 1, i, 30.0 if e0 < 30.0 else 40.0)
+        elif in0 and not in1 and ini is not None:
+            fin = biseccion(i - 1, i, 30.0 if e1 < 30.0 else 40.0)
+            tramos.append((base + dt.timedelta(minutes=ini), base + dt.timedelta(minutes=fin)))
+            ini = None
+    if ini is not None:
+        tramos.append((base + dt.timedelta(minutes=ini), base + dt.timedelta(minutes=minutos[-1])))
+
+    # mediodía: búsqueda ternaria alrededor del máximo de la rejilla
+    k = max(range(len(elevs)), key=elevs.__getitem__)
+    a, b = k - 1.0, k + 1.0
+    for _ in range(40):
+        m1, m2 = a + (b - a) / 3.0, b - (b - a) / 3.0
+        if elev(m1) < elev(m2):
+            a = m1
+        else:
+            b = m2
+    m_noon = (a + b) / 2.0
+
+    mediodia = zonas.localizar(tzname, dt.datetime(fecha.year, fecha.month, fecha.day, 12, 0))
+    return _partir_en_mediodia(tramos, mediodia), base + dt.timedelta(minutes=m_noon), elev(m_noon)
+
+
+# ----------------------------
+# Barrido original minuto a minuto (referencia de regresión del modelo legacy)
+# ----------------------------
+def _calcular_intervalos_30_40_barrido(
+    lat: float,
+    lon: float,
+    fecha: dt.date,
+    tzname: str,
+    paso_min: int = 1,
+) -> Tuple[Optional[Tuple[dt.datetime, dt.datetime]], Optional[Tuple[dt.datetime, dt.datetime]]]:
+    tz = pytz.timezone(tzname)
+    n = fecha.timetuple().tm_yday
+    decl = _declinacion_solar(n)
+
+    base = tz.localize(dt.datetime(fecha.year, fecha.month, fecha.day, 0, 0))
+    puntos: List[Tuple[dt.datetime, float]] = []
+
+    for m in range(0, 24 * 60, paso_min):
+        t = base + dt.timedelta(minutes=m)
+        h_angle = _solar_hour_angle(t, lon, tzname, n)
+        elev = _elevacion_solar_deg(lat, decl, h_angle)
+        puntos.append((t, elev))
+
+    def in_band(e: float) -> bool:
+        return 30.0 <= e <= 40.0
+
+    tramos: List[Tuple[dt.datetime, dt.datetime]] = []
+    en = False
+    ini: Optional[dt.datetime] = None
+
+    for i in range(1, len(puntos)):
+        t_prev, e_prev = puntos[i - 1]
+        t, e = puntos[i]
+
+        prev_in = in_band(e_prev)
+        curr_in = in_band(e)
+
+        if (not prev_in) and curr_in:
+            ini = _interp_time(t_prev, e_prev, t, e, 30.0)
+            en = True
+
+        elif prev_in and (not curr_in) and en and ini is not None:
+            target = 30.0 if e < 30.0 else 40.0
+            fin = _interp_time(t_prev, e_prev, t, e, target)
+            tramos.append((ini, fin))
+            en = False
+            ini = None
+
+    if en and ini is not None:
+        tramos.append((ini, puntos[-1][0]))
+
+    mediodia = tz.localize(dt.datetime(fecha.year, fecha.month, fecha.day, 12, 0))
+    return _partir_en_mediodia(tramos, mediodia)
+
+
+def _calcular_mediodia_solar_barrido(
+    lat: float,
+    lon: float,
+    fecha: dt.date,
+    tzname: str,
+    paso_min: int = 1,
+) -> Tuple[dt.datetime, float]:
+    tz = pytz.timezone(tzname)
+    n = fecha.timetuple().tm_yday
+    decl = _declinacion_solar(n)
+    base = tz.localize(dt.datetime(fecha.year, fecha.month, fecha.day, 0, 0))
+
+    best_t = base
+    best_e = -999.0
+
+    for m in range(0, 24 * 60, paso_min):
+        t = base + dt.timedelta(minutes=m)
+        h_angle = _solar_hour_angle(t, lon, tzname, n)
+        elev = _elevacion_solar_deg(lat, decl, h_angle)
+        if elev > best_e:
+            best_e = elev
+            best_t = t
+
+    return best_t, float(best_e)
+
+
+# ----------------------------
+# Motores a comparar
+# ----------------------------
+def _motor_barrido(lat, lon, fecha, tzname) -> Resultado:
+    t_noon, e_max = _calcular_mediodia_solar_barrido(lat, lon, fecha, tzname)
+    return _calcular_intervalos_30_40_barrido(lat, lon, fecha, tzname), t_noon, e_max
+
+
+def _motor_analitico(lat, lon, fecha, tzname) -> Resultado:
+    t_noon, e_max = calcular_mediodia_solar(lat, lon, fecha, tzname, modelo="legacy")
+    return calcular_intervalos_30_40(lat, lon, fecha, tzname, modelo="legacy"), t_noon, e_max
+
+
+def _motor_solarday(modelo: str) -> Callable[..., Resultado]:
+    def motor(lat, lon, fecha, tzname) -> Resultado:
+        d: SolarDay = calcular_dia_solar(lat, lon, fecha, tzname, modelo=modelo)
+        return d.intervalos, d.mediodia, d.elev_max
+    return motor
+
+
+MOTORES: Dict[str, Callable[..., Resultado]] = {
+    "barrido (original)": _motor_barrido,
+    "analitico": _motor_analitico,
+    "SolarDay": _motor_solarday("legacy"),
+    "SolarDay fast": _motor_solarday("fast"),
+    "SolarDay precise": _motor_solarday("precise"),
+}
+# motores que deben reproducir el barrido original al segundo
+LEGACY = ("analitico", "SolarDay")
+
+
+def _resultados_lote(casos: List[Caso]) -> List[Resultado]:
+    out: List[Resultado] = []
+    for lat, lon, fecha, tzname in casos:
+        r = calcular_ventanas_lote([lat], [lon], [tzname], fecha)
+
+        def tramo(a: str, b: str):
+            ta = minutos_a_datetime(fecha, tzname, float(r[a][0, 0]))
+            tb = minutos_a_datetime(fecha, tzname, float(r[b][0, 0]))
+            return (ta, tb) if ta and tb else None
+
+        out.append((
+            (tramo("manana_ini", "manana_fin"), tramo("tarde_ini", "tarde_fin")),
+            minutos_a_datetime(fecha, tzname, float(r["mediodia"][0, 0])),
+            float(r["elev_max"][0, 0]),
+        ))
+    return out
+
+
+# ----------------------------
+# Medidas
+# ----------------------------
+def _cruces(r: Resultado) -> List[dt.datetime]:
+    # Extremos de los tramos sin la partición de las 12:00 (que no es un cruce real).
+    tramo_m, tramo_t = r[0]
+    if tramo_m and tramo_t and tramo_m[1] == tramo_t[0]:
+        return [tramo_m[0], tramo_t[1]]
+    return [t for tramo in (tramo_m, tramo_t) if tramo for t in tramo]
+
+
+def _desviacion(a: Resultado, b: Resultado) -> Tuple[float, int]:
+    """
+    (desviación máxima en minutos entre cruces y mediodía, 1 si uno de los dos
+    tiene un número distinto de cruces —p.ej. el sol roza 30° o 40°— y 0 si no).
+    """
+    peor = abs((a[1] - b[1]).total_seconds()) / 60.0
+    ca, cb = _cruces(a), _cruces(b)
+    if len(ca) != len(cb):
+        return peor, 1
+    for x, y in zip(ca, cb):
+        peor = max(peor, abs((x - y).total_seconds()) / 60.0)
+    return peor, 0
+
+
+def _cronometrar(fn: Callable[[], object], n_casos: int, repeticiones: int) -> float:
+    mejor = float("inf")
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        fn()
+        mejor = min(mejor, time.perf_counter() - t0)
+    return mejor / n_casos * 1e6
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark y precisión del motor solar")
+    ap.add_argument("--rapido", action="store_true", help="rejilla reducida de latitudes")
+    ap.add_argument("--repeticiones", type=int, default=3)
+    args = ap.parse_args()
+    fallos: List[str] = []
+
+    casos = _casos(LATITUDES_RAPIDO if args.rapido else LATITUDES)
+    print(f"🔧 {len(casos)} usuario-días ({len(ZONAS)} zonas, solsticios/equinoccios/cambios de hora)\n")
+
+    # --- tiempos ---
+    print("⏱  µs por usuario-día (mejor de %d)" % args.repeticiones)
+    tiempos = {}
+    for nombre, motor in MOTORES.items():
+        rep = 1 if nombre.startswith("barrido") else args.repeticiones
+        tiempos[nombre] = _cronometrar(lambda m=motor: [m(*c) for c in casos], len(casos), rep)
+
+    def _rango():
+        for lat, lon, fecha, tzname in casos[:: len(FECHAS)]:
+            list(iterar_dias_solares(lat, lon, fecha, fecha + dt.timedelta(days=179), tzname, modelo="legacy"))
+    tiempos["rango 180 días"] = _cronometrar(_rango, len(casos[:: len(FECHAS)]) * 180, 1)
+
+    lats = [c[0] for c in casos]
+    lons = [c[1] for c in casos]
+    tzs = [c[3] for c in casos]
+    tiempos["lote NumPy (×30 días)"] = _cronometrar(
+        lambda: calcular_ventanas_lote(lats, lons, tzs, FECHAS[0], FECHAS[0] + dt.timedelta(days=29)),
+        len(casos) * 30,
+        args.repeticiones,
+    )
+    for nombre, us in tiempos.items():
+        print(f"  {nombre:<24} {us:10.1f}")
+
+    # --- precisión ---
+    print("\n🎯 Desviación frente a la referencia (min) — máx. por |latitud|")
+    refs = [referencia(*c) for c in casos]
+    resultados = {nombre: [motor(*c) for c in casos] for nombre, motor in MOTORES.items()}
+    resultados["lote NumPy"] = _resultados_lote(casos)
+
+    cambios_hora = {(tzname, f) for tzname, _, cambios in ZONAS for f in cambios}
+    franjas = [(0.0, 30.0), (30.0, 50.0), (50.0, 60.0), (60.0, 90.1)]
+    cabecera = "".join(f"{f'{a:g}–{min(b, 90.0):g}°':>10}" for a, b in franjas)
+    print(f"  {'motor':<24}{cabecera}{'cambio h.':>11}{'rozando':>9}{'distintos':>11}")
+    for nombre, res in resultados.items():
+        peores = {f: 0.0 for f in franjas}
+        peor_cambio = 0.0
+        rozando = 0
+        distintos = 0
+        for (lat, _, fecha, tzname), r, ref in zip(casos, res, refs):
+            if any(abs(ref[2] - x) < ROCE_DEG for x in (30.0, 40.0)):
+                # el sol apenas pasa de 30°/40°: un error mínimo cambia qué tramos hay
+                rozando += 1
+                continue
+            d, n = _desviacion(r, ref)
+            distintos += n
+            if n:
+                continue
+            if (tzname, fecha) in cambios_hora:
+                peor_cambio = max(peor_cambio, d)
+                continue
+            for f in franjas:
+                if f[0] <= abs(lat) < f[1]:
+                    peores[f] = max(peores[f], d)
+        print(
+            f"  {nombre:<24}" + "".join(f"{peores[f]:10.2f}" for f in franjas)
+            + f"{peor_cambio:11.2f}{rozando:9d}{distintos:11d}"
+        )
+        tol = TOLERANCIA_MIN.get(nombre)
+        peor = max(max(peores.values()), peor_cambio)
+        if tol is not None and (peor > tol or distintos):
+            fallos.append(f"{nombre}: {peor:.2f} min frente a la referencia (máx {tol:g}), {distintos} distintos")
+
+    print("\n🔁 Regresión frente al barrido original (0 en analítico, SolarDay legacy y lote NumPy)")
+    base = resultados["barrido (original)"]
+    for nombre, res in resultados.items():
+        if nombre not in LEGACY + ("lote NumPy",):
+            continue
+        peor = 0.0
+        distintos = 0
+        for r, b in zip(res, base):
+            d, n = _desviacion(r, b)
+            peor = max(peor, d)
+            distintos += n
+        print(f"  {nombre:<24} máx {peor * 60:8.3f} s   tramos distintos: {distintos}")
+        if peor * 60 > REGRESION_MAX_S or distintos:
+            fallos.append(f"{nombre}: {peor * 60:.3f} s frente al barrido, {distintos} tramos distintos")
+
+    print("\n🔁 Lote NumPy frente al cálculo escalar, zona ≠ longitud solar (debe ser 0)")
+    desfase = _casos_desfase(200 if args.rapido else 2000)
+    peor = 0.0
+    distintos = 0
+    for r, b in zip(_resultados_lote(desfase), [_motor_analitico(*c) for c in desfase]):
+        d, n = _desviacion(r, b)
+        peor = max(peor, d)
+        distintos += n + (abs(r[2] - b[2]) > 1e-9)
+    print(f"  {len(desfase)} usuario-días        máx {peor * 60:8.3f} s   tramos distintos: {distintos}")
+    if peor * 60 > REGRESION_MAX_S or distintos:
+        fallos.append(f"lote NumPy (zona ≠ longitud): {peor * 60:.3f} s, {distintos} tramos distintos")
+
+    if fallos:
+        print("\n❌ Umbrales superados:")
+        for f in fallos:
+            print(f"  {f}")
+        return 1
+    print("\n✅ Dentro de umbrales")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -4,6 +4,7 @@
 
 import os
 import logging
+import asyncio
 import datetime as dt
 
 from telegram import Update
@@ -12,6 +13,8 @@ from telegram.ext import (
 )
 
 import usuarios_repo as repo
+import zonas_horarias as zonas
+from cache_geo import geocodificar_async
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 if not BOT_TOKEN:
@@ -30,7 +33,7 @@ HELP_TEXT = (
     "• /loctemp 24 — la próxima ubicación será *temporal* (ej. 24h)\n"
     "• /locreset — borra ubicación temporal y vuelve a la persistente\n"
     "• /city NombreCiudad — ciudad preferida si no usas GPS\n"
-    "• /setloc lat lon tz [Ciudad] — fija ubicación manual\n\n"
+    "• /setloc lat lon [tz] [Ciudad] — fija ubicación manual (sin tz, se deduce)\n\n"
     "🕘 Horarios:\n"
     "• /sethour HH — hora local de envío (0–23) (alias: /when)\n\n"
     "ℹ️ Estado:\n"
@@ -40,8 +43,11 @@ HELP_TEXT = (
 # ----------------- helpers -----------------
 
 def _guess_tz_from_coords(lat: float, lon: float) -> str:
-    # Si ya lo guardas por setloc, ok. Si no, dejamos por defecto.
-    return "Europe/Madrid"
+    # TimezoneFinder compartido + memo por celda H3 (ver zonas_horarias)
+    return zonas.zona_de_coords(lat, lon)
+
+def _is_tz(name: str) -> bool:
+    return zonas.normalizar_tz(name) == name and ("/" in name or name.upper() == "UTC")
 
 # ----------------- comandos -----------------
 
@@ -72,22 +78,35 @@ async def cmd_city(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Uso: /city NombreCiudad")
         return
     city = " ".join(context.args)
-    repo.set_city(chat_id, city)
-    await update.message.reply_text(f"✅ Ciudad actualizada a {city}")
+    # nomenclátor local al instante; si no está, geocoding (red, con caché) sin bloquear el loop;
+    # Postgres (pool) también fuera del loop
+    user = await asyncio.to_thread(repo.get_user, chat_id)
+    lang = user.get("lang") or "es"
+    res = await geocodificar_async(city, lang)
+    if res is None:
+        await asyncio.to_thread(repo.set_city, chat_id, city)
+        await update.message.reply_text(f"✅ Ciudad actualizada a {city} (no la encuentro: coordenadas sin cambios)")
+        return
+    # se guardan las coordenadas y la zona que ve el usuario (no se vuelve a resolver el nombre al enviar)
+    await asyncio.to_thread(repo.set_city_location, chat_id, res["ciudad"], res["latitud"], res["longitud"], res["timezone"])
+    await update.message.reply_text(
+        f"✅ Ciudad actualizada a {res['ciudad']} ({res['latitud']:.4f}, {res['longitud']:.4f}, {res['timezone']})"
+    )
 
 async def cmd_setloc(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = str(update.effective_chat.id)
-    if len(context.args) < 3:
-        await update.message.reply_text("Uso: /setloc lat lon tz [Ciudad]")
+    if len(context.args) < 2:
+        await update.message.reply_text("Uso: /setloc lat lon [tz] [Ciudad]")
         return
     lat = float(context.args[0])
     lon = float(context.args[1])
-    tz = context.args[2]
-    city = " ".join(context.args[3:]) if len(context.args) > 3 else None
-    repo.set_location(chat_id, lat, lon, tz, city)
+    rest = list(context.args[2:])
+    tz = rest.pop(0) if rest and _is_tz(rest[0]) else await asyncio.to_thread(_guess_tz_from_coords, lat, lon)
+    city = " ".join(rest) if rest else None
+    await asyncio.to_thread(repo.set_location, chat_id, lat, lon, tz, city)
     # si existiera modo temporal, lo apagamos al fijar manualmente:
     if hasattr(repo, "clear_temp_location"):
-        repo.clear_temp_location(chat_id)
+        await asyncio.to_thread(repo.clear_temp_location, chat_id)
     await update.message.reply_text(f"✅ Ubicación persistente actualizada: {lat}, {lon}, {tz} {('- ' + city) if city else ''}")
 
 async def cmd_sethour(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -116,7 +135,7 @@ async def cmd_where(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # si existe ubicación temporal en tu repo (cuando la implementemos)
     temp = None
     if "temp_lat" in user and user.get("temp_lat") is not None:
-        until = user.get("temp_until_iso")
+        until = user.get("temp_until")
         temp = f"{user.get('temp_lat')}, {user.get('temp_lon')} (hasta {until})"
 
     txt = (
@@ -168,7 +187,7 @@ async def cmd_locreset(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def on_location(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = str(update.effective_chat.id)
-    repo.ensure_user(chat_id)
+    await asyncio.to_thread(repo.ensure_user, chat_id)
 
     loc = update.message.location
     lat, lon = float(loc.latitude), float(loc.longitude)
@@ -177,27 +196,28 @@ async def on_location(update: Update, context: ContextTypes.DEFAULT_TYPE):
     hours = context.user_data.pop("loctemp_hours", None)
 
     if hours and hasattr(repo, "set_temp_location"):
-        tz = _guess_tz_from_coords(lat, lon)
+        tz = await asyncio.to_thread(_guess_tz_from_coords, lat, lon)
         until = dt.datetime.now(dt.timezone.utc) + dt.timedelta(hours=int(hours))
-        repo.set_temp_location(chat_id, lat, lon, tz, until)
-        await update.message.reply_text(f"✅ Ubicación temporal guardada {hours}h: {lat:.5f}, {lon:.5f}")
+        await asyncio.to_thread(repo.set_temp_location, chat_id, lat, lon, tz, until)
+        await update.message.reply_text(f"✅ Ubicación temporal guardada {hours}h: {lat:.5f}, {lon:.5f} ({tz})")
         return
 
     # Persistente
-    tz = _guess_tz_from_coords(lat, lon)
-    repo.set_location(chat_id, lat, lon, tz, None)
+    tz = await asyncio.to_thread(_guess_tz_from_coords, lat, lon)
+    await asyncio.to_thread(repo.set_location, chat_id, lat, lon, tz, None)
     # si existiera modo temporal, lo apagamos al actualizar persistente
     if hasattr(repo, "clear_temp_location"):
-        repo.clear_temp_location(chat_id)
+        await asyncio.to_thread(repo.clear_temp_location, chat_id)
 
-    await update.message.reply_text(f"✅ Ubicación persistente guardada: {lat:.5f}, {lon:.5f}")
+    await update.message.reply_text(f"✅ Ubicación persistente guardada: {lat:.5f}, {lon:.5f} ({tz})")
 
 # ----------------- main -----------------
 
 def main():
     repo.init_db()
-    if hasattr(repo, "migrate_fill_defaults"):
-        repo.migrate_fill_defaults()
+
+    # carga TimezoneFinder ya, para que la primera ubicación no espere
+    _guess_tz_from_coords(0.0, 0.0)
 
     app = Application.builder().token(BOT_TOKEN).build()
 
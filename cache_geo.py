@@ -0,0 +1,173 @@
+# cache_geo.py
+# Caché de geocoding por nombre de ciudad normalizado + idioma: repetir "/city Madrid"
+# no vuelve a llamar a la API. Memoria (LRU) + Postgres opcional (geo_repo).
+# Las búsquedas sin resultado también se guardan (caché negativa, TTL más corto).
+# Antes de todo se mira el nomenclátor local (nomenclator.py), que no necesita red,
+# solo por nombre exacto; prefijos y aproximados quedan para cuando la API no responde
+# (si responde que no la conoce, no se adivina).
+# geocodificar_async es la versión para el event loop del bot: la API va por el
+# cliente httpx compartido de meteo_async y Postgres en un hilo.
+#
+# Variables de entorno:
+#   GEO_CACHE_TTL     (opcional, 2592000) -> segundos que vale un resultado (30 días)
+#   GEO_CACHE_TTL_NEG (opcional, 86400)   -> segundos que vale un "no encontrado" (1 día)
+#   GEO_CACHE_MAX     (opcional, 4096)    -> entradas máximas en memoria
+#   GEO_CACHE_PG      (opcional)          -> "1" = persistir/compartir en la tabla geocode_cache
+
+from __future__ import annotations
+
+import os
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import meteo_async
+import nomenclator
+from nomenclator import normalizar_nombre
+from ubicacion_y_sol import _geocodificar
+
+CACHE_TTL = int(os.getenv("GEO_CACHE_TTL", str(30 * 86400)))
+CACHE_TTL_NEG = int(os.getenv("GEO_CACHE_TTL_NEG", "86400"))
+CACHE_MAX = int(os.getenv("GEO_CACHE_MAX", "4096"))
+CACHE_PG = (os.getenv("GEO_CACHE_PG") or "").strip() == "1"
+
+# (nombre normalizado, idioma) -> (instante en epoch, resultado o None)
+_lru: "OrderedDict[tuple, Tuple[float, Optional[dict]]]" = OrderedDict()
+_pg_listo = False
+
+
+def _pg():
+    """geo_repo (con la tabla creada) si GEO_CACHE_PG=1; si no, None."""
+    global _pg_listo
+    if not CACHE_PG:
+        return None
+    import geo_repo
+    if not _pg_listo:
+        geo_repo.init_geocode_cache()
+        _pg_listo = True
+    return geo_repo
+
+
+def _vigente(entrada: Tuple[float, Optional[dict]], ahora: float) -> bool:
+    ttl = CACHE_TTL if entrada[1] is not None else CACHE_TTL_NEG
+    return ahora - entrada[0] < ttl
+
+
+def _leer_pg(nombre: str, idioma: str) -> Optional[Tuple[float, Optional[dict]]]:
+    try:
+        repo = _pg()
+        if repo is None:
+            return None
+        row = repo.get_geocode_cache(nombre, idioma)
+    except Exception as e:
+        print(f"[WARN] geocode_cache lectura: {e}")
+        return None
+    if not row:
+        return None
+    found, lat, lon, city, tz, country, fetched_at = row
+    res = None
+    if found:
+        res = {"latitud": float(lat), "longitud": float(lon), "ciudad": city, "timezone": tz, "country": country}
+    return fetched_at.timestamp(), res
+
+
+def _guardar_pg(nombre: str, idioma: str, res: Optional[dict]) -> None:
+    try:
+        repo = _pg()
+        if repo is None:
+            return
+        repo.put_geocode_cache(nombre, idioma, res)
+    except Exception as e:
+        print(f"[WARN] geocode_cache escritura: {e}")
+
+
+def _guardar_lru(key: tuple, entrada: Tuple[float, Optional[dict]]) -> None:
+    _lru[key] = entrada
+    _lru.move_to_end(key)
+    while len(_lru) > CACHE_MAX:
+        _lru.popitem(last=False)
+
+
+def _local(ciudad: str) -> Optional[dict]:
+    # antes de la red solo el nombre exacto y sin homónimas: 'Santa' o 'San' no son una ciudad
+    c = nomenclator.exacta(ciudad)
+    return nomenclator.como_geocoding(c) if c is not None else None
+
+
+def _cacheada(key: tuple, ahora: float) -> Optional[Tuple[float, Optional[dict]]]:
+    """Entrada vigente de la memoria o de Postgres; None si hay que preguntar a la API."""
+    entrada = _lru.get(key)
+    if entrada is None or not _vigente(entrada, ahora):
+        entrada = _leer_pg(*key)
+        if entrada is None or not _vigente(entrada, ahora):
+            return None
+    return entrada
+
+
+def _resultado(key: tuple, entrada: Tuple[float, Optional[dict]]) -> Optional[dict]:
+    _guardar_lru(key, entrada)
+    return dict(entrada[1]) if entrada[1] is not None else None
+
+
+def geocodificar(ciudad: str, idioma: str = "es") -> Optional[dict]:
+    """
+    Como ubicacion_y_sol.geocodificar_ciudad, con caché por (nombre normalizado, idioma).
+    Primero el nomenclátor local (solo nombre exacto sin homónimas); si la API no la
+    conoce, None; si no responde, la mejor coincidencia del nomenclátor (prefijo o aproximada). Los fallos de red no se cachean.
+    Devuelve una copia: el llamador puede modificarla.
+    """
+    nombre = normalizar_nombre(ciudad)
+    if not nombre:
+        return None
+    local = _local(ciudad)
+    if local is not None:
+        return local
+    key = (nombre, idioma)
+    ahora = time.time()
+
+    entrada = _cacheada(key, ahora)
+    if entrada is None:
+        try:
+            res = _geocodificar(ciudad, idioma)
+        except Exception as e:
+            print(f"[WARN] geocoding '{ciudad}': {e}")
+            return _aproximada(ciudad)
+        entrada = (ahora, res)
+        _guardar_pg(nombre, idioma, res)
+    return _resultado(key, entrada)
+
+
+async def geocodificar_async(ciudad: str, idioma: str = "es") -> Optional[dict]:
+    """
+    Como geocodificar, sin bloquear el event loop: la API por el cliente httpx
+    compartido (meteo_async, con su circuit breaker) y la caché de Postgres en un hilo.
+    """
+    nombre = normalizar_nombre(ciudad)
+    if not nombre:
+        return None
+    local = _local(ciudad)
+    if local is not None:
+        return local
+    key = (nombre, idioma)
+    ahora = time.time()
+
+    entrada = await asyncio.to_thread(_cacheada, key, ahora)
+    if entrada is None:
+        try:
+            res = await meteo_async.geocodificar_async(ciudad, idioma)
+        except Exception as e:
+            print(f"[WARN] geocoding '{ciudad}': {e}")
+            return _aproximada(ciudad)
+        entrada = (ahora, res)
+        await asyncio.to_thread(_guardar_pg, nombre, idioma, res)
+    return _resultado(key, entrada)
+
+
+def _aproximada(ciudad: str) -> Optional[dict]:
+    c = nomenclator.resolver(ciudad)
+    return nomenclator.como_geocoding(c) if c is not None else None
+
+
+def limpiar_cache() -> None:
+    _lru.clear()
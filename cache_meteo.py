@@ -0,0 +1,234 @@
+# cache_meteo.py
+# Caché de pronósticos Open-Meteo por celda H3: usuarios cercanos comparten una única petición.
+# Clave: (celda H3, tz, fecha local). Memoria (LRU con TTL, ya parseado como HorasMeteo)
+# + Postgres opcional (meteo_repo, JSON crudo de Open-Meteo).
+#
+# Variables de entorno:
+#   METEO_H3_RES    (opcional, 5)    -> resolución H3 (5 ≈ 250 km², del orden de la rejilla de los modelos)
+#   METEO_CACHE_TTL (opcional, 3600) -> segundos que un pronóstico se da por bueno
+#   METEO_CACHE_MAX (opcional, 4096) -> entradas máximas en memoria
+#   METEO_CACHE_PG  (opcional)       -> "1" = persistir/compartir en la tabla meteo_cache
+#   METEO_ESPERA    (opcional, 5)    -> segundos máximos esperando un pronóstico si no hay ninguno guardado
+#
+# Stale-while-revalidate: un pronóstico caducado se sirve al momento y se refresca
+# en fondo; con Open-Meteo caído (circuito abierto en meteo_async) se sigue
+# sirviendo el último conocido y el tick no se alarga.
+
+from __future__ import annotations
+
+import os
+import time
+import threading
+import datetime as dt
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import h3
+
+import meteo_async
+from meteo_async import ClaveMeteo
+from ubicacion_y_sol import HorasMeteo, preparar_hourly
+
+H3_RES = int(os.getenv("METEO_H3_RES", "5"))
+CACHE_TTL = int(os.getenv("METEO_CACHE_TTL", "3600"))
+CACHE_MAX = int(os.getenv("METEO_CACHE_MAX", "4096"))
+CACHE_PG = (os.getenv("METEO_CACHE_PG") or "").strip() == "1"
+ESPERA = float(os.getenv("METEO_ESPERA", "5"))
+
+# clave -> (instante de descarga en epoch, HorasMeteo)
+_lru: "OrderedDict[tuple, Tuple[float, HorasMeteo]]" = OrderedDict()
+_pg_listo = False
+
+# el refresco en fondo escribe desde el hilo de meteo_async
+_lock = threading.RLock()
+_refrescando: set = set()
+
+
+def celda_de(lat: float, lon: float) -> str:
+    return h3.geo_to_h3(float(lat), float(lon), H3_RES)
+
+
+def _pg():
+    """meteo_repo (con la tabla creada) si METEO_CACHE_PG=1; si no, None."""
+    global _pg_listo
+    if not CACHE_PG:
+        return None
+    import meteo_repo
+    if not _pg_listo:
+        meteo_repo.init_meteo_cache()
+        _pg_listo = True
+    return meteo_repo
+
+
+def _leer_pg(cell: str, tzname: str, fecha: dt.date) -> Optional[Tuple[float, HorasMeteo]]:
+    try:
+        repo = _pg()
+        if repo is None:
+            return None
+        row = repo.get_meteo_cache(cell, tzname, fecha)
+    except Exception as e:
+        print(f"[WARN] meteo_cache lectura: {e}")
+        return None
+    if not row:
+        return None
+    hourly, fetched_at = row
+    return fetched_at.timestamp(), preparar_hourly(hourly, tzname)
+
+
+def _guardar_pg(cell: str, tzname: str, fecha: dt.date, hourly: dict) -> None:
+    try:
+        repo = _pg()
+        if repo is None:
+            return
+        repo.put_meteo_cache(cell, tzname, fecha, hourly)
+    except Exception as e:
+        print(f"[WARN] meteo_cache escritura: {e}")
+
+
+def _guardar_lru(key: tuple, entrada: Tuple[float, HorasMeteo]) -> None:
+    with _lock:
+        _lru[key] = entrada
+        _lru.move_to_end(key)
+        while len(_lru) > CACHE_MAX:
+            _lru.popitem(last=False)
+
+
+def _fresca(entrada: Optional[Tuple[float, HorasMeteo]], ahora: float) -> bool:
+    return entrada is not None and ahora - entrada[0] < CACHE_TTL
+
+
+def _buscar(key: tuple, ahora: float) -> Optional[Tuple[float, HorasMeteo]]:
+    """Última entrada conocida (memoria o Postgres), fresca o no."""
+    with _lock:
+        entrada = _lru.get(key)
+        if entrada is not None:
+            _lru.move_to_end(key)
+        refrescando = key in _refrescando
+    if _fresca(entrada, ahora) or refrescando:
+        return entrada
+
+    pg = _leer_pg(*key)
+    if pg is not None and (entrada is None or pg[0] > entrada[0]):
+        _guardar_lru(key, pg)
+        entrada = pg
+    return entrada
+
+
+def _centro(key: tuple) -> ClaveMeteo:
+    c_lat, c_lon = h3.h3_to_geo(key[0])
+    return (c_lat, c_lon, key[1], key[2])
+
+
+def _guardar(key: tuple, hourly: dict, ahora: float) -> HorasMeteo:
+    horas = preparar_hourly(hourly, key[1])
+    _guardar_lru(key, (ahora, horas))
+    _guardar_pg(key[0], key[1], key[2], hourly)
+    return horas
+
+
+def _refrescar_en_fondo(keys: List[tuple]) -> None:
+    """Pide de nuevo esas celdas sin esperar (una sola vez en vuelo por clave)."""
+    with _lock:
+        nuevas = [k for k in dict.fromkeys(keys) if k not in _refrescando]
+        _refrescando.update(nuevas)
+    if not nuevas:
+        return
+    centros = {_centro(k): k for k in nuevas}
+
+    def al_terminar(res: Dict[ClaveMeteo, Optional[dict]]) -> None:
+        try:
+            ahora = time.time()
+            for centro, hourly in res.items():
+                if hourly is not None:
+                    _guardar(centros[centro], hourly, ahora)
+        finally:
+            with _lock:
+                _refrescando.difference_update(nuevas)
+
+    try:
+        meteo_async.pronosticos_en_fondo(list(centros), al_terminar)
+    except Exception as e:
+        print(f"[WARN] meteo_cache refresco: {e}")
+        with _lock:
+            _refrescando.difference_update(nuevas)
+
+
+def pronostico_diario(
+    fecha: dt.date,
+    lat: float,
+    lon: float,
+    tzname: str,
+    espera: Optional[float] = None,
+) -> Optional[HorasMeteo]:
+    """
+    Como ubicacion_y_sol.obtener_pronostico_diario (ya parseado), pero pidiendo el
+    centro de la celda H3 una sola vez por celda, zona y día mientras no caduque (CACHE_TTL).
+    Si está caducado se devuelve el último conocido al momento y se refresca en fondo;
+    si no hay ninguno, se espera como mucho `espera` s (METEO_ESPERA).
+    """
+    return pronosticos_lote([(lat, lon, tzname, fecha)], espera)[(lat, lon, tzname, fecha)]
+
+
+def pronosticos_lote(
+    claves: Sequence[ClaveMeteo],
+    espera: Optional[float] = None,
+    refrescar: bool = False,
+) -> Dict[ClaveMeteo, Optional[HorasMeteo]]:
+    """
+    Pronósticos de varias (lat, lon, tz, fecha) a la vez, con el mismo criterio que
+    pronostico_diario: lo que falta del todo se pide por lotes (una vez por celda,
+    trozos en paralelo con meteo_async) esperando como mucho `espera` s. Lo que ya
+    se está pidiendo en fondo no se pide otra vez: sale lo último conocido o None.
+    refrescar=True pide también (y espera) los caducados, p. ej. en la precarga,
+    cuyo proceso puede terminar antes que un refresco en fondo.
+    """
+    ahora = time.time()
+    out: Dict[ClaveMeteo, Optional[HorasMeteo]] = {}
+    caducadas: List[tuple] = []
+    viejas: Dict[tuple, HorasMeteo] = {}
+    pendientes: Dict[tuple, List[ClaveMeteo]] = {}
+    for lat, lon, tzname, fecha in claves:
+        key = (celda_de(lat, lon), tzname, fecha)
+        if key in pendientes:
+            pendientes[key].append((lat, lon, tzname, fecha))
+            continue
+        entrada = _buscar(key, ahora)
+        with _lock:
+            en_vuelo = key in _refrescando
+        if not en_vuelo and (entrada is None or (refrescar and not _fresca(entrada, ahora))):
+            pendientes[key] = [(lat, lon, tzname, fecha)]
+            if entrada is not None:
+                viejas[key] = entrada[1]
+            continue
+        # con un refresco ya en vuelo no se vuelve a pedir (ni a esperar): lo último conocido o None
+        out[(lat, lon, tzname, fecha)] = entrada[1] if entrada is not None else None
+        if entrada is not None and not _fresca(entrada, ahora):
+            caducadas.append(key)
+
+    if caducadas:
+        _refrescar_en_fondo(caducadas)
+    if not pendientes:
+        return out
+
+    centros = {_centro(key): key for key in pendientes}
+    res = meteo_async.pronosticos_lote(list(centros), ESPERA if espera is None else espera)
+    sin_dato: List[tuple] = []
+    for centro, hourly in res.items():
+        key = centros[centro]
+        if hourly is not None:
+            horas = _guardar(key, hourly, ahora)
+        else:
+            horas = viejas.get(key)
+            sin_dato.append(key)
+        for k in pendientes[key]:
+            out[k] = horas
+
+    # lo que no llegó a tiempo sigue pidiéndose en fondo para los siguientes usuarios
+    if sin_dato and not meteo_async.circuito_abierto():
+        _refrescar_en_fondo(sin_dato)
+    return out
+
+
+def limpiar_cache() -> None:
+    with _lock:
+        _lru.clear()
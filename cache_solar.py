@@ -0,0 +1,123 @@
+# cache_solar.py
+# Caché de ventanas solares por celda H3: usuarios cercanos comparten un único cálculo.
+# Clave: (celda H3, tz, fecha local, modelo). Guarda SolarDay en memoria (LRU) + Postgres opcional (solar_repo).
+#
+# Variables de entorno:
+#   SOLAR_H3_RES    (opcional, 6)    -> resolución H3 (6 ≈ 36 km²: < 1 min de error en las ventanas)
+#   SOLAR_CACHE_MAX (opcional, 4096) -> entradas máximas en memoria
+#   SOLAR_CACHE_PG  (opcional)       -> "1" = persistir/compartir en la tabla solar_cache
+
+from __future__ import annotations
+
+import os
+import datetime as dt
+from collections import OrderedDict
+from typing import Optional, Sequence
+
+import h3
+
+import zonas_horarias as zonas
+from ubicacion_y_sol import (
+    BANDA_30_40,
+    Banda,
+    SolarDay,
+    _modelo,
+    calcular_dia_solar,
+)
+
+H3_RES = int(os.getenv("SOLAR_H3_RES", "6"))
+CACHE_MAX = int(os.getenv("SOLAR_CACHE_MAX", "4096"))
+CACHE_PG = (os.getenv("SOLAR_CACHE_PG") or "").strip() == "1"
+
+_lru: "OrderedDict[tuple, SolarDay]" = OrderedDict()
+_pg_listo = False
+
+
+def celda_de(lat: float, lon: float, res: Optional[int] = None) -> str:
+    return h3.geo_to_h3(float(lat), float(lon), H3_RES if res is None else int(res))
+
+
+def _pg():
+    """solar_repo (con la tabla creada) si SOLAR_CACHE_PG=1; si no, None."""
+    global _pg_listo
+    if not CACHE_PG:
+        return None
+    import solar_repo
+    if not _pg_listo:
+        solar_repo.init_solar_cache()
+        _pg_listo = True
+    return solar_repo
+
+
+def _rebase(v: Optional[dt.datetime], base: dt.datetime) -> Optional[dt.datetime]:
+    # Mismo instante, expresado como base + timedelta (igual que el cálculo original).
+    return None if v is None else base + (v - base)
+
+
+def _leer_pg(cell: str, tzname: str, fecha: dt.date, modelo: str) -> Optional[SolarDay]:
+    try:
+        repo = _pg()
+        if repo is None:
+            return None
+        row = repo.get_solar_cache(cell, tzname, fecha, modelo)
+    except Exception as e:
+        print(f"[WARN] solar_cache lectura: {e}")
+        return None
+    if not row:
+        return None
+
+    base = zonas.localizar(tzname, dt.datetime(fecha.year, fecha.month, fecha.day, 0, 0))
+    m_a, m_b, t_a, t_b, noon, elev_max = row
+    tramo_m = (_rebase(m_a, base), _rebase(m_b, base)) if m_a and m_b else None
+    tramo_t = (_rebase(t_a, base), _rebase(t_b, base)) if t_a and t_b else None
+    return SolarDay(fecha, tzname, _rebase(noon, base), float(elev_max), {BANDA_30_40: (tramo_m, tramo_t)})
+
+
+def _guardar_pg(cell: str, tzname: str, modelo: str, dia: SolarDay) -> None:
+    try:
+        repo = _pg()
+        if repo is None:
+            return
+        repo.put_solar_cache(cell, tzname, dia.fecha, modelo, dia.tramo_m, dia.tramo_t, dia.mediodia, dia.elev_max)
+    except Exception as e:
+        print(f"[WARN] solar_cache escritura: {e}")
+
+
+def dia_solar(
+    lat: float,
+    lon: float,
+    fecha: dt.date,
+    tzname: str,
+    bandas_extra: Sequence[Banda] = (),
+    modelo: Optional[str] = None,
+) -> SolarDay:
+    """
+    SolarDay calculado en el centro de la celda H3 de (lat, lon).
+    Un único cálculo por celda, zona, día, modelo (y juego de bandas).
+    Postgres solo guarda la banda 30–40°, así que solo se usa sin bandas extra.
+    """
+    cell = celda_de(lat, lon)
+    bandas_extra = tuple(bandas_extra)
+    modelo = _modelo(modelo)
+    key = (cell, tzname, fecha, modelo, bandas_extra)
+
+    dia = _lru.get(key)
+    if dia is not None:
+        _lru.move_to_end(key)
+        return dia
+
+    dia = None if bandas_extra else _leer_pg(cell, tzname, fecha, modelo)
+    if dia is None:
+        c_lat, c_lon = h3.h3_to_geo(cell)
+        dia = calcular_dia_solar(c_lat, c_lon, fecha, tzname, bandas_extra, modelo=modelo)
+        if not bandas_extra:
+            _guardar_pg(cell, tzname, modelo, dia)
+
+    _lru[key] = dia
+    while len(_lru) > CACHE_MAX:
+        _lru.popitem(last=False)
+    return dia
+
+
+def limpiar_cache() -> None:
+    _lru.clear()
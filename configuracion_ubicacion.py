@@ -1,6 +1,7 @@
 import requests
 from geopy.geocoders import Nominatim
-from timezonefinder import TimezoneFinder
+
+import zonas_horarias as zonas
 
 def obtener_ubicacion():
     try:
@@ -36,12 +37,7 @@ def obtener_ubicacion():
         print(f"✅ Ubicación por defecto: {ciudad} ({lat}, {lon})")
 
     # Obtener zona horaria a partir de lat/lon
-    try:
-        tf = TimezoneFinder()
-        zona_horaria = tf.timezone_at(lat=lat, lng=lon)
-    except Exception as e:
-        print(f"❌ Error al obtener la zona horaria: {e}")
-        zona_horaria = "Europe/Madrid"
+    zona_horaria = zonas.zona_de_coords(lat, lon)
 
     print(f"✅ Ubicación guardada: {ciudad} ({lat}, {lon}) - Zona horaria: {zona_horaria}")
 
@@ -1,8 +1,14 @@
 # enviar_consejo.py
 # Cron cada 5 min: envía el consejo diario cuando should_send_now(chat) sea True.
+# Se pueden lanzar varios a la vez (ticks solapados, N procesos o máquinas): cada uno
+# reserva lotes de usuarios con repo.claim_due_send y nadie recibe el consejo dos veces.
 # Variables útiles:
 # - FORCE_SEND=1 -> ignora la ventana horaria (envía ahora)
 # - FORCE_TODAY=1 -> ignora "ya enviado hoy" (solo tiene sentido con FORCE_SEND)
+# - ENVIO_MODO=instantanea -> decide quién toca con la foto columnar (snapshot_suscriptores)
+#   y solo reserva a esos
+# - ENVIO_TROZO (1000) -> usuarios que se preparan a la vez (meteo por lotes y envío);
+#   acota la memoria con FORCE_SEND sobre toda la tabla
 
 from __future__ import annotations
 
@@ -10,16 +16,21 @@ import os
 import random
 import datetime as dt
 import logging
+from itertools import islice
+from typing import Callable, Iterable, List, Optional, Set
+
 import requests
 
 import usuarios_repo as repo
+import zonas_horarias as zonas
 
 from ubicacion_y_sol import (
-    calcular_intervalos_30_40,
-    describir_intervalos_y_mediodia,
-    obtener_pronostico_diario,
+    describir_dia_solar,
     formatear_meteo_en_tramos,
 )
+from cache_solar import dia_solar
+from cache_meteo import pronostico_diario, pronosticos_lote
+from precarga_meteo import precargar
 
 from consejos_diarios import CONSEJOS_DIARIOS  # tu contenido
 
@@ -32,6 +43,8 @@ if not BOT_TOKEN:
 
 FORCE_SEND = (os.getenv("FORCE_SEND") or "").strip() == "1"
 FORCE_TODAY = (os.getenv("FORCE_TODAY") or "").strip() == "1"
+ENVIO_MODO = (os.getenv("ENVIO_MODO") or "").strip().lower()
+ENVIO_TROZO = max(1, int(os.getenv("ENVIO_TROZO", "1000")))
 
 
 def tg_send(chat_id: str, text: str) -> None:
@@ -100,42 +113,45 @@ def maybe_add_header(local_date: dt.date, consejo: str) -> str:
     return f"🧠 Consejo para hoy ({weekday_es(local_date)}):\n{consejo}".strip()
 
 
-def main():
-    # Asegura tabla/columnas (idempotente)
-    try:
-        repo.init_db()
-        repo.migrate_fill_defaults()
-    except Exception as e:
-        logger.warning(f"[WARN] init_db/migrate: {e}")
+def enviar_lote(chats, now_utc: dt.datetime, marcas: repo.MarcasEnvio,
+                renovar: Optional[Callable[[Iterable[str]], Set[str]]] = None) -> List[str]:
+    """
+    Prepara y envía el consejo a `chats` (filas de usuarios_repo, también en streaming)
+    y anota los enviados en `marcas`. Va por trozos de ENVIO_TROZO: solo un trozo en
+    memoria a la vez. Con `renovar` (repo.renew_send, para lotes reservados) las
+    reservas de cada trozo se alargan de una vez (repo.ReservaLote) y se salta a quien
+    ya no sea nuestro.
+    Devuelve los chat_id que se quedaron sin enviar.
+    """
+    fallidos: List[str] = []
+    it = iter(chats)
+    while True:
+        trozo = list(islice(it, ENVIO_TROZO))
+        if not trozo:
+            return fallidos
+        fallidos += _enviar_trozo(trozo, now_utc, marcas, renovar)
 
-    chats = repo.list_users()
-    if not chats:
-        logger.info("No hay usuarios en subscribers.")
-        return
 
-    now_utc = dt.datetime.now(dt.timezone.utc)
+def _enviar_trozo(chats, now_utc: dt.datetime, marcas: repo.MarcasEnvio,
+                  renovar: Optional[Callable[[Iterable[str]], Set[str]]]) -> List[str]:
+    fallidos: List[str] = []
 
-    for chat_id, chat in chats.items():
-        chat_id = str(chat_id)
+    # 1ª pasada: a quién toca enviar y con qué ubicación
+    pendientes = []
+    for chat in chats:
+        chat_id = str(chat.get("chat_id"))
 
         try:
             # TZ del usuario (para fecha local y chequeo "ya enviado")
-            tzname = (chat.get("tz") or "Europe/Madrid").strip() or "Europe/Madrid"
-            try:
-                import pytz
-                tz = pytz.timezone(tzname)
-            except Exception:
-                import pytz
-                tz = pytz.timezone("Europe/Madrid")
-                tzname = "Europe/Madrid"
-
-            local_date = now_utc.astimezone(tz).date()
-            already = (chat.get("last_sent_iso") == local_date.isoformat())
+            tzname = zonas.normalizar_tz(chat.get("tz"))
+            local_date = zonas.fecha_local(tzname, now_utc)
+            already = (chat.get("last_sent_date") == local_date)
 
             # 1) ¿toca enviar ahora?
             if not FORCE_SEND:
                 if not repo.should_send_now(chat, now_utc=now_utc):
                     logger.info(f"[SKIP] {chat_id} no está en ventana horaria (tz={tzname})")
+                    fallidos.append(chat_id)
                     continue
             else:
                 # force_send
@@ -147,6 +163,32 @@ def main():
             lat, lon, tz_eff, city, is_temp = repo.get_effective_location(chat, now_utc=now_utc)
             city = city or "tu ciudad"
             tz_eff = (tz_eff or tzname).strip() or tzname
+            if lat is not None and lon is not None:
+                lat, lon = float(lat), float(lon)
+
+            pendientes.append((chat_id, local_date, lat, lon, tz_eff, city, is_temp))
+
+        except Exception as e:
+            logger.exception(f"❌ Error preparando {chat_id}: {e}")
+            fallidos.append(chat_id)
+
+    # Meteo de todas las celdas pendientes en unas pocas peticiones (queda en cache_meteo)
+    claves = [(lat, lon, tz_eff, local_date) for _, local_date, lat, lon, tz_eff, _, _ in pendientes
+              if lat is not None and lon is not None]
+    if claves:
+        try:
+            pronosticos_lote(claves)
+        except Exception as e:
+            logger.warning(f"[WARN] meteo por lotes: {e}")
+
+    # 2ª pasada: componer y enviar
+    reserva = repo.ReservaLote(renovar, [p[0] for p in pendientes]) if renovar is not None else None
+    for chat_id, local_date, lat, lon, tz_eff, city, is_temp in pendientes:
+        try:
+            # la reserva puede haber caducado y ser ya de otro worker: ese envía
+            if reserva is not None and not reserva.sigue(chat_id):
+                logger.warning(f"[SKIP] {chat_id}: la reserva ya no es de este worker")
+                continue
 
             consejo = maybe_add_header(local_date, pick_consejo(local_date))
 
@@ -158,20 +200,17 @@ def main():
                     f"Usa /setloc lat lon tz [Ciudad] o define una ubicación temporal."
                 )
                 tg_send(chat_id, msg)
-                repo.mark_sent_today(chat_id, local_date)
+                marcas.anotar(chat_id, local_date)
                 logger.info(f"✅ Enviado SIN GPS a {chat_id} ({city}) {local_date.isoformat()} tz={tz_eff}")
                 continue
 
-            lat = float(lat)
-            lon = float(lon)
-
-            # 3) Sol + mediodía solar
-            tramos = calcular_intervalos_30_40(lat, lon, local_date, tz_eff)
-            bloque_sol = describir_intervalos_y_mediodia(lat, lon, local_date, tz_eff, city)
+            # 3) Sol + mediodía solar (compartido por celda H3)
+            dia = dia_solar(lat, lon, local_date, tz_eff)
+            bloque_sol = describir_dia_solar(dia, city)
 
-            # 4) Meteo
-            hourly = obtener_pronostico_diario(local_date, lat, lon, tz_eff)
-            bloque_meteo = formatear_meteo_en_tramos(tramos, hourly, tz_eff)
+            # 4) Meteo (compartido por celda H3; normalmente ya precargado)
+            hourly = pronostico_diario(local_date, lat, lon, tz_eff)
+            bloque_meteo = formatear_meteo_en_tramos(dia, hourly, tz_eff)
 
             # 5) Nota si es ubicación temporal
             nota_loc = "\n\n📍 Ubicación temporal activa (viaje)." if is_temp else ""
@@ -182,12 +221,67 @@ def main():
             msg += nota_loc
 
             tg_send(chat_id, msg)
-            repo.mark_sent_today(chat_id, local_date)
+            marcas.anotar(chat_id, local_date)
 
             logger.info(f"✅ Enviado a {chat_id} ({city}) {local_date.isoformat()} tz={tz_eff}")
 
         except Exception as e:
             logger.exception(f"❌ Error enviando a {chat_id}: {e}")
+            fallidos.append(chat_id)
+
+    return fallidos
+
+
+def main():
+    # Asegura tabla/columnas (idempotente)
+    try:
+        repo.init_db()
+    except Exception as e:
+        logger.warning(f"[WARN] init_db: {e}")
+
+    # ubicaciones temporales caducadas: fuera de una vez
+    try:
+        n = repo.expire_temp_locations()
+        if n:
+            logger.info(f"🧹 {n} ubicaciones temporales caducadas borradas")
+    except Exception as e:
+        logger.warning(f"[WARN] expire_temp_locations: {e}")
+
+    now_utc = dt.datetime.now(dt.timezone.utc)
+
+    # marcas "enviado hoy" por lotes (se vuelcan también al salir del with)
+    with repo.MarcasEnvio(repo.mark_sent_many) as marcas:
+        if FORCE_SEND:
+            # FORCE_SEND necesita a todos (en streaming), sin reservas
+            enviar_lote(repo.iter_users(), now_utc, marcas)
+        else:
+            # solo los que tocan (índice sobre next_send_at_utc), por lotes reservados
+            solo = None
+            if ENVIO_MODO == "instantanea":
+                import snapshot_suscriptores
+                solo = snapshot_suscriptores.due_send_ids(now_utc)
+            reservados, fallidos = 0, []
+            try:
+                while True:
+                    lote = repo.claim_due_send(now_utc, solo=solo)
+                    if not lote:
+                        break
+                    reservados += len(lote)
+                    fallidos += enviar_lote(lote.values(), now_utc, marcas, renovar=repo.renew_send)
+            finally:
+                # los fallidos se liberan al final (no dentro del bucle: se volverían a reservar)
+                try:
+                    repo.release_send(fallidos)
+                except Exception as e:
+                    logger.warning(f"[WARN] liberar reservas ({len(fallidos)}): {e}")
+            if not reservados:
+                logger.info("Nadie en ventana de envío.")
+
+    # 3) Meteo de los que tocan en el próximo rato (para el siguiente tick)
+    try:
+        precargar(None, now_utc=now_utc)
+    except Exception as e:
+        logger.warning(f"[WARN] precarga meteo: {e}")
 
 
 if __name__ == "__main__":
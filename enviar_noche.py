@@ -1,14 +1,21 @@
 # enviar_noche.py
 # Cron cada 5 min: envía recordatorio nocturno cuando should_send_sleep_now(chat) sea True.
+# Como enviar_consejo, admite varios a la vez: reservan lotes con repo.claim_due_sleep.
+# Variables útiles:
+# - ENVIO_MODO=instantanea -> decide quién toca con la foto columnar (snapshot_suscriptores)
+#   y solo reserva a esos
 
 from __future__ import annotations
 
 import os
 import datetime as dt
 import logging
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
 import requests
 
 import usuarios_repo as repo
+import zonas_horarias as zonas
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("enviar_noche")
@@ -17,6 +24,8 @@ BOT_TOKEN = os.getenv("BOT_TOKEN")
 if not BOT_TOKEN:
     raise RuntimeError("❌ Falta BOT_TOKEN en variables de entorno")
 
+ENVIO_MODO = (os.getenv("ENVIO_MODO") or "").strip().lower()
+
 def tg_send(chat_id: str, text: str) -> None:
     url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
     r = requests.post(
@@ -26,36 +35,24 @@ def tg_send(chat_id: str, text: str) -> None:
     )
     r.raise_for_status()
 
-def main():
-    try:
-        repo.init_db()
-        repo.migrate_fill_defaults()
-    except Exception as e:
-        logger.warning(f"[WARN] init_db/migrate: {e}")
-
-    chats = repo.list_users()
-    if not chats:
-        logger.info("No hay usuarios en subscribers.")
-        return
-
-    now_utc = dt.datetime.now(dt.timezone.utc)
-
+def enviar_lote(chats: Dict[str, repo.Suscriptor], now_utc: dt.datetime, marcas: repo.MarcasEnvio,
+                renovar: Optional[Callable[[Iterable[str]], Set[str]]] = None) -> List[str]:
+    """
+    Envía el nocturno a `chats`; devuelve los chat_id que se quedaron sin enviar.
+    Con `renovar` (repo.renew_sleep) las reservas se alargan de una vez para todo el
+    lote (repo.ReservaLote) y se salta a quien ya no sea de este worker.
+    """
+    fallidos: List[str] = []
+    reserva = repo.ReservaLote(renovar, chats) if renovar is not None else None
     for chat_id, chat in chats.items():
         chat_id = str(chat_id)
         try:
             if not repo.should_send_sleep_now(chat, now_utc=now_utc):
+                fallidos.append(chat_id)
                 continue
 
-            tzname = (chat.get("tz") or "Europe/Madrid").strip() or "Europe/Madrid"
-            try:
-                import pytz
-                tz = pytz.timezone(tzname)
-            except Exception:
-                import pytz
-                tz = pytz.timezone("Europe/Madrid")
-                tzname = "Europe/Madrid"
-
-            local_date = now_utc.astimezone(tz).date()
+            tzname = zonas.normalizar_tz(chat.get("tz"))
+            local_date = zonas.fecha_local(tzname, now_utc)
 
             msg = (
                 "🌙 Modo noche (parasimpático):\n"
@@ -65,12 +62,53 @@ def main():
                 "• Habitación fresca y oscura\n"
             )
 
+            # la reserva puede haber caducado y ser ya de otro worker: ese envía
+            if reserva is not None and not reserva.sigue(chat_id):
+                logger.warning(f"[SKIP] {chat_id}: la reserva ya no es de este worker")
+                continue
+
             tg_send(chat_id, msg)
-            repo.mark_sleep_sent_today(chat_id, local_date)
+            marcas.anotar(chat_id, local_date)
             logger.info(f"✅ Nocturno enviado a {chat_id} {local_date.isoformat()}")
 
         except Exception as e:
             logger.exception(f"❌ Error nocturno a {chat_id}: {e}")
+            fallidos.append(chat_id)
+
+    return fallidos
+
+def main():
+    try:
+        repo.init_db()
+    except Exception as e:
+        logger.warning(f"[WARN] init_db: {e}")
+
+    now_utc = dt.datetime.now(dt.timezone.utc)
+
+    # solo los que tocan (índice sobre next_sleep_at_utc), por lotes reservados
+    solo = None
+    if ENVIO_MODO == "instantanea":
+        import snapshot_suscriptores
+        solo = snapshot_suscriptores.due_sleep_ids(now_utc)
+
+    reservados, fallidos = 0, []
+    with repo.MarcasEnvio(repo.mark_sleep_sent_many) as marcas:
+        try:
+            while True:
+                chats = repo.claim_due_sleep(now_utc, solo=solo)
+                if not chats:
+                    break
+                reservados += len(chats)
+                fallidos += enviar_lote(chats, now_utc, marcas, renovar=repo.renew_sleep)
+        finally:
+            # al final: dentro del bucle se volverían a reservar
+            try:
+                repo.release_sleep(fallidos)
+            except Exception as e:
+                logger.warning(f"[WARN] liberar reservas ({len(fallidos)}): {e}")
+
+    if not reservados:
+        logger.info("Nadie en ventana nocturna.")
 
 if __name__ == "__main__":
     main()
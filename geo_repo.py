@@ -0,0 +1,71 @@
+# geo_repo.py
+# Caché persistente de geocoding (nombre de ciudad -> coords/tz), incluidas las búsquedas sin resultado.
+# Requiere: DATABASE_DSN en variables de entorno (conexiones del pool compartido, pg_pool.py)
+
+from __future__ import annotations
+
+from typing import Optional
+
+import pg_pool
+
+
+def _get_conn():
+    return pg_pool.conexion()
+
+
+def init_geocode_cache() -> None:
+    """
+    Crea la tabla geocode_cache si no existe.
+    PK (name_norm, lang) => 1 fila por nombre normalizado e idioma.
+    found = FALSE guarda los nombres que no dieron resultado (caché negativa).
+    """
+    with _get_conn() as conn, conn.cursor() as cur:
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS geocode_cache (
+            name_norm TEXT NOT NULL,
+            lang TEXT NOT NULL,
+            found BOOLEAN NOT NULL,
+
+            lat DOUBLE PRECISION,
+            lon DOUBLE PRECISION,
+            city TEXT,
+            tz TEXT,
+            country TEXT,
+
+            fetched_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (name_norm, lang)
+        );
+        """)
+
+
+def get_geocode_cache(name_norm: str, lang: str) -> Optional[tuple]:
+    """(found, lat, lon, city, tz, country, fetched_at) o None."""
+    with _get_conn() as conn, conn.cursor() as cur:
+        cur.execute("""
+        SELECT found, lat, lon, city, tz, country, fetched_at
+          FROM geocode_cache
+         WHERE name_norm=%s AND lang=%s;
+        """, (name_norm, lang))
+        return cur.fetchone()
+
+
+def put_geocode_cache(name_norm: str, lang: str, res: Optional[dict]) -> None:
+    """Guarda el resultado de geocodificar_ciudad (None = sin resultado)."""
+    res = res or {}
+    with _get_conn() as conn, conn.cursor() as cur:
+        cur.execute("""
+        INSERT INTO geocode_cache (name_norm, lang, found, lat, lon, city, tz, country, fetched_at)
+        VALUES (%s,%s,%s,%s,%s,%s,%s,%s,now())
+        ON CONFLICT (name_norm, lang) DO UPDATE SET
+            found = EXCLUDED.found,
+            lat = EXCLUDED.lat,
+            lon = EXCLUDED.lon,
+            city = EXCLUDED.city,
+            tz = EXCLUDED.tz,
+            country = EXCLUDED.country,
+            fetched_at = EXCLUDED.fetched_at;
+        """, (
+            name_norm, lang, bool(res),
+            res.get("latitud"), res.get("longitud"), res.get("ciudad"),
+            res.get("timezone"), res.get("country"),
+        ))
@@ -0,0 +1,287 @@
+# meteo_async.py
+# Cliente HTTP asíncrono para Open-Meteo (pronósticos + geocoding) sobre un único
+# httpx.AsyncClient con pool de conexiones: las peticiones de un tick se solapan
+# en vez de pagarse una detrás de otra.
+#
+# Variables de entorno:
+#   METEO_CONCURRENCIA (opcional, 8)  -> peticiones simultáneas máximas
+#   METEO_TIMEOUT      (opcional, 10) -> segundos máximos por petición
+#   METEO_DEADLINE     (opcional, 30) -> segundos máximos para todo un lote
+#   METEO_CB_FALLOS    (opcional, 5)  -> fallos seguidos que abren el circuito
+#   METEO_CB_PAUSA     (opcional, 300)-> segundos sin llamar a la API con el circuito abierto
+#   METEO_URL_MAX      (opcional, 4000) -> longitud máxima de la URL de un trozo del lote
+#   METEO_LOTE_MAX     (opcional, 100)  -> puntos máximos por petición
+#
+# Desde código síncrono (enviar_consejo, cache_meteo) se usan los envoltorios
+# pronosticos_lote / pronosticos_en_fondo: corren en un event loop propio en un
+# hilo de fondo, así el pool sobrevive entre llamadas y no choca con el loop
+# del bot si lo hay. El bot, que ya tiene loop, usa geocodificar_async directamente
+# (a través de cache_geo.geocodificar_async).
+
+from __future__ import annotations
+
+import os
+import asyncio
+import threading
+import time
+import weakref
+import datetime as dt
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+from urllib.parse import quote
+
+import httpx
+
+from ubicacion_y_sol import _parsear_geocoding, _url_geocoding
+
+# (lat, lon, tz, fecha local) de un pronóstico
+ClaveMeteo = Tuple[float, float, str, dt.date]
+
+CONCURRENCIA = int(os.getenv("METEO_CONCURRENCIA", "8"))
+TIMEOUT = float(os.getenv("METEO_TIMEOUT", "10"))
+DEADLINE = float(os.getenv("METEO_DEADLINE", "30"))
+CB_FALLOS = int(os.getenv("METEO_CB_FALLOS", "5"))
+CB_PAUSA = float(os.getenv("METEO_CB_PAUSA", "300"))
+METEO_URL_MAX = int(os.getenv("METEO_URL_MAX", "4000"))
+METEO_LOTE_MAX = int(os.getenv("METEO_LOTE_MAX", "100"))
+
+# event loop -> (cliente, semáforo): un pool por loop (el de fondo y, si lo usa, el del bot)
+_por_loop: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, tuple]" = weakref.WeakKeyDictionary()
+
+_loop_fondo: Optional[asyncio.AbstractEventLoop] = None
+_lock = threading.Lock()
+
+
+class CircuitoAbierto(RuntimeError):
+    """Open-Meteo ha fallado seguido: no se llama hasta que pase la pausa."""
+
+
+# Circuit breaker (compartido por todos los loops/hilos del proceso)
+_cb_lock = threading.Lock()
+_cb_fallos = 0
+_cb_abierto_hasta = 0.0
+_cb_sonda = False  # medio abierto: ya hay una petición de prueba en vuelo
+
+
+def circuito_abierto() -> bool:
+    """True si ahora no se llama: en pausa, o pasada la pausa con la prueba ya en vuelo."""
+    if time.monotonic() < _cb_abierto_hasta:
+        return True
+    return _cb_fallos >= CB_FALLOS and _cb_sonda
+
+
+def _cb_entrar() -> bool:
+    """
+    Permiso para una petición (CircuitoAbierto si no); True si es la prueba.
+    Tras la pausa (medio abierto) pasa una sola; el resto espera a su resultado.
+    """
+    global _cb_sonda
+    with _cb_lock:
+        if _cb_fallos < CB_FALLOS:
+            return False
+        if time.monotonic() < _cb_abierto_hasta or _cb_sonda:
+            raise CircuitoAbierto("Open-Meteo en pausa")
+        _cb_sonda = True
+        return True
+
+
+def _cb_resultado(ok: Optional[bool], sonda: bool = False) -> None:
+    # None = sin resultado (cancelada desde fuera): no cuenta, solo deja libre la prueba
+    global _cb_fallos, _cb_abierto_hasta, _cb_sonda
+    with _cb_lock:
+        if sonda:
+            _cb_sonda = False
+        if ok is None:
+            return
+        if ok:
+            _cb_fallos = 0
+            return
+        _cb_fallos += 1
+        # si la prueba de después de la pausa vuelve a fallar, se reabre
+        if _cb_fallos >= CB_FALLOS:
+            _cb_abierto_hasta = time.monotonic() + CB_PAUSA
+            print(f"[WARN] Open-Meteo: circuito abierto {CB_PAUSA:g}s tras {_cb_fallos} fallos seguidos")
+
+
+def _recursos() -> tuple:
+    """(cliente, semáforo) del event loop actual, creados la primera vez."""
+    loop = asyncio.get_running_loop()
+    rec = _por_loop.get(loop)
+    if rec is None or rec[0].is_closed:
+        cliente = httpx.AsyncClient(
+            timeout=httpx.Timeout(TIMEOUT),
+            limits=httpx.Limits(max_connections=CONCURRENCIA, max_keepalive_connections=CONCURRENCIA),
+        )
+        rec = _por_loop[loop] = (cliente, asyncio.Semaphore(CONCURRENCIA))
+    return rec
+
+
+async def _get_json(url: str):
+    if circuito_abierto():
+        raise CircuitoAbierto("Open-Meteo en pausa")
+    cliente, sem = _recursos()
+    async with sem:
+        sonda = _cb_entrar()
+        try:
+            r = await asyncio.wait_for(cliente.get(url), TIMEOUT)
+            r.raise_for_status()
+            data = r.json()
+        except asyncio.CancelledError:
+            # cancelada por el deadline de quien espera (p. ej. METEO_ESPERA al enviar): no
+            # dice nada de Open-Meteo; su propio TIMEOUT sí cuenta (asyncio.TimeoutError, abajo)
+            _cb_resultado(None, sonda)
+            raise
+        except httpx.HTTPStatusError as e:
+            # 4xx = petición mala, no caída del servicio
+            _cb_resultado(e.response.status_code < 500, sonda)
+            raise
+        except Exception:
+            _cb_resultado(False, sonda)
+            raise
+    _cb_resultado(True, sonda)
+    return data
+
+
+async def _con_deadline(tareas: Dict[asyncio.Task, object], deadline: float) -> None:
+    # espera hasta `deadline` s y cancela lo que quede
+    if not tareas:
+        return
+    _, pendientes = await asyncio.wait(list(tareas), timeout=deadline)
+    for t in pendientes:
+        t.cancel()
+    if pendientes:
+        print(f"[WARN] Open-Meteo: {len(pendientes)} peticiones canceladas por deadline ({deadline:g}s)")
+        await asyncio.gather(*pendientes, return_exceptions=True)
+
+
+# ---------------- trozos del lote (varios puntos por URL) ----------------
+
+def _trozos_lote(claves: List[ClaveMeteo], fecha: dt.date) -> Iterator[List[ClaveMeteo]]:
+    # Trozos de claves (mismo día) cuya URL no pasa de METEO_URL_MAX ni de METEO_LOTE_MAX puntos.
+    fijo = len(
+        "https://api.open-meteo.com/v1/forecast?latitude=&longitude=&timezone="
+        "&hourly=cloudcover,precipitation_probability&start_date=&end_date="
+    ) + 2 * len(fecha.isoformat())
+    trozo: List[ClaveMeteo] = []
+    largo = fijo
+    for k in claves:
+        extra = len(f"{k[0]:.4f},{k[1]:.4f},{quote(k[2], safe='')},")
+        if trozo and (largo + extra > METEO_URL_MAX or len(trozo) >= METEO_LOTE_MAX):
+            yield trozo
+            trozo, largo = [], fijo
+        trozo.append(k)
+        largo += extra
+    if trozo:
+        yield trozo
+
+
+def _url_lote(trozo: List[ClaveMeteo], fecha: dt.date) -> str:
+    return (
+        "https://api.open-meteo.com/v1/forecast"
+        f"?latitude={','.join(f'{k[0]:.4f}' for k in trozo)}"
+        f"&longitude={','.join(f'{k[1]:.4f}' for k in trozo)}"
+        "&hourly=cloudcover,precipitation_probability"
+        f"&start_date={fecha.isoformat()}&end_date={fecha.isoformat()}"
+        f"&timezone={','.join(quote(k[2], safe='') for k in trozo)}"
+    )
+
+
+def _repartir_lote(trozo: List[ClaveMeteo], data) -> Dict[ClaveMeteo, Optional[dict]]:
+    # un único punto => objeto; varios => lista en el mismo orden
+    if isinstance(data, dict):
+        data = [data]
+    if len(data) != len(trozo):
+        raise ValueError(f"{len(data)} resultados para {len(trozo)} puntos")
+    return {k: (d or {}).get("hourly") for k, d in zip(trozo, data)}
+
+
+def _trozos_por_fecha(claves: Sequence[ClaveMeteo]) -> Iterator[Tuple[dt.date, List[ClaveMeteo]]]:
+    por_fecha: Dict[dt.date, List[ClaveMeteo]] = {}
+    for k in dict.fromkeys(claves):
+        por_fecha.setdefault(k[3], []).append(k)
+    for fecha, grupo in por_fecha.items():
+        for trozo in _trozos_lote(grupo, fecha):
+            yield fecha, trozo
+
+
+async def pronosticos_lote_async(
+    claves: Sequence[ClaveMeteo],
+    deadline: Optional[float] = None,
+) -> Dict[ClaveMeteo, Optional[dict]]:
+    """
+    Varios pronósticos con una petición por trozo (Open-Meteo acepta listas de
+    latitude/longitude/timezone separadas por comas y devuelve un resultado por punto),
+    con los trozos en paralelo. {clave: hourly o None}; si falla un trozo, sus claves quedan en None.
+    """
+    out: Dict[ClaveMeteo, Optional[dict]] = {k: None for k in claves}
+    if circuito_abierto():
+        return out
+    tareas: Dict[asyncio.Task, List[ClaveMeteo]] = {
+        asyncio.ensure_future(_get_json(_url_lote(trozo, fecha))): trozo
+        for fecha, trozo in _trozos_por_fecha(claves)
+    }
+    await _con_deadline(tareas, DEADLINE if deadline is None else deadline)
+
+    for t, trozo in tareas.items():
+        if t.cancelled():
+            continue
+        try:
+            out.update(_repartir_lote(trozo, t.result()))
+        except Exception as e:
+            print(f"[WARN] Open-Meteo lote ({len(trozo)} puntos): {e}")
+    return out
+
+
+async def geocodificar_async(ciudad: str, idioma: str = "es") -> Optional[dict]:
+    """
+    Como ubicacion_y_sol._geocodificar por el cliente compartido: None si la API no
+    conoce la ciudad; los fallos (también CircuitoAbierto) se propagan.
+    """
+    return _parsear_geocoding(await _get_json(_url_geocoding(ciudad, idioma)), ciudad)
+
+
+# ---------------- envoltorios síncronos ----------------
+
+def _loop() -> asyncio.AbstractEventLoop:
+    global _loop_fondo
+    with _lock:
+        if _loop_fondo is None or _loop_fondo.is_closed():
+            _loop_fondo = asyncio.new_event_loop()
+            threading.Thread(target=_loop_fondo.run_forever, name="meteo_async", daemon=True).start()
+        return _loop_fondo
+
+
+def _ejecutar(coro, deadline: float):
+    fut = asyncio.run_coroutine_threadsafe(coro, _loop())
+    # margen sobre el deadline interno, que ya cancela y devuelve parciales
+    return fut.result(timeout=deadline + TIMEOUT)
+
+
+def pronosticos_lote(
+    claves: Sequence[ClaveMeteo],
+    deadline: Optional[float] = None,
+) -> Dict[ClaveMeteo, Optional[dict]]:
+    deadline = DEADLINE if deadline is None else deadline
+    return _ejecutar(pronosticos_lote_async(claves, deadline), deadline)
+
+
+def pronosticos_en_fondo(
+    claves: Sequence[ClaveMeteo],
+    al_terminar: Callable[[Dict[ClaveMeteo, Optional[dict]]], None],
+) -> None:
+    """
+    Pide los pronósticos sin esperar; `al_terminar` se llama en el hilo de fondo
+    siempre, también si el lote falla o se cancela (entonces con {}).
+    """
+    def _hecho(fut) -> None:
+        res: Dict[ClaveMeteo, Optional[dict]] = {}
+        try:
+            res = fut.result()
+        except BaseException as e:  # CancelledError incluida
+            print(f"[WARN] Open-Meteo en fondo: {e!r}")
+        try:
+            al_terminar(res)
+        except Exception as e:
+            print(f"[WARN] Open-Meteo en fondo: {e}")
+
+    fut = asyncio.run_coroutine_threadsafe(pronosticos_lote_async(list(claves)), _loop())
+    fut.add_done_callback(_hecho)
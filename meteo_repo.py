@@ -0,0 +1,59 @@
+# meteo_repo.py
+# Caché compartida (entre ejecuciones/procesos) de pronósticos horarios de Open-Meteo.
+# Requiere: DATABASE_DSN en variables de entorno (conexiones del pool compartido, pg_pool.py)
+
+from __future__ import annotations
+
+import datetime as dt
+from typing import Optional, Tuple
+
+import pg_pool
+from psycopg2.extras import Json
+
+
+def _get_conn():
+    return pg_pool.conexion()
+
+
+def init_meteo_cache() -> None:
+    """
+    Crea la tabla meteo_cache si no existe.
+    PK (cell, tz, date_local) => 1 pronóstico por celda, zona y día local.
+    """
+    with _get_conn() as conn, conn.cursor() as cur:
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS meteo_cache (
+            cell TEXT NOT NULL,
+            tz TEXT NOT NULL,
+            date_local DATE NOT NULL,
+
+            hourly JSONB NOT NULL,
+            fetched_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+
+            PRIMARY KEY (cell, tz, date_local)
+        );
+        """)
+
+
+def get_meteo_cache(cell: str, tz: str, date_local: dt.date) -> Optional[Tuple[dict, dt.datetime]]:
+    """(hourly, fetched_at) o None."""
+    with _get_conn() as conn, conn.cursor() as cur:
+        cur.execute("""
+        SELECT hourly, fetched_at
+          FROM meteo_cache
+         WHERE cell=%s AND tz=%s AND date_local=%s;
+        """, (cell, tz, date_local))
+        return cur.fetchone()
+
+
+def put_meteo_cache(cell: str, tz: str, date_local: dt.date, hourly: dict) -> None:
+    """Guarda (o refresca) el pronóstico de la celda."""
+    with _get_conn() as conn, conn.cursor() as cur:
+        cur.execute("""
+        INSERT INTO meteo_cache (cell, tz, date_local, hourly, fetched_at)
+        VALUES (%s,%s,%s,%s,now())
+        ON CONFLICT (cell, tz, date_local) DO UPDATE SET
+            hourly = EXCLUDED.hourly,
+            fetched_at = EXCLUDED.fetched_at;
+        """, (cell, tz, date_local, Json(hourly)))
+
@@ -0,0 +1,254 @@
+# nomenclator.py
+# Nomenclátor de ciudades local (sin red): nombre -> lat, lon, zona horaria.
+# /city y los usuarios con ciudad pero sin GPS se resuelven aquí en microsegundos;
+# solo lo que no está se pregunta al geocoding de Open-Meteo (cache_geo).
+#
+# Fichero (NOMENCLATOR_FICHERO, por defecto nomenclator.tsv junto a este módulo):
+#   una línea por nombre o alias, ordenadas por bytes de la clave y, dentro de
+#   una misma clave, de más a menos población:
+#     clave \t nombre \t país (ISO2) \t lat \t lon \t tz \t población
+#   Se abre con mmap (no se carga en memoria) y el índice de prefijos es solo el
+#   array de offsets de cada línea: prefijo -> rango contiguo por bisección.
+#
+# Regenerarlo desde GeoNames (cities15000.txt, https://download.geonames.org/export/dump/):
+#   python nomenclator.py construir cities15000.txt [nomenclator.tsv]
+#
+# Variables de entorno:
+#   NOMENCLATOR_FICHERO (opcional) -> ruta del fichero del nomenclátor
+
+from __future__ import annotations
+
+import os
+import sys
+import mmap
+import bisect
+import threading
+import unicodedata
+from array import array
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+
+FICHERO = os.getenv("NOMENCLATOR_FICHERO") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "nomenclator.tsv")
+
+# letras que NFKD no descompone
+_LETRAS = str.maketrans({"ø": "o", "Ø": "o", "æ": "ae", "Æ": "ae", "œ": "oe", "Œ": "oe",
+                         "ł": "l", "Ł": "l", "đ": "d", "Đ": "d", "ı": "i", "þ": "th"})
+
+# candidatos máximos para la búsqueda aproximada por primera letra
+_DIFUSA_MAX = 5000
+
+
+class Ciudad(NamedTuple):
+    nombre: str
+    pais: str
+    lat: float
+    lon: float
+    tz: str
+    poblacion: int
+
+
+def normalizar_nombre(ciudad: str) -> str:
+    """'  Málaga ' -> 'malaga', 'Saint-Étienne' -> 'saint etienne': sin tildes ni signos."""
+    s = unicodedata.normalize("NFKD", (ciudad or "").translate(_LETRAS))
+    s = "".join(c if c.isalnum() else " " for c in s if not unicodedata.combining(c))
+    return " ".join(s.casefold().split())
+
+
+# ---------------- fichero + índice ----------------
+
+_lock = threading.Lock()
+_datos: Optional[Tuple[mmap.mmap, array]] = None
+
+
+def _cargar() -> Optional[Tuple[mmap.mmap, array]]:
+    """(mmap, offsets de línea), abiertos una vez por proceso. None si no hay fichero."""
+    global _datos
+    if _datos is not None:
+        return _datos
+    with _lock:
+        if _datos is None:
+            try:
+                with open(FICHERO, "rb") as f:
+                    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError) as e:
+                print(f"[WARN] nomenclátor no disponible ({FICHERO}): {e}")
+                return None
+            offs = array("I")
+            pos, n = 0, len(mm)
+            while pos < n:
+                offs.append(pos)
+                fin = mm.find(b"\n", pos)
+                pos = n if fin < 0 else fin + 1
+            _datos = (mm, offs)
+    return _datos
+
+
+def _clave(mm: mmap.mmap, off: int) -> bytes:
+    return mm[off:mm.find(b"\t", off)]
+
+
+def _linea(mm: mmap.mmap, off: int) -> Ciudad:
+    fin = mm.find(b"\n", off)
+    _, nombre, pais, lat, lon, tz, pob = mm[off:fin if fin >= 0 else len(mm)].decode("utf-8").split("\t")
+    return Ciudad(nombre, pais, float(lat), float(lon), tz, int(pob or 0))
+
+
+def _rango(mm: mmap.mmap, offs: array, prefijo: bytes, exacto: bool = False) -> Tuple[int, int]:
+    """Índices [lo, hi) de las líneas cuya clave empieza por `prefijo` (o es igual, si exacto)."""
+    key = lambda off: _clave(mm, off)
+    lo = bisect.bisect_left(offs, prefijo, key=key)
+    if exacto:
+        return lo, bisect.bisect_right(offs, prefijo, lo=lo, key=key)
+    # 0xFF no aparece en UTF-8: cota superior de todo lo que empieza por el prefijo
+    return lo, bisect.bisect_left(offs, prefijo + b"\xff", lo=lo, key=key)
+
+
+def _distancia(a: str, b: str, limite: int) -> int:
+    """Levenshtein con corte: devuelve limite + 1 en cuanto se pasa."""
+    if abs(len(a) - len(b)) > limite:
+        return limite + 1
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        for j, cb in enumerate(b, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb)))
+        if min(cur) > limite:
+            return limite + 1
+        prev = cur
+    return prev[-1]
+
+
+def _separar_pais(texto: str) -> Tuple[str, Optional[str]]:
+    """'Córdoba, AR' -> ('Córdoba', 'AR')."""
+    nombre, sep, pais = (texto or "").rpartition(",")
+    pais = pais.strip()
+    if sep and len(pais) == 2 and pais.isalpha():
+        return nombre, pais.upper()
+    return texto or "", None
+
+
+# ---------------- búsqueda ----------------
+
+def buscar(texto: str, limite: int = 5, aproximado: bool = True) -> List[Ciudad]:
+    """
+    Ciudades que encajan con `texto` (admite 'Nombre, PAÍS'), mejor primero:
+    nombre exacto > prefijo > aproximado (1-2 letras de diferencia); a igualdad,
+    más población. Sin tildes ni mayúsculas ('malaga' = 'Málaga').
+    aproximado=False se queda en exacto/prefijo (para preguntar antes a la red).
+    """
+    datos = _cargar()
+    texto, pais = _separar_pais(texto)
+    q = normalizar_nombre(texto)
+    if datos is None or not q:
+        return []
+    mm, offs = datos
+    qb = q.encode("utf-8")
+
+    def ciudades(nivel: int, indices: Iterable[int]) -> List[tuple]:
+        # (nivel, es alias, -población, ciudad): el nombre propio gana a un alias ('madr' -> Madrid, no Madras)
+        out = []
+        for i in indices:
+            c = _linea(mm, offs[i])
+            if pais is None or c.pais == pais:
+                alias = normalizar_nombre(c.nombre) != _clave(mm, offs[i]).decode("utf-8")
+                out.append((nivel, alias, -c.poblacion, c))
+        return out
+
+    # exacto y, desde 3 letras, por prefijo
+    lo, hi = _rango(mm, offs, qb, exacto=True)
+    candidatas = ciudades(0, range(lo, hi))
+    if len(candidatas) < limite and len(q) >= 3:
+        plo, phi = _rango(mm, offs, qb)
+        candidatas += ciudades(1, (i for i in range(plo, phi) if not lo <= i < hi))
+
+    # aproximado: 1-2 letras de diferencia, entre las que empiezan igual
+    if not candidatas and aproximado:
+        tope = 1 if len(q) <= 4 else 2
+        lo, hi = _rango(mm, offs, q[:1].encode("utf-8"))
+        if hi - lo > _DIFUSA_MAX:
+            lo, hi = _rango(mm, offs, q[:2].encode("utf-8"))
+        for i in range(lo, hi):
+            d = _distancia(q, _clave(mm, offs[i]).decode("utf-8"), tope)
+            if d <= tope:
+                candidatas += ciudades(1 + d, (i,))
+
+    candidatas.sort(key=lambda t: t[:3])
+    out: List[Ciudad] = []
+    for *_, c in candidatas:
+        if c not in out:
+            out.append(c)
+            if len(out) >= limite:
+                break
+    return out
+
+
+def resolver(texto: str, aproximado: bool = True) -> Optional[Ciudad]:
+    """La mejor coincidencia de buscar(), o None."""
+    res = buscar(texto, limite=1, aproximado=aproximado)
+    return res[0] if res else None
+
+
+def exacta(texto: str) -> Optional[Ciudad]:
+    """
+    La ciudad con ese nombre (o alias) exacto si es una sola: sin prefijos ni
+    aproximados, y None si hay homónimas ('Córdoba', 'Santiago', 'Mérida'; con
+    'Córdoba, ES' sí sale). Para resolver sin preguntar nombres ya guardados.
+    """
+    datos = _cargar()
+    texto, pais = _separar_pais(texto)
+    q = normalizar_nombre(texto)
+    if datos is None or not q:
+        return None
+    mm, offs = datos
+    lo, hi = _rango(mm, offs, q.encode("utf-8"), exacto=True)
+    ciudades = {c for c in (_linea(mm, offs[i]) for i in range(lo, hi)) if pais is None or c.pais == pais}
+    return ciudades.pop() if len(ciudades) == 1 else None
+
+
+def como_geocoding(c: Ciudad) -> dict:
+    """Mismo formato que ubicacion_y_sol.geocodificar_ciudad."""
+    return {"latitud": c.lat, "longitud": c.lon, "ciudad": c.nombre, "timezone": c.tz, "country": c.pais}
+
+
+# ---------------- construcción desde GeoNames ----------------
+
+def construir(origen: str, destino: str = FICHERO) -> int:
+    """
+    Genera el fichero a partir de un volcado de ciudades de GeoNames (cities15000.txt o
+    similar: geonameid, name, asciiname, alternatenames, lat, lon, ..., población (14), ..., tz (17)).
+    Alias: nombre ASCII y los alternativos en alfabeto latino o cirílico. Devuelve nº de líneas.
+    """
+    lineas = set()
+    with open(origen, encoding="utf-8") as f:
+        for fila in f:
+            c = fila.rstrip("\n").split("\t")
+            if len(c) < 18 or not c[17]:
+                continue
+            nombre, pais, lat, lon, tz = c[1], c[8], c[4], c[5], c[17]
+            pob = int(c[14] or 0)
+            alias = {nombre, c[2], *[a for a in c[3].split(",") if a and not any(x.isdigit() for x in a)]}
+            for a in alias:
+                k = normalizar_nombre(a)
+                if k and all(ch.isascii() or "Ѐ" <= ch <= "ӿ" or ch == " " for ch in k):
+                    lineas.add((k, nombre, pais, lat, lon, tz, pob))
+    _escribir(lineas, destino)
+    return len(lineas)
+
+
+def _escribir(lineas: Iterable[tuple], destino: str) -> None:
+    orden = sorted(lineas, key=lambda t: (t[0].encode("utf-8"), -t[6], t[1]))
+    tmp = destino + ".tmp"
+    with open(tmp, "w", encoding="utf-8", newline="\n") as f:
+        for t in orden:
+            f.write("\t".join(str(x) for x in t) + "\n")
+    os.replace(tmp, destino)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 3 and sys.argv[1] == "construir":
+        n = construir(sys.argv[2], *(sys.argv[3:4]))
+        print(f"✅ Nomenclátor: {n} nombres")
+    elif len(sys.argv) >= 2:
+        for c in buscar(" ".join(sys.argv[1:])):
+            print(f"{c.nombre} ({c.pais}) {c.lat:.4f}, {c.lon:.4f} {c.tz} pob={c.poblacion}")
+    else:
+        print("Uso: python nomenclator.py construir cities15000.txt [destino] | python nomenclator.py Ciudad")
@@ -0,0 +1,207 @@
+# pg_pool.py
+# Pool de conexiones Postgres compartido por todos los *_repo (y maintenance / bot):
+# una conexión TCP+TLS se abre una vez y se reutiliza, en vez de un connect por consulta.
+#
+# Uso (igual que antes con psycopg2.connect):
+#   with conexion() as conn, conn.cursor() as cur: ...
+# Al salir del with: commit (o rollback si hubo excepción) y la conexión vuelve al pool.
+#
+# - Thread-safe (el bot usa hilos con asyncio.to_thread; meteo_async su propio hilo).
+# - Salud: una conexión ociosa más de PG_POOL_PING s se comprueba con SELECT 1 antes de prestarla;
+#   las que dan error de conexión durante el uso se descartan.
+# - Reciclado: las que superan PG_POOL_VIDA s se cierran y se abren nuevas.
+# - Tras un fork (otro pid) se empieza un pool nuevo: las conexiones no se comparten entre procesos.
+#
+# Variables de entorno:
+#   DATABASE_DSN (o DATABASE_URL) -> cadena de conexión
+#   PG_SSLMODE     (opcional, require) -> sslmode de la conexión ("" = el del DSN)
+#   PG_POOL_MIN    (opcional, 1)    -> conexiones que se abren al empezar y se mantienen ociosas
+#   PG_POOL_MAX    (opcional, 10)   -> conexiones máximas abiertas a la vez
+#   PG_POOL_VIDA   (opcional, 1800) -> segundos de vida máxima de una conexión
+#   PG_POOL_PING   (opcional, 30)   -> segundos ociosa a partir de los que se comprueba antes de usarla
+#   PG_POOL_ESPERA (opcional, 10)   -> segundos máximos esperando una conexión libre
+
+from __future__ import annotations
+
+import os
+import time
+import atexit
+import threading
+from collections import deque
+from typing import Deque, Optional, Tuple
+
+import psycopg2
+
+SSLMODE = os.getenv("PG_SSLMODE", "require").strip()
+POOL_MIN = int(os.getenv("PG_POOL_MIN", "1"))
+POOL_MAX = max(1, int(os.getenv("PG_POOL_MAX", "10")))
+POOL_VIDA = float(os.getenv("PG_POOL_VIDA", "1800"))
+POOL_PING = float(os.getenv("PG_POOL_PING", "30"))
+POOL_ESPERA = float(os.getenv("PG_POOL_ESPERA", "10"))
+
+
+def _dsn() -> str:
+    url = os.getenv("DATABASE_DSN") or os.getenv("DATABASE_URL")
+    if not url:
+        raise RuntimeError("DATABASE_DSN (o DATABASE_URL) no está definida")
+    return url
+
+
+def _abrir():
+    if SSLMODE:
+        return psycopg2.connect(_dsn(), sslmode=SSLMODE)
+    return psycopg2.connect(_dsn())
+
+
+def _cerrar(conn) -> None:
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+class _Pool:
+    def __init__(self) -> None:
+        self.pid = os.getpid()
+        self._cond = threading.Condition(threading.Lock())
+        # ociosas: (conexión, instante de apertura, instante en que volvió al pool)
+        self._libres: Deque[Tuple[object, float, float]] = deque()
+        self._abiertas = 0
+        self._nacimiento: dict = {}
+
+    def _sana(self, conn, abierta: float, libre_desde: float, ahora: float) -> bool:
+        if conn.closed or ahora - abierta > POOL_VIDA:
+            return False
+        if ahora - libre_desde > POOL_PING:
+            try:
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+            except Exception:
+                return False
+        return True
+
+    def tomar(self):
+        limite = time.monotonic() + POOL_ESPERA
+        with self._cond:
+            while True:
+                ahora = time.monotonic()
+                while self._libres:
+                    # LIFO: la más reciente, la que menos probablemente haya caducado
+                    conn, abierta, libre_desde = self._libres.pop()
+                    if self._sana(conn, abierta, libre_desde, ahora):
+                        return conn
+                    self._descartar(conn)
+                if self._abiertas < POOL_MAX:
+                    self._abiertas += 1
+                    break
+                if not self._cond.wait(limite - ahora) and time.monotonic() >= limite:
+                    raise RuntimeError(f"pool Postgres agotado ({POOL_MAX} conexiones ocupadas)")
+        try:
+            conn = _abrir()
+        except Exception:
+            with self._cond:
+                self._abiertas -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._nacimiento[id(conn)] = time.monotonic()
+        return conn
+
+    def devolver(self, conn, rota: bool = False) -> None:
+        with self._cond:
+            if rota or conn.closed or os.getpid() != self.pid:
+                self._descartar(conn)
+            else:
+                abierta = self._nacimiento.get(id(conn), 0.0)
+                self._libres.append((conn, abierta, time.monotonic()))
+            self._cond.notify()
+
+    def _descartar(self, conn) -> None:
+        # con el lock tomado
+        self._nacimiento.pop(id(conn), None)
+        self._abiertas -= 1
+        _cerrar(conn)
+
+    def precalentar(self) -> None:
+        conns = []
+        try:
+            while len(conns) < min(POOL_MIN, POOL_MAX):
+                conns.append(self.tomar())
+        finally:
+            for c in conns:
+                self.devolver(c)
+
+    def cerrar(self) -> None:
+        with self._cond:
+            while self._libres:
+                self._descartar(self._libres.pop()[0])
+
+
+_pool: Optional[_Pool] = None
+_pool_lock = threading.Lock()
+
+
+def _el_pool() -> _Pool:
+    global _pool
+    pool = _pool
+    if pool is not None and pool.pid == os.getpid():
+        return pool
+    with _pool_lock:
+        if _pool is None or _pool.pid != os.getpid():
+            _pool = _Pool()
+            try:
+                _pool.precalentar()
+            except Exception as e:
+                print(f"[WARN] pool Postgres: no se pudo precalentar: {e}")
+        return _pool
+
+
+class _Prestada:
+    """Context manager: presta una conexión y al salir hace commit/rollback y la devuelve."""
+
+    __slots__ = ("_pool", "_autocommit", "conn")
+
+    def __init__(self, autocommit: bool) -> None:
+        self._pool = _el_pool()
+        self._autocommit = autocommit
+        self.conn = None
+
+    def __enter__(self):
+        self.conn = self._pool.tomar()
+        try:
+            self.conn.autocommit = self._autocommit
+        except Exception:
+            self._pool.devolver(self.conn, rota=True)
+            raise
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        conn, self.conn = self.conn, None
+        rota = isinstance(exc, (psycopg2.OperationalError, psycopg2.InterfaceError))
+        try:
+            if not conn.closed:
+                if exc_type is None:
+                    conn.commit()
+                else:
+                    conn.rollback()
+        except Exception:
+            rota = True
+            if exc_type is None:
+                self._pool.devolver(conn, rota=True)
+                raise
+        self._pool.devolver(conn, rota=rota)
+
+
+def conexion(autocommit: bool = False) -> _Prestada:
+    """Conexión del pool para usar con `with` (ver cabecera)."""
+    return _Prestada(autocommit)
+
+
+def cerrar() -> None:
+    """Cierra las conexiones ociosas (p. ej. al terminar un cron)."""
+    if _pool is not None and _pool.pid == os.getpid():
+        _pool.cerrar()
+
+
+atexit.register(cerrar)
@@ -0,0 +1,88 @@
+# precarga_meteo.py
+# Precarga de pronósticos: antes de que empiece la ventana de envío de cada
+# usuario, pide por lotes la meteo de las celdas/fechas que harán falta y la deja
+# en cache_meteo. Al enviar solo queda componer el mensaje + Telegram.
+#
+# - Se ejecuta al final de cada pasada de enviar_consejo (para el siguiente tick)
+#   o suelto: python precarga_meteo.py
+# - Para que lo precargado sirva a otro proceso hace falta METEO_CACHE_PG=1
+#   (y METEO_CACHE_TTL mayor que la antelación).
+#
+# Variables de entorno:
+#   METEO_PRECARGA_MIN (opcional, 60) -> minutos de antelación
+
+from __future__ import annotations
+
+import os
+import logging
+import datetime as dt
+from typing import Dict, List, Optional
+
+import usuarios_repo as repo
+from cache_meteo import CACHE_TTL, pronosticos_lote
+from meteo_async import DEADLINE, ClaveMeteo
+
+logger = logging.getLogger("precarga_meteo")
+
+ANTELACION_MIN = int(os.getenv("METEO_PRECARGA_MIN", "60"))
+
+
+def claves_proximas(
+    chats: Optional[Dict[str, dict]],
+    now_utc: Optional[dt.datetime] = None,
+    minutos: int = ANTELACION_MIN,
+) -> List[ClaveMeteo]:
+    """
+    (lat, lon, tz, fecha local) de los usuarios cuya ventana de envío empieza en los próximos `minutos`.
+    chats=None: se piden a la base solo esos (repo.list_due_send con horizonte).
+    """
+    if now_utc is None:
+        now_utc = dt.datetime.now(dt.timezone.utc)
+    limite = now_utc + dt.timedelta(minutes=minutos)
+    if chats is None:
+        chats = repo.list_due_send(now_utc, horizonte=dt.timedelta(minutes=minutos))
+
+    claves: List[ClaveMeteo] = []
+    for chat_id, chat in chats.items():
+        try:
+            ventana = repo.next_send_window(chat, now_utc=now_utc)
+            if ventana is None or ventana[0] > limite:
+                continue
+            inicio, local_date = ventana
+            # la ubicación que se usará al enviar (una temporal puede caducar antes)
+            lat, lon, tz_eff, _, _ = repo.get_effective_location(chat, now_utc=max(inicio, now_utc))
+            if lat is None or lon is None:
+                continue
+            claves.append((float(lat), float(lon), tz_eff, local_date))
+        except Exception as e:
+            logger.warning(f"[WARN] precarga {chat_id}: {e}")
+    return claves
+
+
+def precargar(
+    chats: Optional[Dict[str, dict]] = None,
+    now_utc: Optional[dt.datetime] = None,
+    minutos: int = ANTELACION_MIN,
+) -> int:
+    """Precarga la meteo de los próximos envíos. Devuelve cuántas claves se pidieron."""
+    if minutos * 60 >= CACHE_TTL:
+        logger.warning(f"[WARN] METEO_PRECARGA_MIN={minutos} >= METEO_CACHE_TTL: lo precargado caducará antes de usarse")
+    claves = claves_proximas(chats, now_utc, minutos)
+    if not claves:
+        return 0
+    # aquí sí se espera (hasta METEO_DEADLINE) y se renuevan también los caducados
+    res = pronosticos_lote(claves, espera=DEADLINE, refrescar=True)
+    fallos = sum(1 for v in res.values() if v is None)
+    logger.info(f"🌤 Precarga meteo: {len(claves)} usuarios, {fallos} sin pronóstico")
+    return len(claves)
+
+
+def main():
+    n = precargar()
+    if not n:
+        logger.info("Nadie con envío próximo.")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
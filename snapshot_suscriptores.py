@@ -0,0 +1,265 @@
+# snapshot_suscriptores.py
+# Foto columnar (struct-of-arrays, NumPy) de subscribers para decidir de una vez
+# quién toca, sin recorrer dicts fila a fila. Alternativa a list_due_send para
+# despliegues que evalúan a todos los usuarios en cada tick (ENVIO_MODO=instantanea).
+#
+# - Zonas internadas (tz_id -> nombre), horas en int8, "último envío" como ordinal
+#   de fecha (int32), lat/lon en float64: 38 B por usuario.
+# - Se construye una vez y después solo se aplican los cambios (updated_at > marca)
+#   y las bajas (subscribers_deleted, migración 6).
+# - should_send_now / should_send_sleep_now para todos: la hora local se calcula
+#   una vez por zona y se reparte con indexado por tz_id.
+# - Los chat_id no numéricos no caben en los arrays: van aparte (Instantanea.otros)
+#   y se evalúan fila a fila con should_send_now / should_send_sleep_now.
+#
+# Variables de entorno:
+#   SNAPSHOT_FICHERO (opcional)      -> .npz donde guardar la foto entre ejecuciones del cron
+#   SNAPSHOT_SOLAPE  (opcional, 120) -> segundos que se releen hacia atrás al pedir cambios
+#                                       (transacciones que terminan después de empezar)
+
+from __future__ import annotations
+
+import os
+import datetime as dt
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+import usuarios_repo as repo
+import zonas_horarias as zonas
+
+FICHERO = (os.getenv("SNAPSHOT_FICHERO") or "").strip()
+SOLAPE = dt.timedelta(seconds=float(os.getenv("SNAPSHOT_SOLAPE", "120")))
+
+# filas que se convierten a arrays de golpe al leer de la base
+_BLOQUE = 50_000
+
+# columnas -> dtype (ids ordenados: búsqueda por searchsorted)
+_CAMPOS = {
+    "ids": np.int64,
+    "tz_id": np.int32,
+    "send_hour": np.int8,
+    "sleep_hour": np.int8,
+    "last_sent": np.int32,
+    "last_sleep": np.int32,
+    "lat": np.float64,
+    "lon": np.float64,
+}
+
+
+def _ordinal(d: Optional[dt.date]) -> int:
+    return d.toordinal() if d is not None else 0
+
+
+def _hora(h) -> int:
+    return int(h) if h is not None else -1
+
+
+def _coord(x) -> float:
+    return float(x) if x is not None else np.nan
+
+
+class Instantanea:
+    """Arrays paralelos, una posición por suscriptor, ordenados por chat_id."""
+
+    def __init__(self) -> None:
+        self.cols: Dict[str, np.ndarray] = {k: np.empty(0, dtype=t) for k, t in _CAMPOS.items()}
+        self.zonas: List[str] = []
+        self._zona_idx: Dict[str, int] = {}
+        self.marca: Optional[dt.datetime] = None
+        # chat_id no numéricos: filas completas, por el camino escalar
+        self.otros: Dict[str, repo.Suscriptor] = {}
+
+    def __len__(self) -> int:
+        return len(self.cols["ids"]) + len(self.otros)
+
+    def _tz_id(self, tzname: Optional[str]) -> int:
+        tzname = zonas.normalizar_tz(tzname)
+        i = self._zona_idx.get(tzname)
+        if i is None:
+            i = self._zona_idx[tzname] = len(self.zonas)
+            self.zonas.append(tzname)
+        return i
+
+    # ---------------- construcción ----------------
+
+    def _bloque(self, filas: List[repo.Suscriptor]) -> Dict[str, np.ndarray]:
+        vals: Dict[str, list] = {k: [] for k in _CAMPOS}
+        for f in filas:
+            if f.updated_at is not None and (self.marca is None or f.updated_at > self.marca):
+                self.marca = f.updated_at
+            try:
+                chat_id = int(f.chat_id)
+            except (TypeError, ValueError):
+                self.otros[str(f.chat_id)] = f
+                continue
+            vals["ids"].append(chat_id)
+            vals["tz_id"].append(self._tz_id(f.tz))
+            vals["send_hour"].append(_hora(f.send_hour_local))
+            vals["sleep_hour"].append(_hora(f.sleep_hour_local))
+            vals["last_sent"].append(_ordinal(f.last_sent_date))
+            vals["last_sleep"].append(_ordinal(f.last_sleep_sent_date))
+            vals["lat"].append(_coord(f.lat))
+            vals["lon"].append(_coord(f.lon))
+        return {k: np.array(v, dtype=_CAMPOS[k]) for k, v in vals.items()}
+
+    def _aplicar(self, nuevo: Dict[str, np.ndarray]) -> None:
+        """Actualiza las filas que ya están y añade (reordenando) las nuevas."""
+        if not len(nuevo["ids"]):
+            return
+        ids = self.cols["ids"]
+        pos = np.searchsorted(ids, nuevo["ids"])
+        esta = pos < len(ids)
+        esta[esta] = ids[pos[esta]] == nuevo["ids"][esta]
+        for k in _CAMPOS:
+            self.cols[k][pos[esta]] = nuevo[k][esta]
+        if esta.all():
+            return
+        falta = ~esta
+        todo = {k: np.concatenate([self.cols[k], nuevo[k][falta]]) for k in _CAMPOS}
+        orden = np.argsort(todo["ids"], kind="stable")
+        self.cols = {k: v[orden] for k, v in todo.items()}
+
+    def _borrar(self, ids: np.ndarray) -> None:
+        if not len(ids):
+            return
+        quedan = ~np.isin(self.cols["ids"], ids)
+        self.cols = {k: v[quedan] for k, v in self.cols.items()}
+
+    def _leer(self, filas: Iterable[repo.Suscriptor]) -> Dict[int, dt.datetime]:
+        """Aplica las filas por bloques; devuelve {id: updated_at} de lo leído."""
+        vistos: Dict[int, dt.datetime] = {}
+        bloque: List[repo.Suscriptor] = []
+
+        def volcar() -> None:
+            nuevo = self._bloque(bloque)
+            self._aplicar(nuevo)
+            bloque.clear()
+
+        for f in filas:
+            bloque.append(f)
+            if f.updated_at is not None and str(f.chat_id).lstrip("-").isdigit():
+                vistos[int(f.chat_id)] = f.updated_at
+            if len(bloque) >= _BLOQUE:
+                volcar()
+        volcar()
+        return vistos
+
+    def refrescar(self) -> int:
+        """Carga completa la primera vez; después solo cambios y bajas. Devuelve filas leídas."""
+        if self.marca is None:
+            self.__init__()
+            n = len(self._leer(repo.iter_users()))
+            if self.otros:
+                print(f"[WARN] snapshot: {len(self.otros)} chat_id no numéricos, se evalúan fila a fila")
+            return n
+
+        desde = self.marca - SOLAPE
+        cambiados = self._leer(repo.iter_users(desde=desde))
+        bajas = repo.deleted_since(desde)
+        borrar, borrar_otros = [], 0
+        for chat_id, cuando in bajas.items():
+            if cuando > self.marca:
+                self.marca = cuando
+            try:
+                k = int(chat_id)
+            except ValueError:
+                otro = self.otros.get(chat_id)
+                if otro is not None and (otro.updated_at is None or cuando >= otro.updated_at):
+                    del self.otros[chat_id]
+                    borrar_otros += 1
+                continue
+            # una baja seguida de un alta nueva: vale el alta
+            if k not in cambiados or cuando >= cambiados[k]:
+                borrar.append(k)
+        self._borrar(np.array(borrar, dtype=np.int64))
+        return len(cambiados) + len(borrar) + borrar_otros
+
+    # ---------------- quién toca ----------------
+
+    def _toca(self, now_utc: dt.datetime, horas: np.ndarray, ultimo: np.ndarray, minutos: int) -> np.ndarray:
+        """chat_ids con hora local == horas, minuto < minutos y último envío != hoy local."""
+        if not len(self.cols["ids"]):
+            return np.empty(0, dtype=np.int64)
+        n = len(self.zonas)
+        hora = np.empty(n, dtype=np.int8)
+        minuto = np.empty(n, dtype=np.int8)
+        hoy = np.empty(n, dtype=np.int32)
+        for i, tzname in enumerate(self.zonas):
+            local = zonas.hora_local(tzname, now_utc)
+            hora[i], minuto[i], hoy[i] = local.hour, local.minute, local.toordinal()
+        tz_id = self.cols["tz_id"]
+        mask = (hora[tz_id] == horas) & (minuto[tz_id] < minutos) & (ultimo != hoy[tz_id])
+        return self.cols["ids"][mask]
+
+    def toca_envio(self, now_utc: dt.datetime) -> np.ndarray:
+        """Como should_send_now para todos a la vez."""
+        return self._toca(now_utc, self.cols["send_hour"], self.cols["last_sent"],
+                          int(repo.VENTANA_ENVIO.total_seconds() // 60))
+
+    def toca_noche(self, now_utc: dt.datetime) -> np.ndarray:
+        """Como should_send_sleep_now para todos a la vez."""
+        return self._toca(now_utc, self.cols["sleep_hour"], self.cols["last_sleep"],
+                          int(repo.VENTANA_NOCHE.total_seconds() // 60))
+
+    def otros_que_tocan(self, toca, now_utc: dt.datetime) -> List[str]:
+        """chat_id no numéricos para los que toca(fila, now_utc=...) es True."""
+        return [k for k, f in self.otros.items() if toca(f, now_utc=now_utc)]
+
+    # ---------------- persistencia entre procesos ----------------
+
+    def guardar(self, ruta: str) -> None:
+        tmp = ruta + ".tmp.npz"
+        np.savez(tmp, zonas=np.array(self.zonas, dtype=str), otros=np.array(list(self.otros), dtype=str),
+                 marca=np.array([self.marca.timestamp() if self.marca else np.nan]), **self.cols)
+        os.replace(tmp, ruta)
+
+    @classmethod
+    def abrir(cls, ruta: str) -> "Instantanea":
+        ins = cls()
+        with np.load(ruta) as f:
+            ins.cols = {k: f[k].astype(t, copy=False) for k, t in _CAMPOS.items()}
+            ins.zonas = [str(z) for z in f["zonas"]]
+            marca = float(f["marca"][0])
+            otros = [str(k) for k in f["otros"]] if "otros" in f.files else []
+        ins._zona_idx = {z: i for i, z in enumerate(ins.zonas)}
+        ins.marca = None if np.isnan(marca) else dt.datetime.fromtimestamp(marca, dt.timezone.utc)
+        # las filas no numéricas no van en el .npz: se releen (son pocas)
+        ins.otros = repo.get_users(otros)
+        return ins
+
+
+_actual: Optional[Instantanea] = None
+
+
+def instantanea() -> Instantanea:
+    """La foto del proceso (o la de SNAPSHOT_FICHERO), puesta al día con los cambios."""
+    global _actual
+    if _actual is None:
+        _actual = Instantanea()
+        if FICHERO and os.path.exists(FICHERO):
+            try:
+                _actual = Instantanea.abrir(FICHERO)
+            except Exception as e:
+                print(f"[WARN] snapshot {FICHERO}: {e}; se recarga entera")
+    _actual.refrescar()
+    if FICHERO:
+        try:
+            _actual.guardar(FICHERO)
+        except Exception as e:
+            print(f"[WARN] snapshot: no se pudo guardar {FICHERO}: {e}")
+    return _actual
+
+
+def due_send_ids(now_utc: Optional[dt.datetime] = None) -> List[str]:
+    if now_utc is None:
+        now_utc = dt.datetime.now(dt.timezone.utc)
+    ins = instantanea()
+    return [str(i) for i in ins.toca_envio(now_utc)] + ins.otros_que_tocan(repo.should_send_now, now_utc)
+
+
+def due_sleep_ids(now_utc: Optional[dt.datetime] = None) -> List[str]:
+    if now_utc is None:
+        now_utc = dt.datetime.now(dt.timezone.utc)
+    ins = instantanea()
+    return [str(i) for i in ins.toca_noche(now_utc)] + ins.otros_que_tocan(repo.should_send_sleep_now, now_utc)
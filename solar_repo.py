@@ -1,23 +1,19 @@
 # solar_repo.py
 # Histórico diario de ventanas solares por usuario (flexible a cualquier ciudad/latitud).
-# Requiere: DATABASE_DSN en variables de entorno (igual que usuarios_repo.py)
+# Requiere: DATABASE_DSN en variables de entorno (conexiones del pool compartido, pg_pool.py)
 
 from __future__ import annotations
 
-import os
 import datetime as dt
 from typing import Optional, Tuple
 
-import psycopg2
+import pg_pool
 
 Tramo = Optional[Tuple[dt.datetime, dt.datetime]]
 
 
 def _get_conn():
-    dsn = os.getenv("DATABASE_DSN")
-    if not dsn:
-        raise RuntimeError("DATABASE_DSN no está definida")
-    return psycopg2.connect(dsn)
+    return pg_pool.conexion()
 
 
 def init_solar_history() -> None:
@@ -99,4 +95,72 @@ def upsert_solar_history(
             bool(has_30_40), bool(meteo_ok), str(reason),
             m_start, m_end, t_start, t_end
         ))
-    print(f"🗓️ solar_history guardado: chat_id={chat_id} date={date_local} reason={reason}")
\ No newline at end of file
+    print(f"🗓️ solar_history guardado: chat_id={chat_id} date={date_local} reason={reason}")
+
+# ------------------ caché de ventanas por celda H3 (cache_solar.py) ------------------
+
+def init_solar_cache() -> None:
+    """
+    Crea la tabla solar_cache si no existe.
+    PK (cell, tz, date_local, model) => 1 fila por celda H3, zona, día local y modelo solar.
+    """
+    with _get_conn() as conn, conn.cursor() as cur:
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS solar_cache (
+            cell TEXT NOT NULL,
+            tz TEXT NOT NULL,
+            date_local DATE NOT NULL,
+            model TEXT NOT NULL,
+
+            morning_start TIMESTAMPTZ,
+            morning_end   TIMESTAMPTZ,
+            afternoon_start TIMESTAMPTZ,
+            afternoon_end   TIMESTAMPTZ,
+            noon TIMESTAMPTZ NOT NULL,
+            elev_max DOUBLE PRECISION NOT NULL,
+
+            created_at TIMESTAMPTZ DEFAULT now(),
+            PRIMARY KEY (cell, tz, date_local, model)
+        );
+        """)
+
+
+def get_solar_cache(cell: str, tz: str, date_local: dt.date, model: str) -> Optional[tuple]:
+    """
+    (morning_start, morning_end, afternoon_start, afternoon_end, noon, elev_max) o None.
+    """
+    with _get_conn() as conn, conn.cursor() as cur:
+        cur.execute("""
+        SELECT morning_start, morning_end, afternoon_start, afternoon_end, noon, elev_max
+          FROM solar_cache
+         WHERE cell=%s AND tz=%s AND date_local=%s AND model=%s;
+        """, (cell, tz, date_local, model))
+        return cur.fetchone()
+
+
+def put_solar_cache(
+    cell: str,
+    tz: str,
+    date_local: dt.date,
+    model: str,
+    tramo_m: Tramo,
+    tramo_t: Tramo,
+    noon: dt.datetime,
+    elev_max: float,
+) -> None:
+    m_start = m_end = t_start = t_end = None
+    if tramo_m:
+        m_start, m_end = tramo_m
+    if tramo_t:
+        t_start, t_end = tramo_t
+
+    with _get_conn() as conn, conn.cursor() as cur:
+        cur.execute("""
+        INSERT INTO solar_cache (
+            cell, tz, date_local, model,
+            morning_start, morning_end, afternoon_start, afternoon_end,
+            noon, elev_max
+        )
+        VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
+        ON CONFLICT (cell, tz, date_local, model) DO NOTHING;
+        """, (cell, tz, date_local, model, m_start, m_end, t_start, t_end, noon, float(elev_max)))
@@ -0,0 +1,136 @@
+# tests/test_migraciones.py
+# Migraciones de usuarios_repo contra un Postgres de verdad (se salta si no hay).
+# Cada prueba trabaja en un esquema propio que se borra al terminar.
+#
+# Variables de entorno:
+#   TEST_DATABASE_DSN -> Postgres desechable (p. ej. "host=127.0.0.1 dbname=test user=postgres")
+
+from __future__ import annotations
+
+import os
+import uuid
+import datetime as dt
+
+import psycopg2
+import pytest
+
+import pg_pool
+import usuarios_repo as repo
+
+DSN = os.getenv("TEST_DATABASE_DSN")
+
+pytestmark = pytest.mark.skipif(not DSN, reason="sin TEST_DATABASE_DSN")
+
+# forma de la tabla antes de send_hour_local / sleep_hour_local (sin DEFAULT ni NOT NULL)
+_TABLA_ANTIGUA = """
+CREATE TABLE subscribers (
+    chat_id    TEXT PRIMARY KEY,
+    lang       TEXT,
+    city       TEXT,
+    lat        DOUBLE PRECISION,
+    lon        DOUBLE PRECISION,
+    tz         TEXT,
+    created_at TIMESTAMPTZ DEFAULT now(),
+    updated_at TIMESTAMPTZ DEFAULT now()
+);
+"""
+
+
+@pytest.fixture
+def esquema(monkeypatch):
+    """Esquema vacío y desechable; usuarios_repo lo usa vía search_path (PGOPTIONS)."""
+    nombre = f"test_{uuid.uuid4().hex[:12]}"
+    admin = psycopg2.connect(DSN)
+    admin.autocommit = True
+    with admin.cursor() as cur:
+        cur.execute(f"CREATE SCHEMA {nombre};")
+
+    monkeypatch.setenv("DATABASE_DSN", DSN)
+    monkeypatch.setenv("PGOPTIONS", f"-c search_path={nombre}")
+    monkeypatch.setattr(pg_pool, "SSLMODE", "")
+    monkeypatch.setattr(repo, "_version_ok", 0)
+    pg_pool.cerrar()
+    try:
+        yield nombre
+    finally:
+        pg_pool.cerrar()
+        with admin.cursor() as cur:
+            cur.execute(f"DROP SCHEMA {nombre} CASCADE;")
+        admin.close()
+
+
+def _sql(sql: str, params=()):
+    with pg_pool.conexion(autocommit=True) as conn, conn.cursor() as cur:
+        cur.execute(sql, params)
+        return cur.fetchall() if cur.description else None
+
+
+def test_alta_tras_migrar_tabla_antigua_tiene_horas(esquema):
+    _sql(_TABLA_ANTIGUA)
+    _sql("INSERT INTO subscribers (chat_id, lang, tz) VALUES ('100', NULL, NULL);")
+
+    repo.init_db()
+
+    # alta después de migrar: los DEFAULT de la tabla, no NULL
+    nuevo = repo.ensure_user("200")
+    assert nuevo["send_hour_local"] == 9
+    assert nuevo["sleep_hour_local"] == 21
+    assert nuevo["lang"] == "es"
+    assert nuevo["tz"] == "Europe/Madrid"
+
+    # la fila antigua, rellenada
+    viejo = repo.get_user("100")
+    assert (viejo["send_hour_local"], viejo["sleep_hour_local"], viejo["lang"], viejo["tz"]) == (9, 21, "es", "Europe/Madrid")
+
+    # y ya no se puede volver a colar un NULL
+    with pytest.raises(psycopg2.errors.NotNullViolation):
+        _sql("INSERT INTO subscribers (chat_id, send_hour_local) VALUES ('300', NULL);")
+
+    # el alta entra en el reparto (antes: TypeError en int(None) y ventana siempre mañana)
+    ahora = dt.datetime.now(dt.timezone.utc)
+    fila = repo.get_users(["200"])["200"]
+    assert repo.next_send_window(fila, now_utc=ahora) is not None
+    assert repo.next_sleep_window(fila, now_utc=ahora) is not None
+
+
+def test_init_db_idempotente(esquema):
+    repo.init_db()
+    version = repo.schema_version()
+    assert version == repo.MIGRACIONES[-1][0]
+
+    repo._version_ok = 0
+    repo.init_db()
+    assert repo.schema_version() == version
+    assert _sql("SELECT count(*) FROM schema_migrations;")[0][0] == len(repo.MIGRACIONES)
+
+
+def test_columnas_iso_siguen_sincronizadas(esquema):
+    # mientras quede código anterior: lee y escribe last_*_iso / temp_until_iso
+    _sql(_TABLA_ANTIGUA)
+    _sql("ALTER TABLE subscribers ADD COLUMN last_sent_iso TEXT, ADD COLUMN last_sleep_sent_iso TEXT, "
+         "ADD COLUMN temp_until_iso TEXT;")
+    _sql("INSERT INTO subscribers (chat_id, last_sent_iso, temp_until_iso) "
+         "VALUES ('100', '2026-10-15', '2026-10-20T10:00:00+00:00');")
+
+    repo.init_db()
+
+    fila = repo.get_user("100")
+    assert fila["last_sent_iso"] == "2026-10-15"
+    assert fila["last_sent_date"] == dt.date(2026, 10, 15)
+    assert fila["temp_until"] == dt.datetime(2026, 10, 20, 10, tzinfo=dt.timezone.utc)
+
+    # código nuevo -> texto
+    repo.mark_sent_many([("100", dt.date(2026, 10, 16))])
+    hasta = dt.datetime(2026, 10, 21, 8, 30, tzinfo=dt.timezone.utc)
+    repo.set_temp_location("100", 40.4, -3.7, "Europe/Madrid", hasta)
+    fila = repo.get_user("100")
+    assert fila["last_sent_iso"] == "2026-10-16"
+    assert dt.datetime.fromisoformat(fila["temp_until_iso"]) == hasta
+
+    # código anterior -> tipadas
+    _sql("UPDATE subscribers SET last_sleep_sent_iso = '2026-10-16', temp_until_iso = NULL WHERE chat_id = '100';")
+    fila = repo.get_user("100")
+    assert fila["last_sleep_sent_date"] == dt.date(2026, 10, 16)
+    assert fila["temp_until"] is None
+    _sql("INSERT INTO subscribers (chat_id, last_sent_iso) VALUES ('200', '2026-10-16');")
+    assert repo.get_user("200")["last_sent_date"] == dt.date(2026, 10, 16)
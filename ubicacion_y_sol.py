@@ -1,16 +1,24 @@
 # ubicacion_y_sol.py
 # Utilidades: sol (30–40º), mediodía solar y meteo (Open-Meteo).
-# Sin Astral. Dependencias: requests, pytz, timezonefinder
+# Sin Astral. Dependencias: requests, timezonefinder, numpy
+#
+# Variables de entorno:
+#   SOLAR_MODEL  (opcional, legacy) -> modelo solar: legacy | fast | precise (ver sección 3d)
 
 from __future__ import annotations
 
+import os
 import math
+import bisect
 import datetime as dt
-from typing import Optional, Tuple, List
+from array import array
+from functools import lru_cache
+from typing import Dict, Iterator, Optional, Sequence, Tuple, List, Union
 
+import numpy as np
 import requests
-import pytz
-from timezonefinder import TimezoneFinder
+
+import zonas_horarias as zonas
 
 
 # ----------------------------
@@ -20,7 +28,13 @@ def obtener_ubicacion_servidor_fallback() -> dict:
     """
     OJO: NO es la ubicación del usuario de Telegram.
     Solo fallback si no hay lat/lon guardados.
+    Se resuelve una vez por proceso (el servidor no se mueve).
     """
+    return dict(_ubicacion_servidor())
+
+
+@lru_cache(maxsize=1)
+def _ubicacion_servidor() -> dict:
     ciudad = None
     lat = None
     lon = None
@@ -44,11 +58,7 @@ def obtener_ubicacion_servidor_fallback() -> dict:
         lat = 36.7213
         lon = -4.4214
 
-    try:
-        tf = TimezoneFinder()
-        tzname = tf.timezone_at(lat=float(lat), lng=float(lon)) or "Europe/Madrid"
-    except Exception:
-        tzname = "Europe/Madrid"
+    tzname = zonas.zona_de_coords(float(lat), float(lon))
 
     return {"latitud": float(lat), "longitud": float(lon), "ciudad": ciudad, "timezone": tzname}
 
@@ -56,27 +66,38 @@ def obtener_ubicacion_servidor_fallback() -> dict:
 # ----------------------------
 # 2) Geocoding por ciudad (Open-Meteo)
 # ----------------------------
-def geocodificar_ciudad(ciudad: str) -> Optional[dict]:
+def _url_geocoding(ciudad: str, idioma: str = "es") -> str:
+    return (
+        "https://geocoding-api.open-meteo.com/v1/search"
+        f"?name={requests.utils.quote(ciudad)}&count=1&language={requests.utils.quote(idioma)}&format=json"
+    )
+
+
+def _parsear_geocoding(data: dict, ciudad: str) -> Optional[dict]:
+    results = data.get("results") or []
+    if not results:
+        return None
+    it = results[0]
+    lat = float(it["latitude"])
+    lon = float(it["longitude"])
+    tz = it.get("timezone") or "Europe/Madrid"
+    name = it.get("name") or ciudad
+    country = it.get("country")
+    return {"latitud": lat, "longitud": lon, "ciudad": name, "timezone": tz, "country": country}
+
+
+def _geocodificar(ciudad: str, idioma: str = "es") -> Optional[dict]:
+    # None = la API no conoce la ciudad; los fallos de red/HTTP se propagan
+    r = requests.get(_url_geocoding(ciudad, idioma), timeout=8)
+    r.raise_for_status()
+    return _parsear_geocoding(r.json(), ciudad)
+
+
+def geocodificar_ciudad(ciudad: str, idioma: str = "es") -> Optional[dict]:
     if not ciudad:
         return None
     try:
-        url = (
-            "https://geocoding-api.open-meteo.com/v1/search"
-            f"?name={requests.utils.quote(ciudad)}&count=1&language=es&format=json"
-        )
-        r = requests.get(url, timeout=8)
-        r.raise_for_status()
-        data = r.json()
-        results = data.get("results") or []
-        if not results:
-            return None
-        it = results[0]
-        lat = float(it["latitude"])
-        lon = float(it["longitude"])
-        tz = it.get("timezone") or "Europe/Madrid"
-        name = it.get("name") or ciudad
-        country = it.get("country")
-        return {"latitud": lat, "longitud": lon, "ciudad": name, "timezone": tz, "country": country}
+        return _geocodificar(ciudad, idioma)
     except Exception:
         return None
 
@@ -102,9 +123,8 @@ def _elevacion_solar_deg(lat_deg: float, decl_deg: float, hour_angle_deg: float)
 
 
 def _solar_hour_angle(local_dt: dt.datetime, lon: float, tzname: str, n: int) -> float:
-    tz = pytz.timezone(tzname)
-    noon = tz.localize(dt.datetime(local_dt.year, local_dt.month, local_dt.day, 12, 0))
-    tz_hours = noon.utcoffset().total_seconds() / 3600.0
+    noon = dt.datetime(local_dt.year, local_dt.month, local_dt.day, 12, 0)
+    tz_hours = zonas.offset_local(tzname, noon) / 3600.0
 
     eot = _equation_of_time_minutes(n)
     hora_decimal = local_dt.hour + local_dt.minute / 60.0 + local_dt.second / 3600.0
@@ -124,62 +144,137 @@ def _interp_time(t1: dt.datetime, e1: float, t2: dt.datetime, e2: float, target:
     return t1 + (t2 - t1) * frac
 
 
-def calcular_intervalos_30_40(
-    lat: float,
-    lon: float,
-    fecha: dt.date,
-    tzname: str,
-    paso_min: int = 1,
-) -> Tuple[Optional[Tuple[dt.datetime, dt.datetime]], Optional[Tuple[dt.datetime, dt.datetime]]]:
+# --------------------------------------------
+# 3b) Solver analítico (sin barrido minuto a minuto)
+# --------------------------------------------
+# La elevación solo depende del minuto a través del ángulo horario, que es
+# lineal en el minuto local: H(m) = m/4 + corr/4 - 180. Así que los cruces con
+# 30°/40° y el mediodía salen en forma cerrada; luego evaluamos solo los
+# minutos de la rejilla vecinos a cada cruce para reproducir exactamente la
+# interpolación del barrido original (mismos datetimes, al microsegundo).
+@lru_cache(maxsize=1)
+def _tablas_dia_del_anio() -> Tuple[List[float], List[float]]:
+    # Declinación y EoT solo dependen del día del año: se calculan una vez (n = 0..366).
+    return (
+        [_declinacion_solar(n) for n in range(367)],
+        [_equation_of_time_minutes(n) for n in range(367)],
+    )
+
+
+def _parametros_dia(lon: float, fecha: dt.date, tzname: str) -> Tuple[dt.datetime, float, float]:
     """
-    Devuelve 2 tramos (mañana/tarde) donde elevación ∈ [30,40].
-    Si un tramo cruza las 12:00, se parte.
+    (base, decl, corr_min) del día: todo lo que NO depende del minuto.
+    base = medianoche local (aware, offset fijo), corr_min = EoT + corrección de longitud.
     """
-    tz = pytz.timezone(tzname)
     n = fecha.timetuple().tm_yday
-    decl = _declinacion_solar(n)
+    decls, eots = _tablas_dia_del_anio()
+    decl = decls[n]
+
+    noon = dt.datetime(fecha.year, fecha.month, fecha.day, 12, 0)
+    tz_hours = zonas.offset_local(tzname, noon) / 3600.0
+    L_std = 15.0 * tz_hours
+    corr_min = eots[n] + 4.0 * (lon - L_std)
 
-    base = tz.localize(dt.datetime(fecha.year, fecha.month, fecha.day, 0, 0))
-    puntos: List[Tuple[dt.datetime, float]] = []
+    base = zonas.localizar(tzname, dt.datetime(fecha.year, fecha.month, fecha.day, 0, 0))
+    return base, decl, corr_min
 
-    for m in range(0, 24 * 60, paso_min):
-        t = base + dt.timedelta(minutes=m)
-        h_angle = _solar_hour_angle(t, lon, tzname, n)
-        elev = _elevacion_solar_deg(lat, decl, h_angle)
-        puntos.append((t, elev))
+
+def _elev_minuto(lat: float, decl: float, corr_min: float, m: int) -> float:
+    # Mismas operaciones (y mismo redondeo) que _solar_hour_angle + _elevacion_solar_deg (segundos = 0).
+    hora_decimal = m // 60 + (m % 60) / 60.0
+    hora_solar = hora_decimal + corr_min / 60.0
+    return _elevacion_solar_deg(lat, decl, 15.0 * (hora_solar - 12.0))
+
+
+def _minutos_cruce(lat: float, decl: float, corr_min: float, target: float) -> List[float]:
+    """
+    Minutos locales (float, sin recortar al día) en los que la elevación vale `target`.
+    Vacío si el sol nunca llega (o nunca baja) a esa altura.
+    """
+    den = math.cos(math.radians(lat)) * math.cos(math.radians(decl))
+    if abs(den) < 1e-12:
+        return []
+    x = (math.sin(math.radians(target)) - math.sin(math.radians(lat)) * math.sin(math.radians(decl))) / den
+    if x < -1.0 or x > 1.0:
+        return []
+    h = math.degrees(math.acos(x))
+    m0 = 720.0 - corr_min
+    out: List[float] = []
+    for k in (-1440.0, 0.0, 1440.0):
+        out.append(m0 - 4.0 * h + k)
+        out.append(m0 + 4.0 * h + k)
+    return out
+
+
+def _tramos_banda(
+    lat: float,
+    decl: float,
+    corr_min: float,
+    base: dt.datetime,
+    lo: float,
+    hi: float,
+    paso_min: int = 1,
+) -> List[Tuple[dt.datetime, dt.datetime]]:
+    """
+    Tramos del día con elevación ∈ [lo, hi], con la misma lógica de entrada/salida
+    que el barrido por minutos, pero evaluando solo la rejilla alrededor de cada cruce.
+    """
+    minutos = range(0, 24 * 60, paso_min)
+    n_pts = len(minutos)
+    cache: dict = {}
+
+    def elev(i: int) -> float:
+        if i not in cache:
+            cache[i] = _elev_minuto(lat, decl, corr_min, minutos[i])
+        return cache[i]
 
     def in_band(e: float) -> bool:
-        return 30.0 <= e <= 40.0
+        return lo <= e <= hi
+
+    # índices i donde cambia el estado entre el punto i-1 y el i
+    cambios = set()
+    for target in (lo, hi):
+        for r in _minutos_cruce(lat, decl, corr_min, target):
+            k = int(math.floor(r / paso_min))
+            for i in (k, k + 1, k + 2):
+                if 1 <= i < n_pts and in_band(elev(i - 1)) != in_band(elev(i)):
+                    cambios.add(i)
+
+    def t_at(i: int) -> dt.datetime:
+        return base + dt.timedelta(minutes=minutos[i])
 
     tramos: List[Tuple[dt.datetime, dt.datetime]] = []
     en = False
     ini: Optional[dt.datetime] = None
 
-    for i in range(1, len(puntos)):
-        t_prev, e_prev = puntos[i - 1]
-        t, e = puntos[i]
-
+    for i in sorted(cambios):
+        e_prev, e = elev(i - 1), elev(i)
         prev_in = in_band(e_prev)
         curr_in = in_band(e)
 
         if (not prev_in) and curr_in:
-            # entrada: interpolar a 30 (normalmente)
-            ini = _interp_time(t_prev, e_prev, t, e, 30.0)
+            # entrada: interpolar a lo (normalmente)
+            ini = _interp_time(t_at(i - 1), e_prev, t_at(i), e, lo)
             en = True
 
         elif prev_in and (not curr_in) and en and ini is not None:
-            # salida: interpolar a 30 o 40 dependiendo por dónde sale
-            target = 30.0 if e < 30.0 else 40.0
-            fin = _interp_time(t_prev, e_prev, t, e, target)
+            # salida: interpolar a lo o hi dependiendo por dónde sale
+            target = lo if e < lo else hi
+            fin = _interp_time(t_at(i - 1), e_prev, t_at(i), e, target)
             tramos.append((ini, fin))
             en = False
             ini = None
 
     if en and ini is not None:
-        tramos.append((ini, puntos[-1][0]))
+        tramos.append((ini, t_at(n_pts - 1)))
+
+    return tramos
 
-    mediodia = tz.localize(dt.datetime(fecha.year, fecha.month, fecha.day, 12, 0))
 
+def _partir_en_mediodia(
+    tramos: List[Tuple[dt.datetime, dt.datetime]],
+    mediodia: dt.datetime,
+) -> Tuple[Optional[Tuple[dt.datetime, dt.datetime]], Optional[Tuple[dt.datetime, dt.datetime]]]:
     tramo_m: Optional[Tuple[dt.datetime, dt.datetime]] = None
     tramo_t: Optional[Tuple[dt.datetime, dt.datetime]] = None
 
@@ -198,30 +293,610 @@ def calcular_intervalos_30_40(
     return tramo_m, tramo_t
 
 
+def _mediodia_rejilla(
+    lat: float,
+    decl: float,
+    corr_min: float,
+    base: dt.datetime,
+    paso_min: int = 1,
+) -> Tuple[dt.datetime, float]:
+    # El máximo de la rejilla está junto al mediodía analítico (o en un extremo
+    # del día si éste cae fuera); se conserva el desempate "primer máximo".
+    minutos = range(0, 24 * 60, paso_min)
+    n_pts = len(minutos)
+    m0 = (720.0 - corr_min) % 1440.0
+    k = int(math.floor(m0 / paso_min))
+    candidatos = sorted({i for i in (0, k, k + 1, n_pts - 1) if 0 <= i < n_pts})
+
+    best_i = 0
+    best_e = -999.0
+    for i in candidatos:
+        e = _elev_minuto(lat, decl, corr_min, minutos[i])
+        if e > best_e:
+            best_e = e
+            best_i = i
+
+    return base + dt.timedelta(minutes=minutos[best_i]), float(best_e)
+
+
+def calcular_intervalos_30_40(
+    lat: float,
+    lon: float,
+    fecha: dt.date,
+    tzname: str,
+    paso_min: int = 1,
+    modelo: Optional[str] = None,
+) -> Tuple[Optional[Tuple[dt.datetime, dt.datetime]], Optional[Tuple[dt.datetime, dt.datetime]]]:
+    """
+    Devuelve 2 tramos (mañana/tarde) donde elevación ∈ [30,40].
+    Si un tramo cruza las 12:00, se parte.
+    modelo: "legacy" | "fast" | "precise" (por defecto SOLAR_MODEL); paso_min solo aplica a "legacy".
+    """
+    if _modelo(modelo) != "legacy":
+        return _dia_solar_continuo(lat, lon, fecha, tzname, [BANDA_30_40], _modelo(modelo)).intervalos
+
+    base, decl, corr_min = _parametros_dia(lon, fecha, tzname)
+    tramos = _tramos_banda(lat, decl, corr_min, base, 30.0, 40.0, paso_min)
+    mediodia = zonas.localizar(tzname, dt.datetime(fecha.year, fecha.month, fecha.day, 12, 0))
+    return _partir_en_mediodia(tramos, mediodia)
+
+
 def calcular_mediodia_solar(
     lat: float,
     lon: float,
     fecha: dt.date,
     tzname: str,
     paso_min: int = 1,
+    modelo: Optional[str] = None,
 ) -> Tuple[dt.datetime, float]:
-    tz = pytz.timezone(tzname)
-    n = fecha.timetuple().tm_yday
-    decl = _declinacion_solar(n)
-    base = tz.localize(dt.datetime(fecha.year, fecha.month, fecha.day, 0, 0))
+    if _modelo(modelo) != "legacy":
+        dia = _dia_solar_continuo(lat, lon, fecha, tzname, [BANDA_30_40], _modelo(modelo))
+        return dia.mediodia, dia.elev_max
 
-    best_t = base
-    best_e = -999.0
+    base, decl, corr_min = _parametros_dia(lon, fecha, tzname)
+    return _mediodia_rejilla(lat, decl, corr_min, base, paso_min)
+
+
+# --------------------------------------------
+# 3b') Día solar completo en una pasada
+# --------------------------------------------
+Tramo = Optional[Tuple[dt.datetime, dt.datetime]]
+Banda = Tuple[float, Optional[float]]  # (min, max); max None = sin límite (p.ej. >45°)
+
+BANDA_30_40: Banda = (30.0, 40.0)
 
-    for m in range(0, 24 * 60, paso_min):
-        t = base + dt.timedelta(minutes=m)
-        h_angle = _solar_hour_angle(t, lon, tzname, n)
-        elev = _elevacion_solar_deg(lat, decl, h_angle)
-        if elev > best_e:
-            best_e = elev
-            best_t = t
 
-    return best_t, float(best_e)
+class SolarDay:
+    """
+    Todo lo solar de un día y lugar: tramos (mañana, tarde) por banda de
+    elevación, mediodía solar y altura máxima. La banda 30–40° siempre está.
+    """
+    __slots__ = ("fecha", "tz", "mediodia", "elev_max", "bandas")
+
+    def __init__(
+        self,
+        fecha: dt.date,
+        tz: str,
+        mediodia: dt.datetime,
+        elev_max: float,
+        bandas: Dict[Banda, Tuple[Tramo, Tramo]],
+    ):
+        self.fecha = fecha
+        self.tz = tz
+        self.mediodia = mediodia
+        self.elev_max = elev_max
+        self.bandas = bandas
+
+    @property
+    def intervalos(self) -> Tuple[Tramo, Tramo]:
+        return self.bandas[BANDA_30_40]
+
+    @property
+    def tramo_m(self) -> Tramo:
+        return self.intervalos[0]
+
+    @property
+    def tramo_t(self) -> Tramo:
+        return self.intervalos[1]
+
+    def banda(self, lo: float, hi: Optional[float] = None) -> Tuple[Tramo, Tramo]:
+        return self.bandas.get((float(lo), None if hi is None else float(hi)), (None, None))
+
+    def __repr__(self) -> str:
+        return f"SolarDay({self.fecha}, {self.tz}, mediodia={self.mediodia:%H:%M}, elev_max={self.elev_max:.1f})"
+
+
+def calcular_dia_solar(
+    lat: float,
+    lon: float,
+    fecha: dt.date,
+    tzname: str,
+    bandas_extra: Sequence[Banda] = (),
+    paso_min: int = 1,
+    modelo: Optional[str] = None,
+) -> SolarDay:
+    """
+    Ventanas 30–40° (+ bandas_extra), mediodía y altura máxima con un único
+    cálculo de los parámetros del día. Mismos resultados que
+    calcular_intervalos_30_40 + calcular_mediodia_solar con el mismo modelo.
+    """
+    return _dia_solar(lat, lon, fecha, tzname, _normalizar_bandas(bandas_extra), paso_min, _modelo(modelo))
+
+
+def _normalizar_bandas(bandas_extra: Sequence[Banda]) -> List[Banda]:
+    out: List[Banda] = [BANDA_30_40]
+    for lo, hi in bandas_extra:
+        key = (float(lo), None if hi is None else float(hi))
+        if key not in out:
+            out.append(key)
+    return out
+
+
+def _dia_solar(
+    lat: float,
+    lon: float,
+    fecha: dt.date,
+    tzname: str,
+    bandas: List[Banda],
+    paso_min: int,
+    modelo: str = "legacy",
+) -> SolarDay:
+    if modelo != "legacy":
+        return _dia_solar_continuo(lat, lon, fecha, tzname, bandas, modelo)
+
+    base, decl, corr_min = _parametros_dia(lon, fecha, tzname)
+    mediodia = zonas.localizar(tzname, dt.datetime(fecha.year, fecha.month, fecha.day, 12, 0))
+
+    tramos_por_banda: Dict[Banda, Tuple[Tramo, Tramo]] = {}
+    for lo, hi in bandas:
+        tramos = _tramos_banda(lat, decl, corr_min, base, lo, 90.0 if hi is None else hi, paso_min)
+        tramos_por_banda[(lo, hi)] = _partir_en_mediodia(tramos, mediodia)
+
+    t_noon, elev_max = _mediodia_rejilla(lat, decl, corr_min, base, paso_min)
+    return SolarDay(fecha, tzname, t_noon, elev_max, tramos_por_banda)
+
+
+def iterar_dias_solares(
+    lat: float,
+    lon: float,
+    inicio: dt.date,
+    fin: dt.date,
+    tzname: str,
+    bandas_extra: Sequence[Banda] = (),
+    paso_min: int = 1,
+    modelo: Optional[str] = None,
+) -> Iterator[SolarDay]:
+    """
+    SolarDay de cada día de [inicio, fin] (ambos incluidos), generado bajo demanda.
+    Declinación/EoT salen de la tabla por día del año y los offsets de la tabla
+    anual de la zona, así que cada día extra cuesta lo mismo que un acierto de caché
+    (útil para el calendario de 180 días o para rellenar histórico; para
+    histórico conviene modelo="precise").
+    """
+    bandas = _normalizar_bandas(bandas_extra)
+    modelo = _modelo(modelo)
+    d = inicio
+    while d <= fin:
+        yield _dia_solar(lat, lon, d, tzname, bandas, paso_min, modelo)
+        d += dt.timedelta(days=1)
+
+
+# --------------------------------------------
+# 3d) Modelos de precisión: legacy / fast / precise
+# --------------------------------------------
+# - legacy:  aproximaciones originales (_declinacion_solar, _equation_of_time_minutes),
+#            idéntico al barrido minuto a minuto. Sin refracción.
+# - fast:    declinación y EoT NOAA tabuladas por día (interpoladas al mediodía del
+#            lugar) + solución cerrada + refracción en los umbrales. ~1 min de error.
+# - precise: posición NOAA completa en cada instante + refracción; cruces por bisección.
+# fast y precise calculan instantes reales (correctos también en días de cambio de hora).
+# Por defecto legacy (mismos mensajes que el barrido original); fast/precise, con SOLAR_MODEL
+# o pasando modelo=... explícitamente.
+MODELOS = ("legacy", "fast", "precise")
+MODELO_DEFECTO = (os.getenv("SOLAR_MODEL") or "legacy").strip().lower()
+
+
+def _modelo(modelo: Optional[str]) -> str:
+    m = (modelo or MODELO_DEFECTO or "legacy").strip().lower()
+    if m not in MODELOS:
+        raise ValueError(f"Modelo solar desconocido: {modelo!r} (usa {', '.join(MODELOS)})")
+    return m
+
+
+def _sol_noaa(jd: float) -> Tuple[float, float]:
+    """(declinación en grados, ecuación del tiempo en minutos) NOAA para un día juliano."""
+    T = (jd - 2451545.0) / 36525.0
+
+    L0 = (280.46646 + T * (36000.76983 + T * 0.0003032)) % 360.0
+    M = math.radians(357.52911 + T * (35999.05029 - 0.0001537 * T))
+    e = 0.016708634 - T * (0.000042037 + 0.0000001267 * T)
+    C = (
+        math.sin(M) * (1.914602 - T * (0.004817 + 0.000014 * T))
+        + math.sin(2 * M) * (0.019993 - 0.000101 * T)
+        + math.sin(3 * M) * 0.000289
+    )
+    omega = math.radians(125.04 - 1934.136 * T)
+    app_long = math.radians(L0 + C - 0.00569 - 0.00478 * math.sin(omega))
+    eps0 = 23.0 + (26.0 + (21.448 - T * (46.815 + T * (0.00059 - T * 0.001813))) / 60.0) / 60.0
+    eps = math.radians(eps0 + 0.00256 * math.cos(omega))
+
+    decl = math.degrees(math.asin(math.sin(eps) * math.sin(app_long)))
+    y = math.tan(eps / 2.0) ** 2
+    L0r = math.radians(L0)
+    eot = 4.0 * math.degrees(
+        y * math.sin(2 * L0r)
+        - 2 * e * math.sin(M)
+        + 4 * e * y * math.sin(M) * math.cos(2 * L0r)
+        - 0.5 * y * y * math.sin(4 * L0r)
+        - 1.25 * e * e * math.sin(2 * M)
+    )
+    return decl, eot
+
+
+def _refraccion_deg(alt: float) -> float:
+    """Refracción atmosférica NOAA (grados) para una altura verdadera."""
+    if alt > 85.0:
+        r = 0.0
+    elif alt > 5.0:
+        te = math.tan(math.radians(alt))
+        r = 58.1 / te - 0.07 / te ** 3 + 0.000086 / te ** 5
+    elif alt > -0.575:
+        r = 1735.0 + alt * (-518.2 + alt * (103.4 + alt * (-12.79 + alt * 0.711)))
+    else:
+        r = -20.774 / math.tan(math.radians(alt))
+    return r / 3600.0
+
+
+def _jd(t_utc: dt.datetime) -> float:
+    return t_utc.timestamp() / 86400.0 + 2440587.5
+
+
+def _elevacion_noaa(lat: float, lon: float, t_utc: dt.datetime) -> float:
+    """Elevación aparente (con refracción) NOAA en un instante (aware)."""
+    decl, eot = _sol_noaa(_jd(t_utc))
+    t = t_utc.astimezone(dt.timezone.utc)
+    min_utc = t.hour * 60.0 + t.minute + t.second / 60.0 + t.microsecond / 6e7
+    ha = (min_utc + eot + 4.0 * lon) / 4.0 - 180.0
+    alt = _elevacion_solar_deg(lat, decl, ha)
+    return alt + _refraccion_deg(alt)
+
+
+@lru_cache(maxsize=8)
+def _tabla_noaa(year: int) -> Tuple[List[float], List[float]]:
+    # Declinación y EoT NOAA a las 00:00 UTC de cada día (índice 0 = 1 de enero),
+    # con un día extra para interpolar el 31 de diciembre.
+    jd0 = _jd(dt.datetime(year, 1, 1, tzinfo=dt.timezone.utc))
+    pares = [_sol_noaa(jd0 + i) for i in range(368)]
+    return [p[0] for p in pares], [p[1] for p in pares]
+
+
+def _decl_eot_rapido(t_utc: dt.datetime) -> Tuple[float, float]:
+    """Declinación y EoT interpoladas linealmente en la tabla anual (modelo fast)."""
+    t = t_utc.astimezone(dt.timezone.utc)
+    decls, eots = _tabla_noaa(t.year)
+    x = (t - dt.datetime(t.year, 1, 1, tzinfo=dt.timezone.utc)).total_seconds() / 86400.0
+    i = int(x)
+    f = x - i
+    return decls[i] + (decls[i + 1] - decls[i]) * f, eots[i] + (eots[i + 1] - eots[i]) * f
+
+
+def _altura_verdadera(aparente: float) -> float:
+    # altura verdadera cuya altura aparente (con refracción) es `aparente`
+    return aparente - _refraccion_deg(aparente - _refraccion_deg(aparente))
+
+
+def _a_local(tzname: str, t_utc: dt.datetime) -> dt.datetime:
+    return t_utc.astimezone(zonas.tzinfo_fijo(zonas.offset_utc(tzname, t_utc)))
+
+
+def _dia_solar_continuo(
+    lat: float,
+    lon: float,
+    fecha: dt.date,
+    tzname: str,
+    bandas: List[Banda],
+    modelo: str,
+) -> SolarDay:
+    """SolarDay con los modelos fast/precise: instantes reales, sin rejilla de minutos."""
+    t0 = zonas.localizar(tzname, dt.datetime(fecha.year, fecha.month, fecha.day, 0, 0)).astimezone(dt.timezone.utc)
+    siguiente = fecha + dt.timedelta(days=1)
+    t1 = zonas.localizar(tzname, dt.datetime(siguiente.year, siguiente.month, siguiente.day, 0, 0)).astimezone(dt.timezone.utc)
+    dur = (t1 - t0).total_seconds() / 60.0
+
+    # mediodía solar (fast): 12:00 UTC - 4·lon - EoT, con decl/EoT del propio mediodía
+    dia_utc = dt.datetime(fecha.year, fecha.month, fecha.day, tzinfo=dt.timezone.utc)
+    aprox = dia_utc + dt.timedelta(minutes=720.0 - 4.0 * lon)
+    decl, eot = _decl_eot_rapido(aprox)
+    m_noon = (dia_utc - t0).total_seconds() / 60.0 + 720.0 - 4.0 * lon - eot
+    # el mediodía que cae dentro del día local (o el más cercano)
+    m_noon = min((m_noon + k for k in (-1440.0, 0.0, 1440.0)), key=lambda m: abs(m - dur / 2.0))
+
+    sin_sin = math.sin(math.radians(lat)) * math.sin(math.radians(decl))
+    cos_cos = math.cos(math.radians(lat)) * math.cos(math.radians(decl))
+
+    def elev_fast(m: float) -> float:
+        alt = _elevacion_solar_deg(lat, decl, (m - m_noon) / 4.0)
+        return alt + _refraccion_deg(alt)
+
+    def elev_precise(m: float) -> float:
+        return _elevacion_noaa(lat, lon, t0 + dt.timedelta(minutes=m))
+
+    elev = elev_precise if modelo == "precise" else elev_fast
+
+    if modelo == "precise":
+        m_noon = _refinar_maximo(elev, m_noon)
+    elev_max = elev(m_noon)
+
+    def cruces(aparente: float) -> List[float]:
+        out: List[float] = []
+        if modelo == "precise":
+            # la elevación es monótona entre medianoche y mediodía solar: bisección en cada mitad
+            for k in (-1440.0, 0.0, 1440.0):
+                for a, b in ((m_noon + k - 720.0, m_noon + k), (m_noon + k, m_noon + k + 720.0)):
+                    if b > 0.0 and a < dur:
+                        m = _biseccion(elev, a, b, aparente)
+                        if m is not None and 0.0 < m < dur:
+                            out.append(m)
+            return out
+
+        if abs(cos_cos) < 1e-12:
+            return out
+        x = (math.sin(math.radians(_altura_verdadera(aparente))) - sin_sin) / cos_cos
+        if x < -1.0 or x > 1.0:
+            return out
+        h = 4.0 * math.degrees(math.acos(x))
+        for k in (-1440.0, 0.0, 1440.0):
+            for m in (m_noon + k - h, m_noon + k + h):
+                if 0.0 < m < dur:
+                    out.append(m)
+        return out
+
+    mediodia_local = zonas.localizar(tzname, dt.datetime(fecha.year, fecha.month, fecha.day, 12, 0))
+    tramos_por_banda: Dict[Banda, Tuple[Tramo, Tramo]] = {}
+    for lo, hi in bandas:
+        eventos = sorted(set([0.0, dur] + cruces(lo) + (cruces(hi) if hi is not None else [])))
+        tramos: List[Tuple[dt.datetime, dt.datetime]] = []
+        for a, b in zip(eventos, eventos[1:]):
+            e = elev((a + b) / 2.0)
+            if lo <= e and (hi is None or e <= hi):
+                ta = _a_local(tzname, t0 + dt.timedelta(minutes=a))
+                tb = _a_local(tzname, t0 + dt.timedelta(minutes=b))
+                if tramos and tramos[-1][1] == ta:
+                    tramos[-1] = (tramos[-1][0], tb)
+                else:
+                    tramos.append((ta, tb))
+        tramos_por_banda[(lo, hi)] = _partir_en_mediodia(tramos, mediodia_local)
+
+    t_noon = _a_local(tzname, t0 + dt.timedelta(minutes=m_noon))
+    return SolarDay(fecha, tzname, t_noon, float(elev_max), tramos_por_banda)
+
+
+def _biseccion(elev, a: float, b: float, target: float) -> Optional[float]:
+    """Cruce de `elev` (monótona en [a, b]) con `target`, a ~0,05 s; None si no lo hay."""
+    ea, eb = elev(a) - target, elev(b) - target
+    if (ea >= 0) == (eb >= 0):
+        return None
+    for _ in range(24):
+        mid = (a + b) / 2.0
+        em = elev(mid) - target
+        if (em >= 0) == (ea >= 0):
+            a, ea = mid, em
+        else:
+            b = mid
+    return (a + b) / 2.0
+
+
+def _refinar_maximo(elev, m: float, margen: float = 10.0) -> float:
+    # búsqueda de sección áurea del máximo alrededor de m (~0,1 s)
+    g = (math.sqrt(5.0) - 1.0) / 2.0
+    a, b = m - margen, m + margen
+    c, d = b - g * (b - a), a + g * (b - a)
+    ec, ed = elev(c), elev(d)
+    while b - a > 0.002:
+        if ec < ed:
+            a, c, ec = c, d, ed
+            d = a + g * (b - a)
+            ed = elev(d)
+        else:
+            b, d, ed = d, c, ec
+            c = b - g * (b - a)
+            ec = elev(c)
+    return (a + b) / 2.0
+
+
+# --------------------------------------------
+# 3c) Lote vectorizado (usuarios × días) con NumPy
+# --------------------------------------------
+def _partir_en_mediodia_np(
+    tramos: List[Tuple["np.ndarray", "np.ndarray"]],
+    corte: "np.ndarray",
+) -> Tuple["np.ndarray", ...]:
+    """
+    Igual que _partir_en_mediodia pero sobre arrays de minutos locales
+    (NaN = tramo inexistente). `corte` = las 12:00 locales en minutos desde la
+    medianoche (720 salvo en días de cambio de hora).
+    """
+    shape = tramos[0][0].shape
+    m_a = np.full(shape, np.nan)
+    m_b = np.full(shape, np.nan)
+    t_a = np.full(shape, np.nan)
+    t_b = np.full(shape, np.nan)
+
+    with np.errstate(invalid="ignore"):
+        for a, b in tramos:
+            ok = ~np.isnan(a)
+            cruza = ok & (a < corte) & (corte < b)
+            antes = ok & ~cruza & (b <= corte) & (np.isnan(m_b) | (b > m_b))
+            despues = ok & ~cruza & (a >= corte) & (np.isnan(t_a) | (a < t_a))
+
+            m_a = np.where(cruza, a, np.where(antes, a, m_a))
+            m_b = np.where(cruza, corte, np.where(antes, b, m_b))
+            t_a = np.where(cruza, corte, np.where(despues, a, t_a))
+            t_b = np.where(cruza, b, np.where(despues, b, t_b))
+
+    return m_a, m_b, t_a, t_b
+
+
+# usuario-días por bloque en calcular_ventanas_lote (cada uno lleva 36 minutos candidatos)
+_LOTE_CELDAS = 65536
+
+
+def _ventanas_bloque(
+    lat: "np.ndarray",
+    decl: "np.ndarray",
+    corr_min: "np.ndarray",
+    corte: "np.ndarray",
+) -> Tuple["np.ndarray", ...]:
+    """
+    _tramos_banda + _partir_en_mediodia + _mediodia_rejilla (paso 1 min) sobre
+    arrays (U, D): mismos minutos de la rejilla, mismos cruces envueltos ±1440
+    y misma interpolación, así que sale lo mismo que el cálculo escalar.
+    """
+    lat_r = np.radians(lat)
+    dec_r = np.radians(decl)
+    sin_sin = (np.sin(lat_r) * np.sin(dec_r))[..., None]
+    cos_cos = (np.cos(lat_r) * np.cos(dec_r))[..., None]
+    corr = corr_min[..., None]
+
+    def elev(m):
+        # mismas operaciones que _elev_minuto
+        hora_solar = (np.floor_divide(m, 60.0) + np.mod(m, 60.0) / 60.0) + corr / 60.0
+        h = np.radians(15.0 * (hora_solar - 12.0))
+        return np.degrees(np.arcsin(np.clip(sin_sin + cos_cos * np.cos(h), -1.0, 1.0)))
+
+    # minutos candidatos: los 3 siguientes a cada cruce de _minutos_cruce (30° y 40°, ±1440)
+    m0 = 720.0 - corr_min
+    cand = []
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for target in (30.0, 40.0):
+            x = (math.sin(math.radians(target)) - sin_sin[..., 0]) / cos_cos[..., 0]
+            semi = np.where((np.abs(cos_cos[..., 0]) >= 1e-12) & (np.abs(x) <= 1.0),
+                            4.0 * np.degrees(np.arccos(np.clip(x, -1.0, 1.0))), np.nan)
+            for r in (m0 - semi, m0 + semi):
+                for k in (-1440.0, 0.0, 1440.0):
+                    piso = np.floor(r + k)
+                    cand += [piso, piso + 1.0, piso + 2.0]
+    idx = np.stack(cand, axis=-1)
+    idx = np.sort(np.where((idx >= 1.0) & (idx < 1440.0), idx, np.inf), axis=-1)
+    valido = np.isfinite(idx)
+    valido[..., 1:] &= idx[..., 1:] != idx[..., :-1]
+    idx = np.where(valido, idx, 1.0)
+
+    e_prev = elev(idx - 1.0)
+    e_cur = elev(idx)
+    in_prev = (30.0 <= e_prev) & (e_prev <= 40.0)
+    in_cur = (30.0 <= e_cur) & (e_cur <= 40.0)
+    cambio = valido & (in_prev != in_cur)
+
+    def interp(j: int, target) -> "np.ndarray":
+        # _interp_time en minutos: fracción recortada a [0, 1]; sin pendiente, el minuto i
+        e1, e2 = e_prev[..., j], e_cur[..., j]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            frac = np.clip((target - e1) / (e2 - e1), 0.0, 1.0)
+        return np.where(e2 == e1, idx[..., j], idx[..., j] - 1.0 + frac)
+
+    shape = lat.shape[:1] + corr_min.shape[1:]
+    en = np.zeros(shape, dtype=bool)
+    ini = np.full(shape, np.nan)
+    tramos = []
+    for j in range(idx.shape[-1]):
+        entra = cambio[..., j] & ~in_prev[..., j] & in_cur[..., j]
+        sale = cambio[..., j] & in_prev[..., j] & ~in_cur[..., j] & en
+        if sale.any():
+            fin = interp(j, np.where(e_cur[..., j] < 30.0, 30.0, 40.0))
+            tramos.append((np.where(sale, ini, np.nan), np.where(sale, fin, np.nan)))
+        if entra.any():
+            ini = np.where(entra, interp(j, 30.0), ini)
+        en = (en | entra) & ~sale
+    tramos.append((np.where(en, ini, np.nan), np.where(en, 1439.0, np.nan)))
+
+    m_a, m_b, t_a, t_b = _partir_en_mediodia_np(tramos, corte)
+
+    # _mediodia_rejilla: primer máximo entre 0, k, k+1 y 1439
+    k = np.floor(np.mod(m0, 1440.0))
+    mediodia = np.zeros(shape)
+    elev_max = np.full(shape, -999.0)
+    for m in (np.zeros(shape), k, k + 1.0, np.full(shape, 1439.0)):
+        e = elev(m[..., None])[..., 0]
+        mejor = (m < 1440.0) & (e > elev_max)
+        mediodia = np.where(mejor, m, mediodia)
+        elev_max = np.where(mejor, e, elev_max)
+
+    return m_a, m_b, t_a, t_b, mediodia, elev_max
+
+
+def calcular_ventanas_lote(
+    lats,
+    lons,
+    tznames,
+    fecha_ini: dt.date,
+    fecha_fin: Optional[dt.date] = None,
+) -> dict:
+    """
+    Versión por lotes de calcular_intervalos_30_40 + calcular_mediodia_solar
+    (modelo "legacy") para U usuarios y los días [fecha_ini, fecha_fin] (ambos incluidos).
+
+    Devuelve arrays (U, D) en minutos locales desde medianoche (NaN = sin tramo):
+      manana_ini, manana_fin, tarde_ini, tarde_fin, mediodia, elev_max
+    y "fechas" (lista de D fechas). Mismo resultado que el cálculo escalar,
+    también con la zona lejos de la longitud solar (tramos junto a medianoche).
+    Usa minutos_a_datetime() para pasar a datetimes.
+    """
+    if fecha_fin is None:
+        fecha_fin = fecha_ini
+    fechas = [fecha_ini + dt.timedelta(days=i) for i in range((fecha_fin - fecha_ini).days + 1)]
+
+    lat = np.asarray(lats, dtype=float).reshape(-1, 1)
+    lon = np.asarray(lons, dtype=float).reshape(-1, 1)
+    tz_unicas, tz_idx = np.unique(np.asarray(tznames, dtype=object).astype(str), return_inverse=True)
+    tz_idx = tz_idx.reshape(-1)
+
+    decls, eots = _tablas_dia_del_anio()
+    ns = [f.timetuple().tm_yday for f in fechas]
+    decl = np.array([decls[n] for n in ns]).reshape(1, -1)
+    eot = np.array([eots[n] for n in ns]).reshape(1, -1)
+
+    # offsets UTC a las 00:00 y 12:00 locales: una fila por zona distinta, no por usuario
+    tz_hours = np.empty((len(tz_unicas), len(fechas)))
+    tz_hours_00 = np.empty((len(tz_unicas), len(fechas)))
+    for j, tzname in enumerate(tz_unicas):
+        for k, f in enumerate(fechas):
+            tz_hours[j, k] = zonas.offset_local(tzname, dt.datetime(f.year, f.month, f.day, 12, 0)) / 3600.0
+            tz_hours_00[j, k] = zonas.offset_local(tzname, dt.datetime(f.year, f.month, f.day, 0, 0)) / 3600.0
+
+    corr_min = eot + 4.0 * (lon - 15.0 * tz_hours[tz_idx])
+    # los minutos cuentan desde la medianoche (con su offset): en días de cambio
+    # de hora las 12:00 locales no caen en el minuto 720
+    corte = 720.0 - 60.0 * (tz_hours - tz_hours_00)[tz_idx]
+
+    # por bloques de usuarios: los candidatos ocupan 36 valores por usuario-día
+    filas = max(1, _LOTE_CELDAS // len(fechas))
+    partes = [
+        _ventanas_bloque(lat[a:a + filas], decl, corr_min[a:a + filas], corte[a:a + filas])
+        for a in range(0, len(lat), filas)
+    ]
+    m_a, m_b, t_a, t_b, mediodia, elev_max = (
+        np.concatenate([p[i] for p in partes]) if partes else np.empty((0, len(fechas)))
+        for i in range(6)
+    )
+
+    return {
+        "fechas": fechas,
+        "manana_ini": m_a,
+        "manana_fin": m_b,
+        "tarde_ini": t_a,
+        "tarde_fin": t_b,
+        "mediodia": mediodia,
+        "elev_max": elev_max,
+    }
+
+
+def minutos_a_datetime(fecha: dt.date, tzname: str, minutos: float) -> Optional[dt.datetime]:
+    """Minutos desde la medianoche local (como en calcular_ventanas_lote) -> datetime aware."""
+    if minutos is None or math.isnan(minutos):
+        return None
+    base = zonas.localizar(tzname, dt.datetime(fecha.year, fecha.month, fecha.day, 0, 0))
+    return base + dt.timedelta(minutes=float(minutos))
 
 
 # ---------------------------------------
@@ -254,10 +929,29 @@ def describir_intervalos_y_mediodia(
     tzname: str,
     ciudad: str,
 ) -> str:
-    tramos = calcular_intervalos_30_40(lat, lon, fecha, tzname)
-    txt = describir_intervalos_30_40(tramos, ciudad)
-    t_noon, elev_max = calcular_mediodia_solar(lat, lon, fecha, tzname)
-    txt += f"\n\n🧭 Mediodía solar: {t_noon.strftime('%H:%M')} (altura máx ≈ {elev_max:.1f}°)"
+    return describir_dia_solar(calcular_dia_solar(lat, lon, fecha, tzname), ciudad)
+
+
+def describir_mediodia_solar(t_noon: dt.datetime, elev_max: float) -> str:
+    return f"\n\n🧭 Mediodía solar: {t_noon.strftime('%H:%M')} (altura máx ≈ {elev_max:.1f}°)"
+
+
+def _nombre_banda(lo: float, hi: Optional[float]) -> str:
+    return f">{lo:g}°" if hi is None else f"{lo:g}–{hi:g}°"
+
+
+def describir_dia_solar(dia: SolarDay, ciudad: str) -> str:
+    """Ventanas 30–40° + bandas extra (si se calcularon) + mediodía solar."""
+    txt = describir_intervalos_30_40(dia.intervalos, ciudad)
+    for (lo, hi), (maniana, tarde) in dia.bandas.items():
+        if (lo, hi) == BANDA_30_40 or not (maniana or tarde):
+            continue
+        if maniana and tarde and maniana[1] == tarde[0]:
+            # tramo partido a las 12:00: se muestra entero
+            maniana, tarde = (maniana[0], tarde[1]), None
+        partes = [f"{t[0].strftime('%H:%M')}–{t[1].strftime('%H:%M')}" for t in (maniana, tarde) if t]
+        txt += f"\n🔆 {_nombre_banda(lo, hi)}: " + " · ".join(partes)
+    txt += describir_mediodia_solar(dia.mediodia, dia.elev_max)
     return txt
 
 
@@ -298,59 +992,94 @@ def _parse_hourly_time(iso: str, tzname: str) -> Optional[dt.datetime]:
 
     if t.tzinfo is None:
         try:
-            tz = pytz.timezone(tzname)
-            t = tz.localize(t)
+            t = zonas.localizar(tzname, t)
         except Exception:
             pass
     return t
 
 
-def _avg_in_range(
-    times_iso: List[str],
-    values: List[Optional[float]],
-    inicio: dt.datetime,
-    fin: dt.datetime,
-    tzname: str,
-) -> Optional[int]:
-    if not times_iso or not values:
-        return None
-    sel: List[float] = []
-    for iso, val in zip(times_iso, values):
-        if val is None:
-            continue
-        t = _parse_hourly_time(iso, tzname)
-        if t is None:
+class HorasMeteo:
+    """
+    Pronóstico horario ya parseado: instantes en epoch (s) + un array por variable
+    (NaN donde Open-Meteo da null). Se construye una vez por respuesta y es lo
+    que guarda cache_meteo, así que los aciertos no vuelven a parsear fechas.
+    """
+
+    __slots__ = ("tz", "epoch", "valores")
+
+    def __init__(self, tz: str, epoch: array, valores: Dict[str, array]):
+        self.tz = tz
+        self.epoch = epoch
+        self.valores = valores
+
+    def media(self, variable: str, inicio: dt.datetime, fin: dt.datetime) -> Optional[int]:
+        """Media redondeada de `variable` en [inicio, fin] (ambos aware), o None."""
+        vals = self.valores.get(variable)
+        if not vals:
+            return None
+        a = bisect.bisect_left(self.epoch, inicio.timestamp())
+        b = bisect.bisect_right(self.epoch, fin.timestamp())
+        sel = [v for v in vals[a:b] if v == v]  # fuera NaN
+        if not sel:
+            return None
+        return int(round(sum(sel) / len(sel)))
+
+    def __repr__(self) -> str:
+        return f"HorasMeteo({self.tz}, {len(self.epoch)} h, {', '.join(self.valores)})"
+
+
+def preparar_hourly(hourly: Optional[dict], tzname: str) -> Optional[HorasMeteo]:
+    """`hourly` de Open-Meteo -> HorasMeteo (horas sin fecha válida se descartan)."""
+    if hourly is None or isinstance(hourly, HorasMeteo):
+        return hourly
+    times = hourly.get("time") or []
+    epoch = array("d")
+    idx: List[int] = []
+    for i, iso in enumerate(times):
+        t = _parse_hourly_time(iso, tzname) if isinstance(iso, str) else None
+        if t is None or t.tzinfo is None:
             continue
-        # inicio/fin son aware; t ahora también
-        if inicio <= t <= fin:
-            sel.append(float(val))
-    if not sel:
-        return None
-    return int(round(sum(sel) / len(sel)))
+        epoch.append(t.timestamp())
+        idx.append(i)
+
+    # Open-Meteo devuelve las horas en orden; por si acaso
+    if any(b < a for a, b in zip(epoch, epoch[1:])):
+        orden = sorted(range(len(epoch)), key=epoch.__getitem__)
+        epoch = array("d", (epoch[k] for k in orden))
+        idx = [idx[k] for k in orden]
+
+    valores: Dict[str, array] = {}
+    for var in ("cloudcover", "precipitation_probability"):
+        serie = hourly.get(var) or []
+        if serie:
+            valores[var] = array("d", (
+                float(serie[i]) if i < len(serie) and serie[i] is not None else math.nan for i in idx
+            ))
+    return HorasMeteo(tzname, epoch, valores)
 
 
 def resumen_meteo_en_intervalos(
-    intervalos: Tuple[
-        Optional[Tuple[dt.datetime, dt.datetime]],
-        Optional[Tuple[dt.datetime, dt.datetime]],
-    ],
-    hourly: Optional[dict],
+    intervalos: Union[SolarDay, Tuple[Tramo, Tramo]],
+    hourly: Union[HorasMeteo, dict, None],
     tzname: str,
 ) -> Tuple[Optional[int], Optional[int]]:
-    if not hourly:
+    """
+    `intervalos` = (tramo_m, tramo_t) o un SolarDay (se usa su banda 30–40°).
+    `hourly` = HorasMeteo (p. ej. de cache_meteo) o el dict crudo de Open-Meteo.
+    """
+    if isinstance(intervalos, SolarDay):
+        intervalos = intervalos.intervalos
+    horas = preparar_hourly(hourly or None, tzname)
+    if not horas:
         return None, None
 
-    times = hourly.get("time") or []
-    clouds = hourly.get("cloudcover") or []
-    pprec = hourly.get("precipitation_probability") or []
-
     partes = []
     for tramo in intervalos:
         if not tramo:
             continue
         a, b = tramo
-        c = _avg_in_range(times, clouds, a, b, tzname)
-        p = _avg_in_range(times, pprec, a, b, tzname)
+        c = horas.media("cloudcover", a, b)
+        p = horas.media("precipitation_probability", a, b)
         if c is not None or p is not None:
             partes.append((c, p))
 
@@ -366,11 +1095,8 @@ def resumen_meteo_en_intervalos(
 
 
 def formatear_meteo_en_tramos(
-    intervalos: Tuple[
-        Optional[Tuple[dt.datetime, dt.datetime]],
-        Optional[Tuple[dt.datetime, dt.datetime]],
-    ],
-    hourly: Optional[dict],
+    intervalos: Union[SolarDay, Tuple[Tramo, Tramo]],
+    hourly: Union[HorasMeteo, dict, None],
     tzname: str,
 ) -> str:
     c, p = resumen_meteo_en_intervalos(intervalos, hourly, tzname)
@@ -1,16 +1,30 @@
 # usuarios_repo.py (backend en Postgres)
 # Guarda suscriptores/ajustes en Postgres: durable y compartido.
 # Incluye ubicación persistente + ubicación temporal (con caducidad).
+#
+# Variables de entorno:
+#   DATABASE_DSN (o DATABASE_URL) -> conexión (pool compartido, ver pg_pool.py)
+#   MARCAS_LOTE (opcional, 200) -> marcas de "enviado" acumuladas antes de volcarlas (MarcasEnvio)
+#   MARCAS_SEG  (opcional, 3)   -> segundos máximos que una marca espera a volcarse
+#   SUBS_ITERSIZE (opcional, 2000) -> filas por viaje del cursor de servidor en iter_users
+#   ENVIO_LOTE      (opcional, 500) -> usuarios que reserva un worker de una vez (claim_due_*)
+#   ENVIO_LEASE_SEG (opcional, 300) -> segundos que dura la reserva si el worker no marca ni libera
 
 from __future__ import annotations
 
 import os
-from datetime import datetime, date, timezone
-from typing import Dict, Optional, Tuple
+import time
+import socket
+import threading
+from datetime import datetime, date, timedelta, timezone
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 
 import psycopg2
 import psycopg2.extras
-import pytz
+
+import nomenclator
+import pg_pool
+import zonas_horarias as zonas
 
 # ---- idiomas soportados (canónicos) ----
 VALID_LANG = {"es", "en", "fr", "it", "de", "pt", "nl", "sr", "ru"}
@@ -23,71 +37,255 @@ _LANG_ALIAS = {
 # ------------------ conexión ------------------
 
 def _get_conn():
-    url = os.getenv("DATABASE_DSN") or os.getenv("DATABASE_URL")
-    if not url:
-        raise RuntimeError("DATABASE_DSN (o DATABASE_URL) no está definida")
-    conn = psycopg2.connect(url, sslmode="require")
-    conn.autocommit = True
-    return conn
+    # del pool compartido (pg_pool): sin handshake TCP/TLS por consulta
+    return pg_pool.conexion(autocommit=True)
 
 # ------------------ schema / migraciones ------------------
+# Migraciones numeradas e idempotentes; schema_migrations guarda las aplicadas.
+# init_db() en cada arranque cuesta una lectura (MAX(version)) y solo aplica lo
+# que falte, una vez por despliegue. Para cambiar el esquema: añadir un paso al final.
+
+_SQL_BASE = """
+CREATE TABLE IF NOT EXISTS subscribers (
+    chat_id             TEXT PRIMARY KEY,
+    lang                TEXT NOT NULL DEFAULT 'es',
+    city                TEXT,
+    lat                 DOUBLE PRECISION,
+    lon                 DOUBLE PRECISION,
+    tz                  TEXT NOT NULL DEFAULT 'Europe/Madrid',
+
+    last_sent_iso        TEXT,
+    send_hour_local      INTEGER NOT NULL DEFAULT 9,
+
+    -- nocturno parasimpático
+    last_sleep_sent_iso  TEXT,
+    sleep_hour_local     INTEGER NOT NULL DEFAULT 21,
+
+    created_at          TIMESTAMPTZ NOT NULL DEFAULT now(),
+    updated_at          TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+CREATE INDEX IF NOT EXISTS idx_subs_tz ON subscribers (tz);
+"""
+
+# Ubicación efectiva en SQL (misma regla que get_effective_location, salvo el nomenclátor):
+# la temporal si no ha caducado y tiene coordenadas; si no, la persistente.
+_TEMP_ACTIVA = "(temp_until > now() AND temp_lat IS NOT NULL AND temp_lon IS NOT NULL)"
+SQL_UBICACION_EFECTIVA = f"""
+    CASE WHEN {_TEMP_ACTIVA} THEN temp_lat ELSE lat END AS eff_lat,
+    CASE WHEN {_TEMP_ACTIVA} THEN temp_lon ELSE lon END AS eff_lon,
+    CASE WHEN {_TEMP_ACTIVA} THEN COALESCE(NULLIF(temp_tz, ''), tz) ELSE tz END AS eff_tz,
+    CASE WHEN {_TEMP_ACTIVA} THEN COALESCE(temp_city, city) ELSE city END AS eff_city,
+    COALESCE({_TEMP_ACTIVA}, FALSE) AS is_temp
+"""
+
+# Columnas tipadas <-> *_iso de texto (migración 5): la que haya cambiado manda. El código
+# nuevo escribe las tipadas y el antiguo las de texto; así los dos ven lo mismo durante el despliegue.
+_SQL_SYNC_ISO = r"""
+CREATE OR REPLACE FUNCTION subscribers_sync_iso() RETURNS trigger AS $$
+BEGIN
+    -- en INSERT, OLD es NULL (Postgres >= 11, como EXECUTE FUNCTION): vale lo que venga
+    IF NEW.last_sent_date IS DISTINCT FROM OLD.last_sent_date THEN
+        NEW.last_sent_iso := to_char(NEW.last_sent_date, 'YYYY-MM-DD');
+    ELSIF NEW.last_sent_iso IS DISTINCT FROM OLD.last_sent_iso THEN
+        NEW.last_sent_date := CASE WHEN NEW.last_sent_iso ~ '^\d{4}-\d{2}-\d{2}$' THEN NEW.last_sent_iso::date END;
+    END IF;
+
+    IF NEW.last_sleep_sent_date IS DISTINCT FROM OLD.last_sleep_sent_date THEN
+        NEW.last_sleep_sent_iso := to_char(NEW.last_sleep_sent_date, 'YYYY-MM-DD');
+    ELSIF NEW.last_sleep_sent_iso IS DISTINCT FROM OLD.last_sleep_sent_iso THEN
+        NEW.last_sleep_sent_date := CASE WHEN NEW.last_sleep_sent_iso ~ '^\d{4}-\d{2}-\d{2}$' THEN NEW.last_sleep_sent_iso::date END;
+    END IF;
+
+    IF NEW.temp_until IS DISTINCT FROM OLD.temp_until THEN
+        NEW.temp_until_iso := to_char(NEW.temp_until AT TIME ZONE 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS"+00:00"');
+    ELSIF NEW.temp_until_iso IS DISTINCT FROM OLD.temp_until_iso THEN
+        NEW.temp_until := CASE
+            WHEN NEW.temp_until_iso ~ '[T ]\d{2}:\d{2}.*([+-]\d{2}(:?\d{2})?|Z)$' THEN NEW.temp_until_iso::timestamptz
+            WHEN NEW.temp_until_iso ~ '^\d{4}-\d{2}-\d{2}' THEN NEW.temp_until_iso::timestamp AT TIME ZONE 'UTC'
+        END;
+    END IF;
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+"""
+
+# relleno de NULLs en filas antiguas (migraciones 3 y 8, migrate_fill_defaults)
+_SQL_DEFAULTS = (
+    "UPDATE subscribers SET lang='es' WHERE lang IS NULL OR lang='';",
+    "UPDATE subscribers SET tz='Europe/Madrid' WHERE tz IS NULL OR tz='';",
+    "UPDATE subscribers SET send_hour_local=9 WHERE send_hour_local IS NULL;",
+    "UPDATE subscribers SET sleep_hour_local=21 WHERE sleep_hour_local IS NULL;",
+    "UPDATE subscribers SET updated_at=now() WHERE updated_at IS NULL;",
+)
+
+# (versión, descripción, sentencias)
+MIGRACIONES: List[Tuple[int, str, Tuple[str, ...]]] = [
+    (1, "tabla subscribers", (
+        _SQL_BASE,
+        # por si existían versiones antiguas de la tabla
+        "ALTER TABLE subscribers ADD COLUMN IF NOT EXISTS last_sent_iso TEXT;",
+        "ALTER TABLE subscribers ADD COLUMN IF NOT EXISTS send_hour_local INTEGER;",
+        "ALTER TABLE subscribers ADD COLUMN IF NOT EXISTS last_sleep_sent_iso TEXT;",
+        "ALTER TABLE subscribers ADD COLUMN IF NOT EXISTS sleep_hour_local INTEGER;",
+    )),
+    (2, "ubicación temporal", (
+        "ALTER TABLE subscribers ADD COLUMN IF NOT EXISTS temp_city TEXT;",
+        "ALTER TABLE subscribers ADD COLUMN IF NOT EXISTS temp_lat DOUBLE PRECISION;",
+        "ALTER TABLE subscribers ADD COLUMN IF NOT EXISTS temp_lon DOUBLE PRECISION;",
+        "ALTER TABLE subscribers ADD COLUMN IF NOT EXISTS temp_tz TEXT;",
+        "ALTER TABLE subscribers ADD COLUMN IF NOT EXISTS temp_until_iso TEXT;",
+    )),
+    (3, "defaults en filas antiguas", _SQL_DEFAULTS),
+    # próxima ventana materializada (NULL = recalcular; ver list_due_send)
+    (4, "next_send_at_utc / next_sleep_at_utc", (
+        "ALTER TABLE subscribers ADD COLUMN IF NOT EXISTS next_send_at_utc TIMESTAMPTZ;",
+        "ALTER TABLE subscribers ADD COLUMN IF NOT EXISTS next_sleep_at_utc TIMESTAMPTZ;",
+        "CREATE INDEX IF NOT EXISTS idx_subs_next_send ON subscribers (next_send_at_utc);",
+        "CREATE INDEX IF NOT EXISTS idx_subs_next_sleep ON subscribers (next_sleep_at_utc);",
+    )),
+    # fechas tipadas en vez de TEXT ISO (sin fromisoformat por usuario y tick) + vista de ubicación efectiva
+    (5, "temp_until / last_sent_date / last_sleep_sent_date tipadas", (
+        "ALTER TABLE subscribers ADD COLUMN IF NOT EXISTS temp_until TIMESTAMPTZ;",
+        "ALTER TABLE subscribers ADD COLUMN IF NOT EXISTS last_sent_date DATE;",
+        "ALTER TABLE subscribers ADD COLUMN IF NOT EXISTS last_sleep_sent_date DATE;",
+        # sin zona en el texto = UTC (como hacía get_effective_location)
+        r"""
+        UPDATE subscribers
+           SET temp_until = CASE WHEN temp_until_iso ~ '[T ]\d{2}:\d{2}.*([+-]\d{2}(:?\d{2})?|Z)$'
+                                 THEN temp_until_iso::timestamptz
+                                 ELSE temp_until_iso::timestamp AT TIME ZONE 'UTC' END
+         WHERE temp_until_iso ~ '^\d{4}-\d{2}-\d{2}';
+        """,
+        r"UPDATE subscribers SET last_sent_date = last_sent_iso::date WHERE last_sent_iso ~ '^\d{4}-\d{2}-\d{2}$';",
+        r"UPDATE subscribers SET last_sleep_sent_date = last_sleep_sent_iso::date WHERE last_sleep_sent_iso ~ '^\d{4}-\d{2}-\d{2}$';",
+        # las *_iso se quedan, sincronizadas en los dos sentidos, mientras pueda quedar algún
+        # proceso con el código anterior (lee y escribe las de texto); se quitarán en una
+        # migración posterior (DROP TRIGGER trg_subscribers_sync_iso + DROP COLUMN)
+        _SQL_SYNC_ISO,
+        "DROP TRIGGER IF EXISTS trg_subscribers_sync_iso ON subscribers;",
+        """
+        CREATE TRIGGER trg_subscribers_sync_iso BEFORE INSERT OR UPDATE ON subscribers
+            FOR EACH ROW EXECUTE FUNCTION subscribers_sync_iso();
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_subs_temp_until ON subscribers (temp_until) WHERE temp_until IS NOT NULL;",
+        f"CREATE OR REPLACE VIEW subscribers_effective AS SELECT chat_id, {SQL_UBICACION_EFECTIVA} FROM subscribers;",
+    )),
+    # bajas visibles para quien sigue la tabla por updated_at (snapshot_suscriptores)
+    (6, "subscribers_deleted (lápidas de bajas) + índice updated_at", (
+        """
+        CREATE TABLE IF NOT EXISTS subscribers_deleted (
+            chat_id    TEXT PRIMARY KEY,
+            deleted_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_subs_deleted_at ON subscribers_deleted (deleted_at);",
+        "CREATE INDEX IF NOT EXISTS idx_subs_updated_at ON subscribers (updated_at);",
+        """
+        CREATE OR REPLACE FUNCTION subscribers_lapida() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO subscribers_deleted (chat_id, deleted_at) VALUES (OLD.chat_id, now())
+            ON CONFLICT (chat_id) DO UPDATE SET deleted_at = EXCLUDED.deleted_at;
+            RETURN OLD;
+        END
+        $$ LANGUAGE plpgsql;
+        """,
+        "DROP TRIGGER IF EXISTS trg_subscribers_lapida ON subscribers;",
+        """
+        CREATE TRIGGER trg_subscribers_lapida AFTER DELETE ON subscribers
+            FOR EACH ROW EXECUTE FUNCTION subscribers_lapida();
+        """,
+    )),
+    # reparto entre workers en paralelo (claim_due_send / claim_due_sleep)
+    (7, "concesiones de envío (send_/sleep_lease_until, *_lease_owner)", (
+        """
+        ALTER TABLE subscribers
+            ADD COLUMN IF NOT EXISTS send_lease_until  TIMESTAMPTZ,
+            ADD COLUMN IF NOT EXISTS send_lease_owner  TEXT,
+            ADD COLUMN IF NOT EXISTS sleep_lease_until TIMESTAMPTZ,
+            ADD COLUMN IF NOT EXISTS sleep_lease_owner TEXT;
+        """,
+    )),
+    # tablas de esquemas antiguos: las columnas añadidas con ALTER (migración 1) no tienen
+    # DEFAULT ni NOT NULL y las altas nuevas quedaban con horas NULL (antes lo tapaba
+    # migrate_fill_defaults en cada tick). Primero el DEFAULT (bloquea la tabla: ninguna
+    # alta entre el relleno y el NOT NULL), luego el relleno y el NOT NULL.
+    (8, "DEFAULT y NOT NULL en lang / tz / send_hour_local / sleep_hour_local / updated_at", (
+        """
+        ALTER TABLE subscribers
+            ALTER COLUMN lang SET DEFAULT 'es',
+            ALTER COLUMN tz SET DEFAULT 'Europe/Madrid',
+            ALTER COLUMN send_hour_local SET DEFAULT 9,
+            ALTER COLUMN sleep_hour_local SET DEFAULT 21,
+            ALTER COLUMN updated_at SET DEFAULT now();
+        """,
+        *_SQL_DEFAULTS,
+        """
+        ALTER TABLE subscribers
+            ALTER COLUMN lang SET NOT NULL,
+            ALTER COLUMN tz SET NOT NULL,
+            ALTER COLUMN send_hour_local SET NOT NULL,
+            ALTER COLUMN sleep_hour_local SET NOT NULL,
+            ALTER COLUMN updated_at SET NOT NULL;
+        """,
+    )),
+]
+
+# un solo proceso migra a la vez (cron y bot pueden arrancar juntos)
+_MIGRACIONES_LOCK = 72150017
+_version_ok = 0
+
+def schema_version() -> int:
+    """Última migración aplicada (0 si no hay schema_migrations)."""
+    with _get_conn() as conn, conn.cursor() as cur:
+        try:
+            # MAX sobre la PK: una lectura de índice
+            cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations;")
+        except psycopg2.errors.UndefinedTable:
+            return 0
+        return int(cur.fetchone()[0])
 
 def init_db() -> None:
     """
-    Crea tabla si no existe + añade columnas si faltan (idempotente).
-    """
-    base_sql = """
-    CREATE TABLE IF NOT EXISTS subscribers (
-        chat_id             TEXT PRIMARY KEY,
-        lang                TEXT NOT NULL DEFAULT 'es',
-        city                TEXT,
-        lat                 DOUBLE PRECISION,
-        lon                 DOUBLE PRECISION,
-        tz                  TEXT NOT NULL DEFAULT 'Europe/Madrid',
-
-        last_sent_iso        TEXT,
-        send_hour_local      INTEGER NOT NULL DEFAULT 9,
-
-        -- nocturno parasimpático
-        last_sleep_sent_iso  TEXT,
-        sleep_hour_local     INTEGER NOT NULL DEFAULT 21,
-
-        created_at          TIMESTAMPTZ NOT NULL DEFAULT now(),
-        updated_at          TIMESTAMPTZ NOT NULL DEFAULT now()
-    );
-    CREATE INDEX IF NOT EXISTS idx_subs_tz ON subscribers (tz);
+    Aplica las migraciones pendientes (idempotente). Si ya está al día solo lee la versión;
+    dentro del mismo proceso, ni eso.
     """
-    with _get_conn() as conn, conn.cursor() as cur:
-        cur.execute(base_sql)
-
-        # ---- añadir columnas nuevas (por si existían versiones antiguas) ----
-        cur.execute("ALTER TABLE subscribers ADD COLUMN IF NOT EXISTS last_sent_iso TEXT;")
-        cur.execute("ALTER TABLE subscribers ADD COLUMN IF NOT EXISTS send_hour_local INTEGER;")
-        cur.execute("ALTER TABLE subscribers ADD COLUMN IF NOT EXISTS last_sleep_sent_iso TEXT;")
-        cur.execute("ALTER TABLE subscribers ADD COLUMN IF NOT EXISTS sleep_hour_local INTEGER;")
-
-        # ---- ubicación temporal ----
-        cur.execute("ALTER TABLE subscribers ADD COLUMN IF NOT EXISTS temp_city TEXT;")
-        cur.execute("ALTER TABLE subscribers ADD COLUMN IF NOT EXISTS temp_lat DOUBLE PRECISION;")
-        cur.execute("ALTER TABLE subscribers ADD COLUMN IF NOT EXISTS temp_lon DOUBLE PRECISION;")
-        cur.execute("ALTER TABLE subscribers ADD COLUMN IF NOT EXISTS temp_tz TEXT;")
-        cur.execute("ALTER TABLE subscribers ADD COLUMN IF NOT EXISTS temp_until_iso TEXT;")
-
-        # defaults suaves
-        cur.execute("UPDATE subscribers SET send_hour_local = COALESCE(send_hour_local, 9);")
-        cur.execute("UPDATE subscribers SET sleep_hour_local = COALESCE(sleep_hour_local, 21);")
+    global _version_ok
+    ultima = MIGRACIONES[-1][0]
+    if _version_ok >= ultima or schema_version() >= ultima:
+        _version_ok = ultima
+        return
+
+    # una transacción: pasos + registro, bajo advisory lock
+    with pg_pool.conexion() as conn, conn.cursor() as cur:
+        cur.execute("SELECT pg_advisory_xact_lock(%s);", (_MIGRACIONES_LOCK,))
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version     INTEGER PRIMARY KEY,
+            descripcion TEXT NOT NULL,
+            applied_at  TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        """)
+        cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations;")
+        actual = int(cur.fetchone()[0])
+        for version, descripcion, sentencias in MIGRACIONES:
+            if version <= actual:
+                continue
+            for sql in sentencias:
+                cur.execute(sql)
+            cur.execute("INSERT INTO schema_migrations (version, descripcion) VALUES (%s, %s);",
+                        (version, descripcion))
+            print(f"🗄️ Migración {version}: {descripcion}")
+    _version_ok = ultima
 
 def migrate_fill_defaults() -> None:
     """
-    Rellena defaults si hay NULLs.
+    Rellena defaults si hay NULLs (las migraciones 3 y 8 ya lo hacen, y tras la 8 las columnas
+    son NOT NULL con DEFAULT; esto es para lanzarlo a mano).
     """
     try:
         with _get_conn() as conn, conn.cursor() as cur:
-            cur.execute("UPDATE subscribers SET lang='es' WHERE lang IS NULL OR lang='';")
-            cur.execute("UPDATE subscribers SET tz='Europe/Madrid' WHERE tz IS NULL OR tz='';")
-            cur.execute("UPDATE subscribers SET send_hour_local=9 WHERE send_hour_local IS NULL;")
-            cur.execute("UPDATE subscribers SET sleep_hour_local=21 WHERE sleep_hour_local IS NULL;")
-            cur.execute("UPDATE subscribers SET updated_at=now() WHERE updated_at IS NULL;")
+            for sql in _SQL_DEFAULTS:
+                cur.execute(sql)
     except Exception as e:
         print(f"[WARN] migrate_fill_defaults: {e}")
 
@@ -104,6 +302,81 @@ def ensure_user(chat_id: str) -> dict:
         cur.execute("SELECT * FROM subscribers WHERE chat_id=%s", (str(chat_id),))
         return dict(cur.fetchone())
 
+# ------------------ Lectura para los envíos (filas ligeras) ------------------
+
+# Lo que usan los envíos (should_send_*, ventanas, get_effective_location): no SELECT *
+COLUMNAS_ENVIO = (
+    "chat_id", "lang", "city", "lat", "lon", "tz",
+    "send_hour_local", "last_sent_date", "next_send_at_utc",
+    "sleep_hour_local", "last_sleep_sent_date", "next_sleep_at_utc",
+    "temp_city", "temp_lat", "temp_lon", "temp_tz", "temp_until",
+    "updated_at",
+)
+_SELECT_ENVIO = f"SELECT {', '.join(COLUMNAS_ENVIO)} FROM subscribers"
+
+SUBS_ITERSIZE = int(os.getenv("SUBS_ITERSIZE", "2000"))
+
+class Suscriptor:
+    """
+    Fila de COLUMNAS_ENVIO con __slots__ (sin dict por fila). Se lee como el dict
+    de antes, chat.get("tz") / chat["tz"], así que vale para should_send_now & cía.
+    """
+    __slots__ = COLUMNAS_ENVIO
+
+    def __init__(self, fila: tuple) -> None:
+        for k, v in zip(COLUMNAS_ENVIO, fila):
+            setattr(self, k, v)
+
+    def get(self, key: str, default=None):
+        return getattr(self, key, default)
+
+    def __getitem__(self, key: str):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __setitem__(self, key: str, value) -> None:
+        setattr(self, key, value)
+
+    def __contains__(self, key: str) -> bool:
+        return key in COLUMNAS_ENVIO
+
+    def __repr__(self) -> str:
+        return f"Suscriptor({self.chat_id!r}, tz={self.tz!r})"
+
+def iter_users(itersize: int = SUBS_ITERSIZE, desde: Optional[datetime] = None) -> Iterator[Suscriptor]:
+    """
+    Todos los suscriptores (o, con `desde`, los cambiados después: updated_at > desde),
+    de `itersize` en `itersize` con un cursor con nombre (de servidor): la memoria
+    no crece con el número de filas.
+    La conexión queda prestada hasta que se agota (o se cierra) el generador.
+    """
+    # los cursores con nombre necesitan transacción: conexión sin autocommit
+    with pg_pool.conexion() as conn, conn.cursor(name="iter_users") as cur:
+        cur.itersize = itersize
+        if desde is None:
+            cur.execute(_SELECT_ENVIO + ";")
+        else:
+            cur.execute(_SELECT_ENVIO + " WHERE updated_at > %s;", (desde,))
+        for fila in cur:
+            yield Suscriptor(fila)
+
+def get_users(chat_ids: Iterable[str]) -> Dict[str, Suscriptor]:
+    """Filas ligeras de esos chat_id (p. ej. los que tocan según snapshot_suscriptores)."""
+    ids = [str(c) for c in chat_ids]
+    if not ids:
+        return {}
+    with _get_conn() as conn, conn.cursor() as cur:
+        cur.execute(_SELECT_ENVIO + " WHERE chat_id = ANY(%s);", (ids,))
+        return {fila[0]: Suscriptor(fila) for fila in cur}
+
+def deleted_since(desde: datetime) -> Dict[str, datetime]:
+    """{chat_id: deleted_at} de las bajas posteriores a `desde` (tabla subscribers_deleted)."""
+    with _get_conn() as conn, conn.cursor() as cur:
+        cur.execute("SELECT chat_id, deleted_at FROM subscribers_deleted WHERE deleted_at > %s;", (desde,))
+        return dict(cur.fetchall())
+
 def list_users() -> Dict[str, dict]:
     with _get_conn() as conn, conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
         cur.execute("SELECT * FROM subscribers;")
@@ -138,6 +411,21 @@ def set_city(chat_id: str, city: Optional[str]) -> None:
     with _get_conn() as conn, conn.cursor() as cur:
         cur.execute("UPDATE subscribers SET city=%s, updated_at=now() WHERE chat_id=%s;", (city, str(chat_id)))
 
+def set_city_location(chat_id: str, city: str, lat: float, lon: float, tz: str) -> None:
+    """
+    /city resuelta: nombre + coordenadas + zona de esa ciudad (las que se le mostraron
+    al usuario). No toca la ubicación temporal.
+    """
+    tz = (tz or "Europe/Madrid").strip() or "Europe/Madrid"
+    with _get_conn() as conn, conn.cursor() as cur:
+        cur.execute("""
+            UPDATE subscribers
+               SET city=%s, lat=%s, lon=%s, tz=%s,
+                   next_send_at_utc=NULL, next_sleep_at_utc=NULL,
+                   updated_at=now()
+             WHERE chat_id=%s
+        """, (city, float(lat), float(lon), tz, str(chat_id)))
+
 def set_send_hour(chat_id: str, hour_local: int) -> None:
     try:
         hour_local = int(hour_local)
@@ -145,7 +433,7 @@ def set_send_hour(chat_id: str, hour_local: int) -> None:
         hour_local = 9
     hour_local = max(0, min(23, hour_local))
     with _get_conn() as conn, conn.cursor() as cur:
-        cur.execute("UPDATE subscribers SET send_hour_local=%s, updated_at=now() WHERE chat_id=%s;",
+        cur.execute("UPDATE subscribers SET send_hour_local=%s, next_send_at_utc=NULL, updated_at=now() WHERE chat_id=%s;",
                     (hour_local, str(chat_id)))
 
 def set_sleep_hour(chat_id: str, hour_local: int) -> None:
@@ -155,14 +443,14 @@ def set_sleep_hour(chat_id: str, hour_local: int) -> None:
         hour_local = 21
     hour_local = max(0, min(23, hour_local))
     with _get_conn() as conn, conn.cursor() as cur:
-        cur.execute("UPDATE subscribers SET sleep_hour_local=%s, updated_at=now() WHERE chat_id=%s;",
+        cur.execute("UPDATE subscribers SET sleep_hour_local=%s, next_sleep_at_utc=NULL, updated_at=now() WHERE chat_id=%s;",
                     (hour_local, str(chat_id)))
 
 def clear_temp_location(chat_id: str) -> None:
     with _get_conn() as conn, conn.cursor() as cur:
         cur.execute("""
             UPDATE subscribers
-               SET temp_city=NULL, temp_lat=NULL, temp_lon=NULL, temp_tz=NULL, temp_until_iso=NULL,
+               SET temp_city=NULL, temp_lat=NULL, temp_lon=NULL, temp_tz=NULL, temp_until=NULL,
                    updated_at=now()
              WHERE chat_id=%s
         """, (str(chat_id),))
@@ -176,7 +464,8 @@ def set_location(chat_id: str, lat: float, lon: float, tz: str, city_hint: Optio
         cur.execute("""
             UPDATE subscribers
                SET lat=%s, lon=%s, tz=%s, city=COALESCE(%s, city),
-                   temp_city=NULL, temp_lat=NULL, temp_lon=NULL, temp_tz=NULL, temp_until_iso=NULL,
+                   next_send_at_utc=NULL, next_sleep_at_utc=NULL,
+                   temp_city=NULL, temp_lat=NULL, temp_lon=NULL, temp_tz=NULL, temp_until=NULL,
                    updated_at=now()
              WHERE chat_id=%s
         """, (float(lat), float(lon), tz, city_hint, str(chat_id)))
@@ -186,41 +475,35 @@ def set_temp_location(chat_id: str, lat: float, lon: float, tz: str, until_utc:
     Ubicación temporal (p.ej. viaje) válida hasta until_utc (UTC).
     """
     tz = (tz or "Europe/Madrid").strip() or "Europe/Madrid"
-    until_iso = until_utc.astimezone(timezone.utc).isoformat()
     with _get_conn() as conn, conn.cursor() as cur:
         cur.execute("""
             UPDATE subscribers
                SET temp_lat=%s, temp_lon=%s, temp_tz=%s,
                    temp_city=COALESCE(%s, temp_city),
-                   temp_until_iso=%s,
+                   temp_until=%s,
                    updated_at=now()
              WHERE chat_id=%s
-        """, (float(lat), float(lon), tz, city_hint, until_iso, str(chat_id)))
+        """, (float(lat), float(lon), tz, city_hint, until_utc.astimezone(timezone.utc), str(chat_id)))
 
 def get_effective_location(chat: dict, now_utc: Optional[datetime] = None) -> Tuple[Optional[float], Optional[float], str, Optional[str], bool]:
     """
     Devuelve (lat, lon, tz, city, is_temp), eligiendo temporal si no ha caducado.
-    Si la temporal caducó, NO la borra aquí (eso lo hace el caller si quiere).
+    Sin coordenadas (filas de antes de que /city las guardara), usa las de la ciudad
+    si el nomenclátor local la conoce sin ambigüedad; la tz es siempre la guardada.
+    Si la temporal caducó, NO la borra aquí (eso lo hace expire_temp_locations).
     """
     if now_utc is None:
         now_utc = datetime.now(timezone.utc)
 
-    # temporal
-    temp_until = chat.get("temp_until_iso")
-    if temp_until:
-        try:
-            until_dt = datetime.fromisoformat(temp_until)
-            if until_dt.tzinfo is None:
-                until_dt = until_dt.replace(tzinfo=timezone.utc)
-            if now_utc < until_dt:
-                lat = chat.get("temp_lat")
-                lon = chat.get("temp_lon")
-                tz = (chat.get("temp_tz") or chat.get("tz") or "Europe/Madrid").strip()
-                city = chat.get("temp_city") or chat.get("city")
-                if lat is not None and lon is not None:
-                    return float(lat), float(lon), tz or "Europe/Madrid", city, True
-        except Exception:
-            pass
+    # temporal (temp_until ya viene como datetime con zona de psycopg2)
+    temp_until = chat.get("temp_until")
+    if temp_until is not None and now_utc < temp_until:
+        lat = chat.get("temp_lat")
+        lon = chat.get("temp_lon")
+        tz = (chat.get("temp_tz") or chat.get("tz") or "Europe/Madrid").strip()
+        city = chat.get("temp_city") or chat.get("city")
+        if lat is not None and lon is not None:
+            return float(lat), float(lon), tz or "Europe/Madrid", city, True
 
     # persistente
     lat = chat.get("lat")
@@ -230,46 +513,393 @@ def get_effective_location(chat: dict, now_utc: Optional[datetime] = None) -> Tu
     if lat is not None and lon is not None:
         return float(lat), float(lon), tz, city, False
 
-    # sin coords
+    # sin coords: la ciudad, solo si el nombre es exacto y no tiene homónimas
+    if city:
+        c = nomenclator.exacta(city)
+        if c is not None:
+            return c.lat, c.lon, tz, city, False
+
     return None, None, tz, city, False
 
+def expire_temp_locations(now_utc: Optional[datetime] = None) -> int:
+    """Borra de una vez las ubicaciones temporales caducadas (índice parcial sobre temp_until)."""
+    if now_utc is None:
+        now_utc = datetime.now(timezone.utc)
+    with _get_conn() as conn, conn.cursor() as cur:
+        cur.execute("""
+            UPDATE subscribers
+               SET temp_city=NULL, temp_lat=NULL, temp_lon=NULL, temp_tz=NULL, temp_until=NULL,
+                   updated_at=now()
+             WHERE temp_until <= %s
+        """, (now_utc,))
+        return cur.rowcount
+
 # ------------------ Control de envío diario/nocturno ------------------
 
 def mark_sent_today(chat_id: str, local_date: date) -> None:
     with _get_conn() as conn, conn.cursor() as cur:
-        cur.execute("UPDATE subscribers SET last_sent_iso=%s, updated_at=now() WHERE chat_id=%s;",
-                    (local_date.isoformat(), str(chat_id)))
+        cur.execute("UPDATE subscribers SET last_sent_date=%s, next_send_at_utc=NULL, send_lease_until=NULL, updated_at=now() WHERE chat_id=%s;",
+                    (local_date, str(chat_id)))
 
 def mark_sleep_sent_today(chat_id: str, local_date: date) -> None:
     with _get_conn() as conn, conn.cursor() as cur:
-        cur.execute("UPDATE subscribers SET last_sleep_sent_iso=%s, updated_at=now() WHERE chat_id=%s;",
-                    (local_date.isoformat(), str(chat_id)))
+        cur.execute("UPDATE subscribers SET last_sleep_sent_date=%s, next_sleep_at_utc=NULL, sleep_lease_until=NULL, updated_at=now() WHERE chat_id=%s;",
+                    (local_date, str(chat_id)))
+
+def _mark_many(columna_fecha: str, columna_next: str, columna_lease: str, pares: Iterable[Tuple[str, date]]) -> int:
+    # un solo UPDATE ... FROM (VALUES ...) para todo el lote; la reserva (claim_due_*) queda libre
+    vals = [(str(chat_id), d) for chat_id, d in pares]
+    if not vals:
+        return 0
+    with _get_conn() as conn, conn.cursor() as cur:
+        psycopg2.extras.execute_values(cur, f"""
+            UPDATE subscribers AS s
+               SET {columna_fecha} = v.d, {columna_next} = NULL, {columna_lease} = NULL, updated_at = now()
+              FROM (VALUES %s) AS v(chat_id, d)
+             WHERE s.chat_id = v.chat_id
+        """, vals, template="(%s, %s::date)", page_size=1000)
+    return len(vals)
+
+def mark_sent_many(pares: Iterable[Tuple[str, date]]) -> int:
+    """mark_sent_today de varios (chat_id, fecha local) en una sentencia."""
+    return _mark_many("last_sent_date", "next_send_at_utc", "send_lease_until", pares)
+
+def mark_sleep_sent_many(pares: Iterable[Tuple[str, date]]) -> int:
+    """mark_sleep_sent_today de varios (chat_id, fecha local) en una sentencia."""
+    return _mark_many("last_sleep_sent_date", "next_sleep_at_utc", "sleep_lease_until", pares)
+
+# Envíos por lote: cada cuántos envíos / segundos se vuelcan las marcas
+MARCAS_LOTE = int(os.getenv("MARCAS_LOTE", "200"))
+MARCAS_SEG = float(os.getenv("MARCAS_SEG", "3"))
+
+class MarcasEnvio:
+    """
+    Acumula las marcas de "enviado hoy" y las vuelca con mark_sent_many (o la
+    función que se pase) cada MARCAS_LOTE envíos y, dentro del with, también desde
+    un hilo cada MARCAS_SEG segundos aunque no llegue ningún anotar() (envíos
+    atascados en timeouts de Telegram o meteo lenta: las marcas no esperan a que
+    caduque la reserva). Siempre al salir del with (también con excepción). Igual
+    que antes, la marca va después del envío: si el proceso muere antes de volcar,
+    esos usuarios pueden recibir el mensaje dos veces, nunca cero.
+
+        with repo.MarcasEnvio(repo.mark_sent_many) as marcas:
+            ...
+            tg_send(chat_id, msg)
+            marcas.anotar(chat_id, local_date)
+    """
+
+    def __init__(self, volcar: Callable[[List[Tuple[str, date]]], int] = mark_sent_many,
+                 lote: int = MARCAS_LOTE, segundos: float = MARCAS_SEG) -> None:
+        self._volcar = volcar
+        self._lote = max(1, lote)
+        self._segundos = segundos
+        self._pendientes: List[Tuple[str, date]] = []
+        self._desde = 0.0
+        self._lock = threading.Lock()
+        self._parar = threading.Event()
+        self._hilo: Optional[threading.Thread] = None
+
+    def anotar(self, chat_id: str, local_date: date) -> None:
+        with self._lock:
+            if not self._pendientes:
+                self._desde = time.monotonic()
+            self._pendientes.append((str(chat_id), local_date))
+            lleno = (len(self._pendientes) >= self._lote
+                     or time.monotonic() - self._desde >= self._segundos)
+        if lleno:
+            self.vaciar()
+
+    def vaciar(self) -> int:
+        with self._lock:
+            lote, self._pendientes = self._pendientes, []
+            if not lote:
+                return 0
+            try:
+                return self._volcar(lote)
+            except Exception as e:
+                # se reintentan en el siguiente volcado
+                print(f"[WARN] marcas de envío ({len(lote)}): {e}")
+                self._pendientes = lote + self._pendientes
+                return 0
+
+    def _cada_tanto(self) -> None:
+        while not self._parar.wait(self._segundos):
+            self.vaciar()
+
+    def __enter__(self) -> "MarcasEnvio":
+        self._parar.clear()
+        self._hilo = threading.Thread(target=self._cada_tanto, name="marcas_envio", daemon=True)
+        self._hilo.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._parar.set()
+        if self._hilo is not None:
+            self._hilo.join()
+            self._hilo = None
+        self.vaciar()
+        if self._pendientes:
+            print(f"[WARN] {len(self._pendientes)} marcas de envío sin guardar")
 
 def should_send_now(chat: dict, now_utc: Optional[datetime] = None) -> bool:
     """
     Cron cada 5 min:
     - Convierte now_utc a hora local del usuario (chat["tz"])
     - Envía si: local_hour == send_hour_local y 0<=min<30
-    - y si aún no se envió hoy (last_sent_iso == fecha local)
+    - y si aún no se envió hoy (last_sent_date == fecha local)
     """
     if now_utc is None:
         now_utc = datetime.now(timezone.utc)
 
-    tzname = (chat.get("tz") or "Europe/Madrid").strip() or "Europe/Madrid"
-    try:
-        tz = pytz.timezone(tzname)
-    except Exception:
-        tz = pytz.timezone("Europe/Madrid")
-        tzname = "Europe/Madrid"
+    tzname = zonas.normalizar_tz(chat.get("tz"))
 
     send_hour = int(chat.get("send_hour_local", 9))
-    now_local = now_utc.astimezone(tz)
+    now_local = zonas.hora_local(tzname, now_utc)
     local_date = now_local.date()
 
-    already = (chat.get("last_sent_iso") == local_date.isoformat())
+    already = (chat.get("last_sent_date") == local_date)
     in_window = (now_local.hour == send_hour and 0 <= now_local.minute < 30)
     return in_window and not already
 
+# duración de las ventanas de should_send_now / should_send_sleep_now
+VENTANA_ENVIO = timedelta(minutes=30)
+VENTANA_NOCHE = timedelta(minutes=10)
+
+def _proxima_ventana(tzname: str, hour: int, last_date: Optional[date], ventana: timedelta,
+                     now_utc: datetime) -> Optional[Tuple[datetime, date]]:
+    today = zonas.fecha_local(tzname, now_utc)
+    for d in (today, today + timedelta(days=1)):
+        if last_date == d:
+            continue
+        start = zonas.localizar(tzname, datetime(d.year, d.month, d.day, hour, 0)).astimezone(timezone.utc)
+        if start + ventana > now_utc:
+            return start, d
+    return None
+
+def next_send_window(chat: dict, now_utc: Optional[datetime] = None) -> Optional[Tuple[datetime, date]]:
+    """
+    (inicio en UTC, fecha local) de la próxima ventana de envío diario que aún
+    no ha terminado ni se ha enviado (la de hoy o la de mañana). Misma ventana
+    que should_send_now: send_hour_local:00 .. :30.
+    """
+    if now_utc is None:
+        now_utc = datetime.now(timezone.utc)
+    return _proxima_ventana(zonas.normalizar_tz(chat.get("tz")), int(chat.get("send_hour_local", 9)),
+                            chat.get("last_sent_date"), VENTANA_ENVIO, now_utc)
+
+def next_sleep_window(chat: dict, now_utc: Optional[datetime] = None) -> Optional[Tuple[datetime, date]]:
+    """Como next_send_window, para el nocturno (sleep_hour_local:00 .. :10)."""
+    if now_utc is None:
+        now_utc = datetime.now(timezone.utc)
+    return _proxima_ventana(zonas.normalizar_tz(chat.get("tz")), int(chat.get("sleep_hour_local", 21)),
+                            chat.get("last_sleep_sent_date"), VENTANA_NOCHE, now_utc)
+
+# ------------------ Quién toca ahora (consulta por índice) ------------------
+
+def _list_due(columna: str, ventana_de, now_utc: Optional[datetime], hasta_utc: Optional[datetime]) -> Dict[str, Suscriptor]:
+    """
+    Filas con `columna` <= hasta_utc (o NULL = pendiente de recalcular). De paso
+    recalcula y guarda la próxima ventana de las NULL y de las que ya pasaron sin
+    envío, para que no vuelvan a salir hasta su siguiente ventana.
+    """
+    if now_utc is None:
+        now_utc = datetime.now(timezone.utc)
+    if hasta_utc is None:
+        hasta_utc = now_utc
+    with _get_conn() as conn, conn.cursor() as cur:
+        cur.execute(f"{_SELECT_ENVIO} WHERE {columna} IS NULL OR {columna} <= %s;", (hasta_utc,))
+        rows = {}
+        for fila in cur:
+            chat = Suscriptor(fila)
+            rows[chat.chat_id] = chat
+
+        cambios = []
+        for chat_id, chat in rows.items():
+            try:
+                ventana = ventana_de(chat, now_utc=now_utc)
+            except Exception as e:
+                print(f"[WARN] próxima ventana {chat_id}: {e}")
+                ventana = None
+            # sin ventana hoy ni mañana (ya enviado ambos días) o sin poder calcularla:
+            # se mira de nuevo en un día
+            nuevo = ventana[0] if ventana else now_utc + timedelta(days=1)
+            if chat.get(columna) != nuevo:
+                cambios.append((chat_id, nuevo))
+                chat[columna] = nuevo
+        if cambios:
+            psycopg2.extras.execute_values(cur, f"""
+                UPDATE subscribers AS s SET {columna} = v.t
+                  FROM (VALUES %s) AS v(chat_id, t)
+                 WHERE s.chat_id = v.chat_id
+            """, cambios, template="(%s, %s::timestamptz)")
+
+    return {k: v for k, v in rows.items() if v[columna] <= hasta_utc}
+
+def list_due_send(now_utc: Optional[datetime] = None, horizonte: timedelta = timedelta(0)) -> Dict[str, Suscriptor]:
+    """
+    Usuarios cuya ventana de envío diario ha empezado (o empieza en `horizonte`),
+    por índice sobre next_send_at_utc: coste O(usuarios que tocan), no O(tabla).
+    Falta confirmar con should_send_now (la ventana puede no haber empezado aún).
+    """
+    if now_utc is None:
+        now_utc = datetime.now(timezone.utc)
+    return _list_due("next_send_at_utc", next_send_window, now_utc, now_utc + horizonte)
+
+def list_due_sleep(now_utc: Optional[datetime] = None) -> Dict[str, Suscriptor]:
+    """Como list_due_send para el nocturno (next_sleep_at_utc)."""
+    return _list_due("next_sleep_at_utc", next_sleep_window, now_utc, None)
+
+# ------------------ Reparto entre workers (reservas con caducidad) ------------------
+
+# Varios enviar_consejo / enviar_noche a la vez (ticks solapados, N procesos o máquinas):
+# cada uno reserva un lote con SELECT ... FOR UPDATE SKIP LOCKED y lo marca como suyo
+# hasta now() + ENVIO_LEASE_SEG; el resto de workers se salta esas filas. La marca de
+# enviado (mark_*_many) libera la reserva; release_* devuelve las que fallaron.
+# Durante el envío, ReservaLote alarga con renew_* (un UPDATE para todo el trozo) las
+# reservas que quedan y confirma cuáles siguen siendo nuestras: un lote lento (más que
+# ENVIO_LEASE_SEG) no acaba enviando en paralelo con el worker que lo haya vuelto a reservar.
+# Si un worker muere sin marcar, la reserva caduca y otro lo reintenta (puede repetir
+# los envíos aún sin volcar de MarcasEnvio, nunca perderlos).
+ENVIO_LOTE = int(os.getenv("ENVIO_LOTE", "500"))
+ENVIO_LEASE_SEG = float(os.getenv("ENVIO_LEASE_SEG", "300"))
+
+def worker_id() -> str:
+    """Quién reserva (host:pid), visible en *_lease_owner."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def _claim_due(columna: str, columna_lease: str, columna_owner: str, ventana_de,
+               now_utc: Optional[datetime], lote: int, solo: Optional[Iterable[str]]) -> Dict[str, Suscriptor]:
+    if now_utc is None:
+        now_utc = datetime.now(timezone.utc)
+    sql = f"{_SELECT_ENVIO} WHERE ({columna} IS NULL OR {columna} <= %s) AND ({columna_lease} IS NULL OR {columna_lease} <= now())"
+    params: list = [now_utc]
+    if solo is not None:
+        sql += " AND chat_id = ANY(%s)"
+        params.append([str(c) for c in solo])
+    sql += f" ORDER BY {columna} NULLS FIRST LIMIT %s FOR UPDATE SKIP LOCKED;"
+    params.append(max(1, lote))
+    yo = worker_id()
+
+    while True:
+        # la caducidad se mide con el reloj de Postgres: igual para todas las máquinas
+        with pg_pool.conexion() as conn, conn.cursor() as cur:
+            cur.execute(sql, params)
+            filas = [Suscriptor(f) for f in cur.fetchall()]
+            if not filas:
+                return {}
+
+            # se vuelve a mirar la ventana con la fila ya bloqueada (last_*_date al día):
+            # las que no tocan ahora pasan a su próxima ventana y no se reservan
+            reservados: Dict[str, Suscriptor] = {}
+            cambios = []
+            for chat in filas:
+                try:
+                    ventana = ventana_de(chat, now_utc=now_utc)
+                except Exception as e:
+                    print(f"[WARN] próxima ventana {chat.chat_id}: {e}")
+                    ventana = None
+                nuevo = ventana[0] if ventana else now_utc + timedelta(days=1)
+                chat[columna] = nuevo
+                if nuevo <= now_utc:
+                    reservados[chat.chat_id] = chat
+                cambios.append((chat.chat_id, nuevo, yo if nuevo <= now_utc else None))
+            psycopg2.extras.execute_values(cur, f"""
+                UPDATE subscribers AS s
+                   SET {columna} = v.t,
+                       {columna_lease} = CASE WHEN v.owner IS NULL THEN NULL
+                                              ELSE now() + {ENVIO_LEASE_SEG:f} * interval '1 second' END,
+                       {columna_owner} = COALESCE(v.owner, s.{columna_owner})
+                  FROM (VALUES %s) AS v(chat_id, t, owner)
+                 WHERE s.chat_id = v.chat_id
+            """, cambios, template="(%s, %s::timestamptz, %s::text)")
+        if reservados:
+            return reservados
+
+def claim_due_send(now_utc: Optional[datetime] = None, lote: int = ENVIO_LOTE,
+                   solo: Optional[Iterable[str]] = None) -> Dict[str, Suscriptor]:
+    """
+    Reserva para este worker hasta `lote` usuarios en ventana de envío diario que
+    nadie tenga reservados; {} cuando ya no queda ninguno. `solo` limita a esos
+    chat_id (p. ej. los de snapshot_suscriptores).
+    """
+    return _claim_due("next_send_at_utc", "send_lease_until", "send_lease_owner",
+                      next_send_window, now_utc, lote, solo)
+
+def claim_due_sleep(now_utc: Optional[datetime] = None, lote: int = ENVIO_LOTE,
+                    solo: Optional[Iterable[str]] = None) -> Dict[str, Suscriptor]:
+    """Como claim_due_send para el nocturno."""
+    return _claim_due("next_sleep_at_utc", "sleep_lease_until", "sleep_lease_owner",
+                      next_sleep_window, now_utc, lote, solo)
+
+def _release(columna_lease: str, columna_owner: str, chat_ids: Iterable[str]) -> int:
+    ids = [str(c) for c in chat_ids]
+    if not ids:
+        return 0
+    with _get_conn() as conn, conn.cursor() as cur:
+        cur.execute(f"UPDATE subscribers SET {columna_lease} = NULL WHERE chat_id = ANY(%s) AND {columna_owner} = %s;",
+                    (ids, worker_id()))
+        return cur.rowcount
+
+def _renew(columna_lease: str, columna_owner: str, chat_ids: Iterable[str]) -> Set[str]:
+    ids = [str(c) for c in chat_ids]
+    if not ids:
+        return set()
+    # si caducó pero nadie la ha vuelto a reservar (owner sigue siendo este worker) se
+    # recupera: el UPDATE bloquea la fila y un claim_due_* a la vez se la salta
+    with _get_conn() as conn, conn.cursor() as cur:
+        cur.execute(f"""
+            UPDATE subscribers
+               SET {columna_lease} = now() + {ENVIO_LEASE_SEG:f} * interval '1 second'
+             WHERE chat_id = ANY(%s) AND {columna_owner} = %s AND {columna_lease} IS NOT NULL
+         RETURNING chat_id;
+        """, (ids, worker_id()))
+        return {f[0] for f in cur.fetchall()}
+
+def renew_send(chat_ids: Iterable[str]) -> Set[str]:
+    """
+    Alarga ENVIO_LEASE_SEG las reservas de envío de este worker y devuelve los chat_id
+    que siguen siendo suyos; a los demás (los ha reservado otro) no hay que enviarles.
+    """
+    return _renew("send_lease_until", "send_lease_owner", chat_ids)
+
+def renew_sleep(chat_ids: Iterable[str]) -> Set[str]:
+    return _renew("sleep_lease_until", "sleep_lease_owner", chat_ids)
+
+class ReservaLote:
+    """
+    Reservas de un trozo de envíos. sigue(chat_id), justo antes de enviar, dice si la
+    reserva sigue siendo de este worker. La primera llamada renueva todo el trozo de
+    una vez (renew_send / renew_sleep); se vuelve a renovar, solo lo que falta por
+    enviar, cuando ha pasado la mitad de ENVIO_LEASE_SEG desde la última renovación.
+
+        reserva = repo.ReservaLote(repo.renew_send, ids)
+        for chat_id in ids:
+            if not reserva.sigue(chat_id):
+                continue  # ya es de otro worker
+            tg_send(...)
+    """
+
+    def __init__(self, renovar: Callable[[Iterable[str]], Set[str]], chat_ids: Iterable[str]) -> None:
+        self._renovar = renovar
+        self._quedan: Dict[str, None] = dict.fromkeys(str(c) for c in chat_ids)
+        self._mias: Set[str] = set()
+        self._cuando: Optional[float] = None
+
+    def sigue(self, chat_id: str) -> bool:
+        chat_id = str(chat_id)
+        if self._cuando is None or time.monotonic() - self._cuando >= ENVIO_LEASE_SEG / 2:
+            self._mias = self._renovar(list(self._quedan))
+            self._cuando = time.monotonic()
+        self._quedan.pop(chat_id, None)
+        return chat_id in self._mias
+
+def release_send(chat_ids: Iterable[str]) -> int:
+    """Libera las reservas propias sin marcar enviado (envío fallido: otro tick lo reintenta)."""
+    return _release("send_lease_until", "send_lease_owner", chat_ids)
+
+def release_sleep(chat_ids: Iterable[str]) -> int:
+    return _release("sleep_lease_until", "sleep_lease_owner", chat_ids)
+
 def should_send_sleep_now(chat: dict, now_utc: Optional[datetime] = None) -> bool:
     """
     Nocturno parasimpático: por defecto 21:00 local.
@@ -278,16 +908,12 @@ def should_send_sleep_now(chat: dict, now_utc: Optional[datetime] = None) -> boo
     if now_utc is None:
         now_utc = datetime.now(timezone.utc)
 
-    tzname = (chat.get("tz") or "Europe/Madrid").strip() or "Europe/Madrid"
-    try:
-        tz = pytz.timezone(tzname)
-    except Exception:
-        tz = pytz.timezone("Europe/Madrid")
+    tzname = zonas.normalizar_tz(chat.get("tz"))
 
     sleep_hour = int(chat.get("sleep_hour_local", 21))
-    now_local = now_utc.astimezone(tz)
+    now_local = zonas.hora_local(tzname, now_utc)
     local_date = now_local.date()
 
-    already = (chat.get("last_sleep_sent_iso") == local_date.isoformat())
+    already = (chat.get("last_sleep_sent_date") == local_date)
     in_window = (now_local.hour == sleep_hour and 0 <= now_local.minute < 10)
     return in_window and not already
@@ -0,0 +1,182 @@
+# zonas_horarias.py
+# Offsets UTC por zona horaria sin pasar por pytz en el bucle caliente.
+# Para cada (zona, año) se precalculan una vez las transiciones (cambios de hora)
+# en arrays compactos; el offset de un instante sale por bisect.
+# También: zona horaria de unas coordenadas con un único TimezoneFinder por
+# proceso y memo por celda H3.
+#
+# Variables de entorno:
+#   TZ_H3_RES (opcional, 7) -> resolución H3 del memo coords -> zona (7 ≈ 5 km²)
+
+from __future__ import annotations
+
+import os
+import bisect
+import threading
+import datetime as dt
+from array import array
+from functools import lru_cache
+from typing import Tuple
+
+import pytz
+
+TZ_DEFECTO = "Europe/Madrid"
+TZ_H3_RES = int(os.getenv("TZ_H3_RES", "7"))
+
+_EPOCH = dt.datetime(1970, 1, 1)
+
+
+def _ts(naive_utc: dt.datetime) -> int:
+    return int((naive_utc - _EPOCH).total_seconds())
+
+
+@lru_cache(maxsize=None)
+def normalizar_tz(tzname: str) -> str:
+    """Nombre de zona válido; si no existe (o viene vacío), TZ_DEFECTO."""
+    tzname = (tzname or "").strip()
+    if not tzname:
+        return TZ_DEFECTO
+    try:
+        pytz.timezone(tzname)
+        return tzname
+    except Exception:
+        return TZ_DEFECTO
+
+
+@lru_cache(maxsize=None)
+def _tabla(tzname: str, year: int) -> Tuple[array, array, array]:
+    """
+    (transiciones, offsets, dst) del año (con un día de margen a cada lado):
+    transiciones[i] = segundos epoch UTC desde los que rige offsets[i] (segundos).
+    El primer elemento es el offset vigente al empezar el rango.
+    """
+    tz = pytz.timezone(tzname)
+    ini = _ts(dt.datetime(year, 1, 1) - dt.timedelta(days=1))
+    fin = _ts(dt.datetime(year + 1, 1, 1) + dt.timedelta(days=1))
+
+    trans = array("q")
+    offs = array("l")
+    dsts = array("b")
+
+    utc_times = getattr(tz, "_utc_transition_times", None)
+    infos = getattr(tz, "_transition_info", None)
+    if not utc_times or not infos:
+        # zona de offset fijo (StaticTzInfo / UTC)
+        off = tz.utcoffset(dt.datetime(year, 7, 1)) or dt.timedelta(0)
+        trans.append(ini)
+        offs.append(int(off.total_seconds()))
+        dsts.append(0)
+        return trans, offs, dsts
+
+    tss = [_ts(t) if t.year > 1 else -(2 ** 62) for t in utc_times]
+    i0 = max(0, bisect.bisect_right(tss, ini) - 1)
+    for i in range(i0, len(tss)):
+        if tss[i] >= fin:
+            break
+        off, dst, _ = infos[i]
+        trans.append(max(tss[i], ini))
+        offs.append(int(off.total_seconds()))
+        dsts.append(1 if dst else 0)
+    return trans, offs, dsts
+
+
+def offset_utc(tzname: str, instante_utc: dt.datetime) -> int:
+    """Offset UTC (segundos) de la zona en ese instante (aware o naive en UTC)."""
+    if instante_utc.tzinfo is not None:
+        instante_utc = instante_utc.astimezone(dt.timezone.utc).replace(tzinfo=None)
+    trans, offs, _ = _tabla(tzname, instante_utc.year)
+    i = bisect.bisect_right(trans, _ts(instante_utc)) - 1
+    return offs[max(0, i)]
+
+
+def offset_local(tzname: str, local: dt.datetime) -> int:
+    """
+    Offset UTC (segundos) de una hora local naive, con el mismo criterio que
+    pytz localize(is_dst=False): en horas ambiguas, la de invierno; en horas
+    inexistentes (hueco de primavera), la de antes del salto.
+    """
+    trans, offs, dsts = _tabla(tzname, local.year)
+    ts_local = _ts(local)
+
+    def vigente(ts_utc: int) -> int:
+        return max(0, bisect.bisect_right(trans, ts_utc) - 1)
+
+    # candidatos: los offsets vigentes un día antes y un día después
+    posibles = {}
+    for delta in (-86400, 86400):
+        i = vigente(ts_local + delta)
+        if offs[vigente(ts_local - offs[i])] == offs[i]:
+            posibles[(offs[i], dsts[i])] = offs[i]
+
+    if len(posibles) == 1:
+        return next(iter(posibles.values()))
+    if not posibles:
+        return offset_local(tzname, local - dt.timedelta(hours=6))
+
+    no_dst = [off for (off, dst) in posibles if not dst] or list(posibles.values())
+    return min(no_dst)
+
+
+@lru_cache(maxsize=None)
+def tzinfo_fijo(offset_s: int) -> dt.tzinfo:
+    return dt.timezone(dt.timedelta(seconds=offset_s))
+
+
+def localizar(tzname: str, local: dt.datetime) -> dt.datetime:
+    """Hora local naive -> aware con offset fijo (equivalente a pytz localize)."""
+    return local.replace(tzinfo=tzinfo_fijo(offset_local(tzname, local)))
+
+
+def hora_local(tzname: str, now_utc: dt.datetime) -> dt.datetime:
+    """Instante UTC -> hora local naive de la zona."""
+    if now_utc.tzinfo is not None:
+        now_utc = now_utc.astimezone(dt.timezone.utc).replace(tzinfo=None)
+    return now_utc + dt.timedelta(seconds=offset_utc(tzname, now_utc))
+
+
+def fecha_local(tzname: str, now_utc: dt.datetime) -> dt.date:
+    return hora_local(tzname, now_utc).date()
+
+
+# ------------------ zona horaria por coordenadas ------------------
+
+_tf = None
+_tf_lock = threading.Lock()
+
+
+def _finder():
+    """TimezoneFinder compartido; se carga (≈0,5 s) la primera vez que hace falta."""
+    global _tf
+    if _tf is None:
+        with _tf_lock:
+            if _tf is None:
+                from timezonefinder import TimezoneFinder
+                _tf = TimezoneFinder(in_memory=True)
+    return _tf
+
+
+def _zona_exacta(lat: float, lon: float) -> str:
+    try:
+        return normalizar_tz(_finder().timezone_at(lat=lat, lng=lon) or "")
+    except Exception:
+        return TZ_DEFECTO
+
+
+@lru_cache(maxsize=65536)
+def _zona_de_celda(cell: str) -> str:
+    import h3
+    lat, lon = h3.h3_to_geo(cell)
+    return _zona_exacta(lat, lon)
+
+
+def zona_de_coords(lat: float, lon: float) -> str:
+    """
+    Zona horaria IANA de (lat, lon); TZ_DEFECTO si no se puede resolver.
+    Se resuelve en el centro de la celda H3 (TZ_H3_RES), así que las repeticiones
+    son O(1); solo a ~1 km de una frontera de zona puede salir la vecina.
+    """
+    try:
+        import h3
+        return _zona_de_celda(h3.geo_to_h3(float(lat), float(lon), TZ_H3_RES))
+    except Exception:
+        return _zona_exacta(float(lat), float(lon))